@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the main endpoints of the code submitter.
+
+A temporary SQLite database is seeded with a number of teams each having a
+number of archives, then the app is driven in-process over
+`httpx.ASGITransport`. Latency percentiles, throughput and peak memory are
+reported for each endpoint and can be saved as JSON for comparison with a
+later run. Peak memory is measured in a separate pass from the timed
+requests, since tracing allocations slows them considerably.
+"""
+
+from __future__ import annotations
+
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import zipfile
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from types import ModuleType
+from pathlib import Path
+from collections.abc import Callable, Coroutine
+from typing_extensions import TypedDict
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+BLUESHIRT = ('SRZ', 'blueshirt')
+PASSWORD = 'password'
+
+
+class ScenarioResult(TypedDict):
+    requests: int
+    concurrency: int
+    errors: int
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    throughput_rps: float
+    peak_memory_bytes: int
+
+
+class Results(TypedDict):
+    commit: str | None
+    timestamp: str
+    python: str
+    parameters: dict[str, int]
+    scenarios: dict[str, ScenarioResult]
+    max_rss_bytes: int
+
+
+def team_name(index: int) -> str:
+    return f'T{index:03d}'
+
+
+def make_archive(rng: random.Random, size: int) -> bytes:
+    contents = io.BytesIO()
+    with zipfile.ZipFile(contents, mode='w') as zf:
+        zf.writestr('robot.py', 'print("I am a robot")\n')
+        # Random content doesn't compress, so the archive is about `size`
+        zf.writestr('data.bin', rng.randbytes(size), zipfile.ZIP_DEFLATED)
+    return contents.getvalue()
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of the given sorted values.
+    """
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure(directory: Path, teams: int) -> None:
+    """
+    Configure the app to use a fresh database within the given directory.
+
+    This must happen before the app is imported.
+    """
+    from starlette.config import environ
+
+    credentials = {team_name(x): PASSWORD for x in range(teams)}
+    credentials[BLUESHIRT[0]] = BLUESHIRT[1]
+    credentials_file = directory / 'credentials.yml'
+    credentials_file.write_text(json.dumps(credentials))
+
+    environ['DATABASE_URL'] = f'sqlite:///{directory / "benchmark.db"}'
+    environ['AUTH_BACKEND'] = json.dumps({
+        'backend': 'code_submitter.auth.FileBackend',
+        'kwargs': {'path': str(credentials_file), 'reload_interval': 0},
+    })
+    environ['BUNDLE_CACHE_DIR'] = str(directory / 'bundles')
+
+    import alembic.command
+    from alembic.config import Config
+
+    alembic_config = Config(str(REPO_ROOT / 'alembic.ini'))
+    alembic_config.set_main_option('script_location', str(REPO_ROOT / 'migrations'))
+    alembic.command.upgrade(alembic_config, 'head')
+
+
+async def seed(
+    server: ModuleType,
+    rng: random.Random,
+    *,
+    teams: int,
+    archives: int,
+    archive_size: int,
+) -> dict[str, list[int]]:
+    """
+    Seed the database, returning the ids of each team's archives.
+    """
+    from code_submitter import uploads
+    from code_submitter.rules import ArchiveRules
+    from code_submitter.tables import Archive, ChoiceHistory
+
+    created = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    ids: dict[str, list[int]] = {}
+
+    for index in range(teams):
+        team = team_name(index)
+        for _ in range(archives):
+            content = make_archive(rng, archive_size)
+            sha256 = hashlib.sha256(content).hexdigest()
+            metadata = uploads.validate_archive(io.BytesIO(content), ArchiveRules())
+            await server.blob_store.put(sha256, io.BytesIO(content))
+
+            created += datetime.timedelta(minutes=1)
+            archive_id = await server.database.execute(Archive.insert().values(
+                sha256=sha256,
+                username=team,
+                team=team,
+                created=created,
+                size=len(content),
+                member_count=metadata.member_count,
+                uncompressed_size=metadata.uncompressed_size,
+                members=metadata.members,
+            ))
+            ids.setdefault(team, []).append(archive_id)
+
+        await server.database.execute(ChoiceHistory.insert().values(
+            archive_id=ids[team][-1],
+            username=team,
+            created=created,
+        ))
+
+    return ids
+
+
+Request = Callable[[int], Coroutine[None, None, httpx.Response]]
+
+
+async def run_scenario(
+    request: Request,
+    *,
+    count: int,
+    concurrency: int,
+    warmup: int,
+) -> ScenarioResult:
+    for index in range(warmup):
+        await asyncio.create_task(request(index))
+
+    latencies: list[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal errors, next_index
+        while next_index < count:
+            index = next_index
+            next_index += 1
+
+            start = time.perf_counter()
+            response = await request(warmup + index)
+            latencies.append(time.perf_counter() - start)
+
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # Tracing allocations slows requests several times over, so memory is
+    # measured in a separate pass of one concurrent request per worker.
+    tracemalloc.start()
+    try:
+        await asyncio.gather(*(
+            request(warmup + count + index)
+            for index in range(concurrency)
+        ))
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ordered = sorted(latencies)
+    return ScenarioResult(
+        requests=count,
+        concurrency=concurrency,
+        errors=errors,
+        mean_ms=1000 * sum(ordered) / len(ordered),
+        p50_ms=1000 * percentile(ordered, 0.5),
+        p90_ms=1000 * percentile(ordered, 0.9),
+        p99_ms=1000 * percentile(ordered, 0.99),
+        max_ms=1000 * ordered[-1],
+        throughput_rps=count / elapsed,
+        peak_memory_bytes=peak_memory,
+    )
+
+
+async def run_benchmarks(args: argparse.Namespace, directory: Path) -> Results:
+    configure(directory, args.teams)
+
+    from code_submitter import server, bundles
+
+    rng = random.Random(args.seed)
+
+    await server.database.connect()
+    try:
+        # The database's connections are task-local but inherited by child
+        # tasks, so do all database access in separate tasks (as a server
+        # would) to avoid the workers sharing one connection.
+        ids = await asyncio.create_task(seed(
+            server,
+            rng,
+            teams=args.teams,
+            archives=args.archives,
+            archive_size=args.archive_size,
+        ))
+
+        transport = httpx.ASGITransport(app=server.app)
+        client = httpx.AsyncClient(transport=transport, base_url='http://testserver')
+
+        def team_auth(index: int) -> tuple[str, str]:
+            return team_name(index % args.teams), PASSWORD
+
+        async def homepage(index: int) -> httpx.Response:
+            return await client.get('/', auth=team_auth(index))
+
+        upload_content = make_archive(rng, args.archive_size)
+
+        async def upload(index: int) -> httpx.Response:
+            # Vary the content so that each upload is stored
+            content = upload_content + index.to_bytes(8, 'big')
+            return await client.post(
+                '/upload',
+                auth=team_auth(index),
+                files={'archive': ('robot.zip', content, 'application/zip')},
+            )
+
+        async def archive(index: int) -> httpx.Response:
+            team, password = team_auth(index)
+            archive_id = ids[team][index % len(ids[team])]
+            return await client.get(f'/archive/{archive_id}', auth=(team, password))
+
+        async def download_submissions(index: int) -> httpx.Response:
+            return await client.get('/download-submissions', auth=BLUESHIRT)
+
+        async def download_submissions_uncached(index: int) -> httpx.Response:
+            server.bundle_cache = bundles.BundleCache(directory / f'bundles-{index}')
+            return await client.get('/download-submissions', auth=BLUESHIRT)
+
+        scenarios: dict[str, Request] = {
+            'homepage': homepage,
+            'archive': archive,
+            'download-submissions': download_submissions,
+            'download-submissions-uncached': download_submissions_uncached,
+            'upload': upload,
+        }
+
+        results = {}
+        async with client:
+            for name, request in scenarios.items():
+                if args.scenario and name not in args.scenario:
+                    continue
+
+                # Bundles are large, so use fewer requests
+                count = args.requests
+                if name.startswith('download-submissions'):
+                    count = max(1, count // 10)
+
+                results[name] = await run_scenario(
+                    request,
+                    count=count,
+                    concurrency=args.concurrency,
+                    warmup=args.warmup,
+                )
+                print_result(name, results[name])
+    finally:
+        await server.database.disconnect()
+
+    return Results(
+        commit=git_commit(),
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        python=platform.python_version(),
+        parameters={
+            'teams': args.teams,
+            'archives': args.archives,
+            'archive_size': args.archive_size,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+        },
+        scenarios=results,
+        # Note: kilobytes on Linux
+        max_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    )
+
+
+def print_result(name: str, result: ScenarioResult) -> None:
+    print(
+        f"{name:<30} "
+        f"p50 {result['p50_ms']:8.2f}ms  "
+        f"p90 {result['p90_ms']:8.2f}ms  "
+        f"p99 {result['p99_ms']:8.2f}ms  "
+        f"{result['throughput_rps']:8.1f} req/s  "
+        f"peak {result['peak_memory_bytes'] / 1024 / 1024:7.2f} MiB  "
+        f"errors {result['errors']}",
+    )
+
+
+def print_comparison(baseline: Results, results: Results) -> None:
+    print(f"\nCompared with {baseline['commit'] or 'baseline'}:")
+
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+
+        changes = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps', 'peak_memory_bytes'):
+            old = before[key]
+            new = result[key]
+            change = (new - old) / old * 100 if old else 0
+            changes.append(f"{key} {change:+6.1f}%")
+
+        print(f"{name:<30} " + "  ".join(changes))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--archives', type=int, default=10, help="Per team")
+    parser.add_argument(
+        '--archive-size',
+        type=int,
+        default=64 * 1024,
+        help="Approximate size of each archive, in bytes",
+    )
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=200,
+        help="Number of requests per scenario",
+    )
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        help="Only run the given scenario (may be repeated)",
+    )
+    parser.add_argument(
+        '--output',
+        type=Path,
+        help="Write the results as JSON to this file",
+    )
+    parser.add_argument(
+        '--compare',
+        type=Path,
+        help="Compare the results with those from a previous run",
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory(prefix='code-submitter-benchmark-') as tmp:
+        results = asyncio.run(run_benchmarks(args, Path(tmp)))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + '\n')
+
+    if args.compare:
+        baseline: Results = json.loads(args.compare.read_text())
+        print_comparison(baseline, results)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, str(REPO_ROOT))
+    main(parse_args())
@@ -1,24 +1,33 @@
 from __future__ import annotations
 
+import hmac
+import json
+import time
 import base64
 import logging
 import secrets
+import threading
 from typing import cast
 from pathlib import Path
-from collections.abc import Sequence
+from collections.abc import Callable, Sequence
 from typing_extensions import TypedDict
 
 import yaml
 import httpx
+from starlette.types import Send, Scope, ASGIApp, Message, Receive
 from starlette.requests import HTTPConnection
 from starlette.responses import Response
 from starlette.applications import Starlette
 from starlette.authentication import (
+    BaseUser,
     SimpleUser,
     AuthCredentials,
     AuthenticationError,
     AuthenticationBackend,
 )
+from starlette.datastructures import MutableHeaders
+
+from .caching import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -97,37 +106,60 @@ class NemesisUserInfo(TypedDict):
 
 
 class NemesisBackend(BasicAuthBackend):
+    """
+    Authentication backend which validates credentials against Nemesis.
+
+    Successful validations are cached for `cache_ttl` seconds so that
+    repeated requests don't each need a round trip to Nemesis. Passwords are
+    not held in the cache, only a hash of them salted with a per-process
+    secret.
+    """
+
     def __init__(
         self,
         app: Starlette | None = None,
         *,
         url: str,
         verify: bool = True,
+        cache_ttl: float = 300,
+        cache_size: int = 1024,
     ) -> None:
         self.client = httpx.AsyncClient(
             base_url=url,
             transport=httpx.ASGITransport(app=app) if app is not None else None,
             verify=verify,
         )
+        self.setup_cache(cache_ttl=cache_ttl, cache_size=cache_size)
+
+    def setup_cache(self, *, cache_ttl: float, cache_size: int) -> None:
+        self.cache: TTLCache[tuple[str, bytes], ValidationResult] = TTLCache(
+            max_size=cache_size,
+            ttl=cache_ttl,
+        )
+        self._cache_salt = secrets.token_bytes(32)
+
+    def cache_key(self, username: str, password: str) -> tuple[str, bytes]:
+        return username, hmac.digest(self._cache_salt, password.encode(), 'sha256')
 
     async def load_user(self, username: str, password: str) -> NemesisUserInfo:
-        async with self.client as client:
-            response = await client.get(
-                f'user/{username}',
-                auth=(username, password),
-            )
+        # Note: the client is shared between requests, so mustn't be used as
+        # a context manager (which would close it).
+        response = await self.client.get(
+            f'user/{username}',
+            auth=(username, password),
+        )
 
-            try:
-                response.raise_for_status()
-            except httpx.HTTPError as e:
-                if response.status_code != 403:
-                    logger.exception(
-                        "Failed to contact nemesis while trying to authenticate %r",
-                        username,
-                    )
-                raise AuthenticationError(e) from e
+        try:
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if response.status_code != 403:
+                logger.exception(
+                    "Failed to contact nemesis while trying to authenticate %r",
+                    username,
+                )
+            raise AuthenticationError(e) from e
 
-            return cast(NemesisUserInfo, response.json())
+        return cast(NemesisUserInfo, response.json())
 
     def strip_team(self, team: str) -> str:
         # All teams from nemesis *should* start with this prefix...
@@ -169,12 +201,19 @@ class NemesisBackend(BasicAuthBackend):
         if not password:
             raise AuthenticationError("Must provide a password")
 
+        key = self.cache_key(username, password)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
         info = await self.load_user(username, password)
 
         team = self.get_team(info)
         scopes = self.get_scopes(info)
 
-        return scopes, User(username, team)
+        result = scopes, User(username, team)
+        self.cache.put(key, result)
+        return result
 
 
 class DummyNemesisBackend(NemesisBackend):
@@ -199,8 +238,15 @@ class DummyNemesisBackend(NemesisBackend):
         }),
     ]
 
-    def __init__(self, data: list[NemesisUserInfo] = DEFAULT) -> None:
+    def __init__(
+        self,
+        data: list[NemesisUserInfo] = DEFAULT,
+        *,
+        cache_ttl: float = 300,
+        cache_size: int = 1024,
+    ) -> None:
         self.data = {x['username']: x for x in data}
+        self.setup_cache(cache_ttl=cache_ttl, cache_size=cache_size)
 
     async def load_user(self, username: str, password: str) -> NemesisUserInfo:
         try:
@@ -227,15 +273,82 @@ class FileBackend(BasicAuthBackend):
     UNKNOWN_USER_MESSAGE = "Username or password is incorrect"
     BLUESHIRT_TEAM = 'SRZ'
 
-    def __init__(self, *, path: str | Path) -> None:
-        with open(path) as f:
+    def __init__(self, *, path: str | Path, reload_interval: float = 5) -> None:
+        """
+        The credentials file is checked for changes every `reload_interval`
+        seconds by a background thread; changes are picked up without a
+        restart. A non-positive interval disables this.
+        """
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+
+        self._signature = self._stat()
+        self.credentials = self._load()
+
+        self._stopped = threading.Event()
+        self._watcher: threading.Thread | None = None
+        if reload_interval > 0:
+            self._watcher = threading.Thread(
+                target=self._watch,
+                name=f'FileBackend({self.path})',
+                daemon=True,
+            )
+            self._watcher.start()
+
+    def _stat(self) -> tuple[int, int, int] | None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self) -> dict[str, str]:
+        with open(self.path) as f:
             credentials = yaml.safe_load(f)
             if not isinstance(credentials, dict):
                 raise ValueError(
                     "Invalid credentials file contents (should be a mapping from "
                     " username to password).",
                 )
-            self.credentials = cast(dict[str, str], credentials)
+            return cast(dict[str, str], credentials)
+
+    def reload(self) -> bool:
+        """
+        Load the credentials file if it has changed since it was last loaded.
+
+        The new credentials replace the old ones in a single assignment, so
+        concurrent validations see either the old or the new credentials in
+        full. If the file is missing or invalid the current credentials are
+        kept. Returns whether the credentials were replaced.
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+
+        try:
+            credentials = self._load()
+        except (OSError, ValueError, yaml.YAMLError):
+            logger.exception("Failed to reload credentials from %s", self.path)
+            return False
+        finally:
+            # Don't retry a broken file until it changes again.
+            self._signature = signature
+
+        self.credentials = credentials
+        logger.info("Reloaded credentials from %s", self.path)
+        return True
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.reload_interval):
+            self.reload()
+
+    def close(self) -> None:
+        """
+        Stop watching the credentials file for changes.
+        """
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
 
     def get_scopes(self, username: str) -> list[str]:
         scopes = ['authenticated']
@@ -259,3 +372,147 @@ class FileBackend(BasicAuthBackend):
         if BLUESHIRT_SCOPE in scopes:
             return scopes, User('Blueshirt', None)
         return scopes, User(f'Team {username}', username)
+
+
+class SessionData(TypedDict):
+    # The username as given in the Basic auth credentials
+    login: str
+    username: str
+    team: str | None
+    scopes: list[str]
+    expires: float
+
+
+class SessionAuthBackend(AuthenticationBackend):
+    """
+    Authentication backend which remembers successful logins in a signed,
+    expiring cookie so that later requests don't need to be re-validated.
+
+    Requests without a valid session, or whose Basic auth credentials are for
+    a different user to their session, are authenticated by the wrapped
+    backend. Sessions are issued by `SessionCookieMiddleware` after the
+    wrapped backend succeeds.
+
+    Note: changes to a user's password or permissions only take effect once
+    their session expires.
+    """
+
+    COOKIE_NAME = 'code_submitter_session'
+    SCOPE_KEY = 'code_submitter.session'
+
+    def __init__(
+        self,
+        backend: AuthenticationBackend,
+        *,
+        secret_key: str,
+        max_age: int,
+        https_only: bool = False,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.backend = backend
+        self.secret_key = secret_key.encode()
+        self.max_age = max_age
+        self.https_only = https_only
+        self.clock = clock
+
+    def _signature(self, payload: bytes) -> bytes:
+        return hmac.digest(self.secret_key, payload, 'sha256')
+
+    def dump(self, session: SessionData) -> str:
+        payload = base64.urlsafe_b64encode(json.dumps(session).encode())
+        signature = base64.urlsafe_b64encode(self._signature(payload))
+        return f'{payload.decode()}.{signature.decode()}'
+
+    def load(self, token: str) -> SessionData | None:
+        payload, _, signature = token.encode().partition(b'.')
+
+        try:
+            expected = base64.urlsafe_b64decode(signature)
+        except ValueError:
+            return None
+
+        if not hmac.compare_digest(self._signature(payload), expected):
+            return None
+
+        session = cast(SessionData, json.loads(base64.urlsafe_b64decode(payload)))
+        if session['expires'] <= self.clock():
+            return None
+
+        return session
+
+    def cookie_header(self, token: str, path: str) -> str:
+        header = (
+            f'{self.COOKIE_NAME}={token}; Max-Age={self.max_age}; Path={path}; '
+            'HttpOnly; SameSite=lax'
+        )
+        if self.https_only:
+            header += '; Secure'
+        return header
+
+    def _login(self, auth_header: str | None) -> str | None:
+        if auth_header is None:
+            return None
+        try:
+            username, _ = extract_basic_auth(auth_header)
+        except AuthenticationError:
+            return None
+        return username
+
+    async def authenticate(
+        self,
+        request: HTTPConnection,
+    ) -> tuple[AuthCredentials, BaseUser] | None:
+        auth_header = request.headers.get('Authorization')
+        login = self._login(auth_header)
+
+        token = request.cookies.get(self.COOKIE_NAME)
+        session = self.load(token) if token else None
+        if session is not None and (auth_header is None or login == session['login']):
+            return (
+                AuthCredentials(session['scopes']),
+                User(session['username'], session['team']),
+            )
+
+        result = await self.backend.authenticate(request)
+        if result is None or login is None:
+            return result
+
+        credentials, user = result
+        if isinstance(user, User):
+            request.scope[self.SCOPE_KEY] = self.dump(SessionData(
+                login=login,
+                username=user.username,
+                team=user.team,
+                scopes=list(credentials.scopes),
+                expires=self.clock() + self.max_age,
+            ))
+
+        return result
+
+
+class SessionCookieMiddleware:
+    """
+    Middleware which sets the session cookie for requests which have been
+    issued a new session by a `SessionAuthBackend`.
+
+    This must wrap the `AuthenticationMiddleware` which uses the backend.
+    """
+
+    def __init__(self, app: ASGIApp, *, backend: SessionAuthBackend) -> None:
+        self.app = app
+        self.backend = backend
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            token = scope.get(self.backend.SCOPE_KEY)
+            if message['type'] == 'http.response.start' and token:
+                path = scope.get('root_path') or '/'
+                headers = MutableHeaders(scope=message)
+                headers.append('Set-Cookie', self.backend.cookie_header(token, path))
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
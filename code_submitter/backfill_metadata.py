@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Fill in the metadata of archives which were uploaded before it was captured
+at upload time.
+"""
+
+from __future__ import annotations
+
+import io
+import asyncio
+import argparse
+from typing import NamedTuple
+
+import databases
+from sqlalchemy.sql import func, select
+
+from . import config, uploads
+from .rules import ArchiveRules
+from .tables import Archive
+from .storage import BlobStore
+
+
+class BackfillResult(NamedTuple):
+    updated: int
+    # Reasons that content wasn't valid, by SHA-256
+    skipped: dict[str, str]
+
+
+async def backfill_metadata(
+    database: databases.Database,
+    blob_store: BlobStore,
+) -> BackfillResult:
+    """
+    Fill in the metadata of archives which don't have it, returning the number
+    of archives updated and the content which was skipped as invalid.
+
+    Content is loaded once for each distinct SHA-256, however many archives
+    share it.
+    """
+    hashes = await database.fetch_all(
+        select([
+            Archive.c.sha256,
+            func.count().label('count'),
+        ]).where(
+            Archive.c.member_count.is_(None),
+        ).group_by(
+            Archive.c.sha256,
+        ),
+    )
+
+    # The archives were checked against the rules in force when they were
+    # uploaded, so don't hold them to the current ones.
+    rules = ArchiveRules()
+
+    updated = 0
+    skipped = {}
+    for row in hashes:
+        sha256 = row['sha256']
+        content = await blob_store.get(sha256)
+
+        try:
+            metadata = uploads.validate_archive(io.BytesIO(content), rules)
+        except uploads.InvalidArchive as e:
+            skipped[sha256] = str(e)
+            continue
+
+        await database.execute(
+            Archive.update().where(
+                Archive.c.sha256 == sha256,
+            ).where(
+                Archive.c.member_count.is_(None),
+            ).values(
+                size=len(content),
+                member_count=metadata.member_count,
+                uncompressed_size=metadata.uncompressed_size,
+                members=metadata.members,
+            ),
+        )
+        updated += row['count']
+
+    return BackfillResult(updated, skipped)
+
+
+async def async_main() -> None:
+    database = databases.Database(config.DATABASE_URL)
+    blob_store = config.get_blob_store(database)
+
+    async with database:
+        result = await backfill_metadata(database, blob_store)
+
+    for sha256, reason in result.skipped.items():
+        print(f"Skipping {sha256}: {reason}")
+    print(f"Updated {result.updated} archives")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    asyncio.get_event_loop().run_until_complete(async_main())
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import os
+import asyncio
+import hashlib
+import tempfile
+from typing import IO
+from pathlib import Path
+from collections.abc import Mapping, AsyncIterator
+
+from starlette.concurrency import run_in_threadpool
+
+from . import utils
+from .storage import BlobStore, STREAM_CHUNK_SIZE
+
+
+def bundle_key(archives: Mapping[str, utils.ChosenArchive]) -> str:
+    """
+    Compute a key identifying the bundle of the given archives.
+
+    Archives are never modified once uploaded and bundles are built
+    deterministically, so the bundle's content is determined entirely by
+    which archive each team has chosen.
+    """
+    summary = utils.summarise({
+        team: (info['archive_id'], None)
+        for team, info in archives.items()
+    })
+    return hashlib.sha256(summary.encode()).hexdigest()
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    candidates = [x.strip() for x in if_none_match.split(',')]
+    if '*' in candidates:
+        return True
+    return any(x.removeprefix('W/') == etag for x in candidates)
+
+
+async def _stream_file(file: IO[bytes]) -> AsyncIterator[bytes]:
+    try:
+        while chunk := await run_in_threadpool(file.read, STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+class BundleCache:
+    """
+    Cache of the most recently built bundle of chosen archives, on local disk.
+
+    A bundle is built at most once for each set of chosen archives: the first
+    request for a new set streams the bundle to the client while also writing
+    it to the cache, later requests for the same set are served from the
+    cached file. Requests which arrive while the bundle is being built wait
+    for it to be cached rather than building it again.
+    """
+
+    def __init__(self, directory: str | Path | None = None) -> None:
+        self._directory = Path(directory) if directory is not None else None
+        self._current: tuple[str, Path] | None = None
+        self._building: dict[str, asyncio.Event] = {}
+
+    @property
+    def directory(self) -> Path:
+        if self._directory is None:
+            self._directory = Path(tempfile.mkdtemp(prefix='code-submitter-bundles-'))
+        self._directory.mkdir(parents=True, exist_ok=True)
+        return self._directory
+
+    def _open_cached(self, key: str) -> IO[bytes] | None:
+        if self._current is None:
+            return None
+
+        current_key, path = self._current
+        if current_key != key:
+            return None
+
+        try:
+            return path.open('rb')
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, key: str, tmp: Path) -> None:
+        path = self.directory / f'bundle-{key}.zip'
+        os.replace(tmp, path)
+
+        previous, self._current = self._current, (key, path)
+
+        # Any requests still streaming the previous bundle hold it open, so
+        # it's safe to remove it.
+        if previous is not None and previous[1] != path:
+            previous[1].unlink(missing_ok=True)
+
+    async def _build(
+        self,
+        key: str,
+        archives: Mapping[str, utils.ChosenArchive],
+        blob_store: BlobStore,
+    ) -> AsyncIterator[bytes]:
+        fd, name = tempfile.mkstemp(dir=self.directory, suffix='.zip.tmp')
+        published = False
+        try:
+            with open(fd, 'wb') as tmp:
+                async for chunk in utils.stream_bundle(archives, blob_store):
+                    await run_in_threadpool(tmp.write, chunk)
+                    yield chunk
+
+            self._publish(key, Path(name))
+            published = True
+        finally:
+            if not published:
+                os.unlink(name)
+
+    async def _build_once(
+        self,
+        key: str,
+        archives: Mapping[str, utils.ChosenArchive],
+        blob_store: BlobStore,
+    ) -> AsyncIterator[bytes]:
+        # Wait for any build of the same bundle which is already in progress.
+        # If that build fails, or is abandoned by its client, this one takes
+        # over building the bundle.
+        while (building := self._building.get(key)) is not None:
+            await building.wait()
+
+            cached = await run_in_threadpool(self._open_cached, key)
+            if cached is not None:
+                async for chunk in _stream_file(cached):
+                    yield chunk
+                return
+
+        self._building[key] = building = asyncio.Event()
+        try:
+            async for chunk in self._build(key, archives, blob_store):
+                yield chunk
+        finally:
+            del self._building[key]
+            building.set()
+
+    async def stream(
+        self,
+        key: str,
+        archives: Mapping[str, utils.ChosenArchive],
+        blob_store: BlobStore,
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream the bundle of the given archives, which must be identified by
+        the given key, building it only if it is not already cached.
+        """
+        cached = await run_in_threadpool(self._open_cached, key)
+        if cached is not None:
+            return _stream_file(cached)
+
+        return self._build_once(key, archives, blob_store)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import time
+import threading
+from typing import Generic, TypeVar
+from collections import OrderedDict
+from collections.abc import Callable
+
+G = TypeVar('G')
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A bounded in-memory cache whose entries expire a fixed time after they
+    are stored.
+
+    When full, the least recently used entry is evicted. Counts of hits and
+    misses are kept so that the effectiveness of the cache can be observed.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires <= self.clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class GroupedTTLCache(Generic[G, K, V]):
+    """
+    A `TTLCache` whose entries each belong to a group, all of whose entries
+    can be invalidated at once.
+
+    Invalidating a group advances its generation, and entries stored under an
+    earlier generation are no longer returned. Callers should note the
+    generation before loading a value and pass it to `put`, so that a value
+    loaded concurrently with an invalidation (which may therefore be stale) is
+    not stored. A generation is kept for each group ever invalidated, so the
+    number of groups should be small.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: TTLCache[tuple[G, K], tuple[int, V]] = TTLCache(
+            max_size=max_size,
+            ttl=ttl,
+            clock=clock,
+        )
+        self._generations: dict[G, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def generation(self, group: G) -> int:
+        with self._lock:
+            return self._generations.get(group, 0)
+
+    def get(self, group: G, key: K) -> V | None:
+        entry = self._entries.get((group, key))
+        if entry is not None:
+            generation, value = entry
+            if generation == self.generation(group):
+                self.hits += 1
+                return value
+            self._entries.discard((group, key))
+
+        self.misses += 1
+        return None
+
+    def put(self, group: G, key: K, value: V, *, generation: int) -> None:
+        with self._lock:
+            if generation != self._generations.get(group, 0):
+                return
+            self._entries.put((group, key), (generation, value))
+
+    def invalidate(self, group: G) -> None:
+        with self._lock:
+            self._generations[group] = self._generations.get(group, 0) + 1
@@ -7,8 +7,14 @@ from typing import cast, TypeVar
 from collections.abc import Mapping
 from typing_extensions import TypedDict
 
+import databases
 from starlette.config import Config
 from starlette.authentication import AuthenticationBackend
+from starlette.datastructures import Secret
+
+from .pool import PoolOptions, production_pragmas
+from .rules import ArchiveRules
+from .storage import BlobStore
 
 T = TypeVar('T')
 
@@ -44,8 +50,26 @@ def get_auth_backend() -> AuthenticationBackend:
     return backend(**AUTH_BACKEND['kwargs'])
 
 
-def load_required_files_in_archive(raw: str) -> list[str]:
-    return raw.split(os.path.pathsep)
+class BlobStoreConfig(TypedDict):
+    backend: type[BlobStore]
+    kwargs: Mapping[str, object]
+
+
+def load_blob_store(raw: str) -> BlobStoreConfig:
+    data = json.loads(raw)
+    return BlobStoreConfig({
+        'backend': load_class(data['backend'], BlobStore),
+        'kwargs': data.get('kwargs', {}),
+    })
+
+
+def get_blob_store(database: databases.Database) -> BlobStore:
+    backend = BLOB_STORE['backend']
+    return backend(database, **BLOB_STORE['kwargs'])
+
+
+def load_file_patterns(raw: str) -> list[str]:
+    return [x for x in raw.split(os.path.pathsep) if x]
 
 
 config = Config('.env')
@@ -53,14 +77,146 @@ config = Config('.env')
 DATABASE_URL: str = config('DATABASE_URL', default='sqlite:///sqlite.db')
 TESTING: bool = config('TESTING', cast=bool, default=False)
 
+# Optional replica of the database from which read-only requests are served.
+# Clients which have uploaded within the last READ_YOUR_WRITES_WINDOW seconds
+# read from the primary instead, so that they see their upload regardless of
+# replication lag.
+READ_DATABASE_URL: str | None = config('READ_DATABASE_URL', default=None)
+READ_YOUR_WRITES_WINDOW: int = config('READ_YOUR_WRITES_WINDOW', cast=int, default=30)
+
+# Each worker keeps between the minimum and maximum number of connections to
+# the database open. Requests which would need more wait up to the acquire
+# timeout (in seconds) for a connection to become free before failing with a
+# 503. Connections are re-opened once they are older than the recycle age in
+# seconds, if set (for PostgreSQL, once they have been idle that long). The
+# timeout and recycling apply only to SQLite and PostgreSQL; other databases
+# use their driver's own pool.
+DATABASE_POOL = PoolOptions(
+    min_size=config('DATABASE_POOL_MIN_SIZE', cast=int, default=1),
+    max_size=config('DATABASE_POOL_MAX_SIZE', cast=int, default=10),
+    acquire_timeout=config('DATABASE_POOL_ACQUIRE_TIMEOUT', cast=float, default=5),
+    recycle=config('DATABASE_POOL_RECYCLE', cast=float, default=None),
+)
+
+# Tune SQLite for serving concurrent requests, see `pool.production_pragmas`.
+# Recommended when running with SQLite for anything other than development.
+SQLITE_PRODUCTION_MODE: bool = config(
+    'SQLITE_PRODUCTION_MODE',
+    cast=bool,
+    default=False,
+)
+SQLITE_BUSY_TIMEOUT: float = config('SQLITE_BUSY_TIMEOUT', cast=float, default=5)
+SQLITE_MMAP_SIZE: int = config(
+    'SQLITE_MMAP_SIZE',
+    cast=int,
+    default=256 * 1024 * 1024,
+)
+
+if SQLITE_PRODUCTION_MODE:
+    DATABASE_POOL['pragmas'] = production_pragmas(
+        busy_timeout=SQLITE_BUSY_TIMEOUT,
+        mmap_size=SQLITE_MMAP_SIZE,
+    )
+
+# Database queries taking at least this many seconds are logged.
+SLOW_QUERY_THRESHOLD: float = config('SLOW_QUERY_THRESHOLD', cast=float, default=0.5)
+
+# Whether to tell clients how long their requests spent in the database, via a
+# `Server-Timing` header.
+SERVER_TIMING: bool = config('SERVER_TIMING', cast=bool, default=True)
+
 AUTH_BACKEND: AuthConfig = config(
     'AUTH_BACKEND',
     load_auth_backend,
     json.dumps({'backend': 'code_submitter.auth.DummyBackend'}),
 )
 
+BLOB_STORE: BlobStoreConfig = config(
+    'BLOB_STORE',
+    load_blob_store,
+    json.dumps({'backend': 'code_submitter.storage.DatabaseBlobStore'}),
+)
+
+# When set, successful logins are remembered in a cookie signed with this key
+# so that later requests don't need to be re-validated by the AUTH_BACKEND.
+SESSION_SECRET_KEY: Secret | None = config(
+    'SESSION_SECRET_KEY',
+    cast=Secret,
+    default=None,
+)
+SESSION_MAX_AGE: int = config('SESSION_MAX_AGE', cast=int, default=60 * 60)
+SESSION_HTTPS_ONLY: bool = config('SESSION_HTTPS_ONLY', cast=bool, default=False)
+
+# Glob patterns, separated by `os.pathsep`, for files which uploaded archives
+# must and must not contain. See `rules.translate_glob` for the syntax.
 REQUIRED_FILES_IN_ARCHIVE: list[str] = config(
     'REQUIRED_FILES_IN_ARCHIVE',
-    load_required_files_in_archive,
+    load_file_patterns,
     'robot.py',
 )
+FORBIDDEN_FILES_IN_ARCHIVE: list[str] = config(
+    'FORBIDDEN_FILES_IN_ARCHIVE',
+    load_file_patterns,
+    '',
+)
+
+# Limits on the content of uploaded archives, guarding against ZIP bombs.
+MAX_ARCHIVE_MEMBERS: int = config('MAX_ARCHIVE_MEMBERS', cast=int, default=10_000)
+MAX_ARCHIVE_UNCOMPRESSED_SIZE: int = config(
+    'MAX_ARCHIVE_UNCOMPRESSED_SIZE',
+    cast=int,
+    default=512 * 1024 * 1024,
+)
+MAX_ARCHIVE_COMPRESSION_RATIO: float = config(
+    'MAX_ARCHIVE_COMPRESSION_RATIO',
+    cast=float,
+    default=100,
+)
+
+ARCHIVE_RULES = ArchiveRules(
+    required_files=REQUIRED_FILES_IN_ARCHIVE,
+    forbidden_files=FORBIDDEN_FILES_IN_ARCHIVE,
+    max_members=MAX_ARCHIVE_MEMBERS,
+    max_uncompressed_size=MAX_ARCHIVE_UNCOMPRESSED_SIZE,
+    max_compression_ratio=MAX_ARCHIVE_COMPRESSION_RATIO,
+)
+
+MAX_ARCHIVE_SIZE: int = config(
+    'MAX_ARCHIVE_SIZE',
+    cast=int,
+    default=64 * 1024 * 1024,
+)
+
+# At most this many uploads are processed at once by each worker, further
+# uploads being rejected with a 503.
+MAX_CONCURRENT_UPLOADS: int = config('MAX_CONCURRENT_UPLOADS', cast=int, default=8)
+
+# Maximum number of parts (files and fields) in an upload form.
+MAX_UPLOAD_PARTS: int = config('MAX_UPLOAD_PARTS', cast=int, default=4)
+
+# Uploaded archives are inspected in a pool of this many threads, each archive
+# being allowed at most this many seconds (including any wait for a thread).
+ARCHIVE_INSPECTION_WORKERS: int = config(
+    'ARCHIVE_INSPECTION_WORKERS',
+    cast=int,
+    default=4,
+)
+ARCHIVE_INSPECTION_TIMEOUT: float = config(
+    'ARCHIVE_INSPECTION_TIMEOUT',
+    cast=float,
+    default=10,
+)
+
+UPLOADS_PAGE_SIZE: int = config('UPLOADS_PAGE_SIZE', cast=int, default=20)
+
+# Each team's homepage data (their chosen archive and the first page of
+# uploads) is cached for at most this many seconds, in up to this many entries
+# (one per user). Uploads clear their team's entries, though only in the
+# worker which received the upload; other workers may show stale data for up
+# to the TTL. Set the size to 0 to disable the cache.
+HOMEPAGE_CACHE_SIZE: int = config('HOMEPAGE_CACHE_SIZE', cast=int, default=256)
+HOMEPAGE_CACHE_TTL: float = config('HOMEPAGE_CACHE_TTL', cast=float, default=10)
+
+# Directory in which to cache the bundle of chosen submissions. A temporary
+# directory is used if not set.
+BUNDLE_CACHE_DIR: str | None = config('BUNDLE_CACHE_DIR', default=None)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Copy archive content from the database's `blob` table into the configured
+blob store. Use this when moving an existing deployment to a different
+`BLOB_STORE`.
+"""
+
+from __future__ import annotations
+
+import io
+import asyncio
+import argparse
+
+import databases
+from sqlalchemy.sql import select
+
+from . import config
+from .tables import Blob
+from .storage import BlobStore
+
+
+async def copy_blobs(database: databases.Database, blob_store: BlobStore) -> int:
+    """
+    Copy the content in the database's `blob` table into the given blob store,
+    returning the number of blobs copied.
+
+    Blobs which the store already has are skipped, so this can be re-run
+    safely, for example after being interrupted.
+    """
+    hashes = await database.fetch_all(select([Blob.c.sha256]))
+
+    copied = 0
+    for row in hashes:
+        sha256 = row['sha256']
+        if await blob_store.contains(sha256):
+            continue
+
+        content = await database.fetch_val(
+            select([Blob.c.content]).where(Blob.c.sha256 == sha256),
+        )
+        await blob_store.put(sha256, io.BytesIO(content))
+        copied += 1
+
+    return copied
+
+
+async def async_main() -> None:
+    database = databases.Database(config.DATABASE_URL)
+    blob_store = config.get_blob_store(database)
+
+    async with database:
+        copied = await copy_blobs(database, blob_store)
+
+    print(f"Copied {copied} blobs")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    asyncio.get_event_loop().run_until_complete(async_main())
+
+
+if __name__ == '__main__':
+    main(parse_args())
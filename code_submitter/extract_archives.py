@@ -2,34 +2,399 @@
 
 from __future__ import annotations
 
+import os
+import re
+import sys
+import json
+import stat
+import shutil
 import asyncio
 import zipfile
 import argparse
-from pathlib import Path
+import tempfile
+import contextlib
+from pathlib import Path, PurePosixPath
+from collections.abc import Mapping, Iterator
+from concurrent.futures import ProcessPoolExecutor
 
 import databases
 
 from . import utils, config
+from .storage import BlobStore, STREAM_CHUNK_SIZE
 
 
-async def async_main(output_archive: Path) -> None:
+def default_manifest_path(output_archive: Path) -> Path:
+    return output_archive.with_name(output_archive.name + '.manifest.json')
+
+
+def load_manifest(path: Path) -> dict[str, utils.ChosenArchive] | None:
+    """
+    Load the manifest of a previous export, if there is a valid one.
+    """
+    try:
+        with path.open() as f:
+            data = json.load(f)
+        return {
+            team: utils.ChosenArchive(
+                archive_id=int(info['archive_id']),
+                sha256=str(info['sha256']),
+            )
+            for team, info in data['teams'].items()
+        }
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def write_manifest(path: Path, archives: Mapping[str, utils.ChosenArchive]) -> None:
+    content = json.dumps({'teams': archives}, indent=2, sort_keys=True) + '\n'
+
+    with tempfile.NamedTemporaryFile(
+        mode='w',
+        dir=path.parent,
+        prefix=path.name,
+        suffix='.tmp',
+        delete=False,
+    ) as tmp:
+        tmp.write(content)
+
+    os.replace(tmp.name, path)
+
+
+@contextlib.contextmanager
+def _open_previous(
+    output_archive: Path,
+    manifest: Path,
+) -> Iterator[utils.PreviousSubmissions | None]:
+    archives = load_manifest(manifest)
+    if archives is None:
+        yield None
+        return
+
+    try:
+        zf = zipfile.ZipFile(output_archive)
+    except (OSError, zipfile.BadZipFile):
+        yield None
+        return
+
+    with zf:
+        yield utils.PreviousSubmissions(zf, archives)
+
+
+async def export(
+    database: databases.Database,
+    blob_store: BlobStore,
+    output_archive: Path,
+    *,
+    manifest: Path,
+    incremental: bool = False,
+) -> tuple[int, int]:
+    """
+    Export the chosen archives to the given file, along with a manifest of
+    which archives were exported.
+
+    When `incremental`, archives which are unchanged since the export
+    described by the manifest are copied from the previous output rather than
+    loaded from the blob store, and the output is not rewritten at all if no
+    choices have changed.
+
+    Returns the number of archives exported and how many of those were
+    reused from the previous export.
+    """
     output_archive.parent.mkdir(parents=True, exist_ok=True)
 
+    archives = await utils.get_chosen_archives(database)
+
+    with contextlib.ExitStack() as stack:
+        previous = None
+        if incremental:
+            previous = stack.enter_context(_open_previous(output_archive, manifest))
+
+        reused = 0
+        if previous is not None:
+            reused = sum(
+                1
+                for team, info in archives.items()
+                if previous.archives.get(team) == info
+            )
+            if archives == previous.archives:
+                return len(archives), reused
+
+        with tempfile.NamedTemporaryFile(
+            dir=output_archive.parent,
+            prefix=output_archive.name,
+            suffix='.tmp',
+            delete=False,
+        ) as tmp:
+            try:
+                with zipfile.ZipFile(tmp, mode='w') as zf:
+                    await utils.write_submissions(archives, blob_store, zf, previous)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+    # Replace the output before the manifest, so that the manifest never
+    # describes content which the output doesn't have.
+    os.replace(tmp.name, output_archive)
+    write_manifest(manifest, archives)
+
+    return len(archives), reused
+
+
+class UnsafeArchive(ValueError):
+    pass
+
+
+class ExtractionFailed(Exception):
+    def __init__(self, errors: Mapping[str, BaseException]) -> None:
+        super().__init__("Failed to extract archives:\n" + "\n".join(
+            f"  {team}: {error}"
+            for team, error in sorted(errors.items())
+        ))
+        self.errors = errors
+
+
+def _member_path(name: str) -> PurePosixPath:
+    path = PurePosixPath(name)
+    if (
+        path.is_absolute() or
+        '..' in path.parts or
+        '\\' in name or
+        # Windows drive letters
+        ':' in name
+    ):
+        raise UnsafeArchive(f"Unsafe path {name!r}")
+    return path
+
+
+def extract_archive(source: str, destination: str, max_size: int | None) -> int:
+    """
+    Extract the ZIP file at `source` into the directory `destination`,
+    returning the number of files extracted.
+
+    Members whose paths would escape the destination, and symlinks, are
+    rejected. Content is extracted up to `max_size` bytes in total, counting
+    what is actually decompressed rather than the sizes claimed by the
+    archive.
+
+    This runs in worker processes, so takes and returns only simple types.
+    """
+    root = Path(destination)
+    written = 0
+    count = 0
+
+    with zipfile.ZipFile(source) as zf:
+        for info in zf.infolist():
+            path = _member_path(info.filename)
+            if stat.S_ISLNK(info.external_attr >> 16):
+                raise UnsafeArchive(f"Symlinks are not supported: {info.filename!r}")
+
+            target = root.joinpath(*path.parts)
+            if info.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with zf.open(info) as src, target.open('xb') as dest:
+                while chunk := src.read(STREAM_CHUNK_SIZE):
+                    written += len(chunk)
+                    if max_size is not None and written > max_size:
+                        raise UnsafeArchive(
+                            f"Content exceeds the maximum of {max_size} bytes",
+                        )
+                    dest.write(chunk)
+            count += 1
+
+    return count
+
+
+def _team_directory_name(team: str) -> str:
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', team):
+        raise ValueError(f"Unsafe team name {team!r}")
+    return team.upper()
+
+
+async def _extract_team(
+    pool: ProcessPoolExecutor,
+    limit: asyncio.Semaphore,
+    blob_store: BlobStore,
+    output_dir: Path,
+    team: str,
+    info: utils.ChosenArchive,
+    max_size: int | None,
+) -> None:
+    destination = output_dir / _team_directory_name(team)
+
+    # Only fetch an archive once there's a worker free to extract it, so that
+    # we don't load every team's archive at once.
+    async with limit:
+        with contextlib.ExitStack() as stack:
+            source = blob_store.local_path(info['sha256'])
+            if source is None:
+                tmp = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.zip'))
+                async for chunk in blob_store.stream(info['sha256']):
+                    tmp.write(chunk)
+                tmp.flush()
+                source = Path(tmp.name)
+
+            # Extract alongside the final location and then swap into place, so
+            # that a failed extraction doesn't leave partial content.
+            staging = Path(tempfile.mkdtemp(
+                dir=output_dir,
+                prefix=f'.{destination.name}-',
+            ))
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    pool,
+                    extract_archive,
+                    str(source),
+                    str(staging),
+                    max_size,
+                )
+            except BaseException:
+                shutil.rmtree(staging)
+                raise
+
+        if destination.exists():
+            shutil.rmtree(destination)
+        os.replace(staging, destination)
+
+
+async def extract_to_directory(
+    database: databases.Database,
+    blob_store: BlobStore,
+    output_dir: Path,
+    *,
+    workers: int | None = None,
+    max_size: int | None = None,
+) -> dict[str, utils.ChosenArchive]:
+    """
+    Extract each team's chosen archive into its own directory within the
+    given directory, alongside a `summary.txt`. Archives are decompressed in
+    parallel in a pool of worker processes, fetching at most one archive per
+    worker at a time.
+
+    Returns the archives which were extracted. If any archive can't be
+    extracted the others are still extracted, then `ExtractionFailed` is
+    raised.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    archives = await utils.get_chosen_archives(database)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    limit = asyncio.Semaphore(workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = await asyncio.gather(
+            *(
+                _extract_team(
+                    pool,
+                    limit,
+                    blob_store,
+                    output_dir,
+                    team,
+                    info,
+                    max_size,
+                )
+                for team, info in sorted(archives.items())
+            ),
+            return_exceptions=True,
+        )
+
+    errors = {
+        team: result
+        for team, result in zip(sorted(archives), results)
+        if isinstance(result, BaseException)
+    }
+    extracted = {
+        team: info
+        for team, info in archives.items()
+        if team not in errors
+    }
+
+    (output_dir / 'summary.txt').write_text(utils.summarise({
+        team: (info['archive_id'], None)
+        for team, info in extracted.items()
+    }))
+
+    if errors:
+        raise ExtractionFailed(errors)
+
+    return extracted
+
+
+async def async_main(args: argparse.Namespace) -> None:
     database = databases.Database(config.DATABASE_URL)
+    blob_store = config.get_blob_store(database)
+
+    async with database:
+        if args.directory:
+            extracted = await extract_to_directory(
+                database,
+                blob_store,
+                args.output,
+                workers=args.workers,
+                max_size=config.MAX_ARCHIVE_UNCOMPRESSED_SIZE,
+            )
+            print(f"Extracted {len(extracted)} archives")
+            return
 
-    with zipfile.ZipFile(output_archive) as zf:
-        async with database.transaction():
-            await utils.collect_submissions(database, zf)
+        exported, reused = await export(
+            database,
+            blob_store,
+            args.output,
+            manifest=args.manifest or default_manifest_path(args.output),
+            incremental=args.incremental,
+        )
+
+    print(f"Exported {exported} archives ({reused} unchanged)")
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
-    parser.add_argument('output_archive', type=Path)
+    parser.add_argument(
+        'output',
+        type=Path,
+        help="The ZIP file to write, or with --directory the directory to extract to",
+    )
+
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--incremental',
+        action='store_true',
+        help=(
+            "Only load archives which have changed since the previous export "
+            "to the same output, as recorded in its manifest"
+        ),
+    )
+    mode.add_argument(
+        '--directory',
+        action='store_true',
+        help="Extract each team's archive into its own directory within the output",
+    )
+
+    parser.add_argument(
+        '--manifest',
+        type=Path,
+        help="Path of the manifest (default: alongside the output archive)",
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help=(
+            "Number of processes to extract archives with when using "
+            "--directory (default: the number of CPUs)"
+        ),
+    )
     return parser.parse_args()
 
 
 def main(args: argparse.Namespace) -> None:
-    asyncio.get_event_loop().run_until_complete(async_main(args.output_archive))
+    try:
+        asyncio.get_event_loop().run_until_complete(async_main(args))
+    except ExtractionFailed as e:
+        sys.exit(str(e))
 
 
 if __name__ == '__main__':
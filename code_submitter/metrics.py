@@ -0,0 +1,645 @@
+from __future__ import annotations
+
+import math
+import time
+import bisect
+import logging
+import threading
+import contextlib
+from typing import Protocol, NamedTuple
+from contextvars import ContextVar
+from collections.abc import Callable, Iterator, Sequence
+
+import databases
+from sqlalchemy.sql import ClauseElement
+from starlette.types import Send, Scope, ASGIApp, Message, Receive
+from starlette.routing import Match, BaseRoute
+from starlette.requests import HTTPConnection
+from starlette.authentication import (
+    BaseUser,
+    AuthCredentials,
+    AuthenticationError,
+    AuthenticationBackend,
+)
+from starlette.datastructures import MutableHeaders
+
+from .pool import PoolOptions, PooledDatabase
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1,
+    2.5,
+    5,
+    7.5,
+    10,
+)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'),
+        )
+        for name, value in zip(names, values)
+    ) + '}'
+
+
+class Metric:
+    """
+    A named metric, with a value for each combination of its labels, which
+    can be rendered in the Prometheus text exposition format.
+    """
+
+    type_: str
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name!r} has labels {self.labelnames!r}, "
+                f"not {tuple(labels)!r}",
+            )
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def samples(self) -> Iterator[tuple[str, Sequence[str], LabelValues, float]]:
+        """
+        Yield the name, label names, label values and value of each sample.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_}',
+        ]
+        with self._lock:
+            samples = list(self.samples())
+        lines.extend(
+            f'{name}{_format_labels(names, values)} {_format_value(value)}'
+            for name, names, values, value in samples
+        )
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterator[tuple[str, Sequence[str], LabelValues, float]]:
+        for key, value in sorted(self._values.items()):
+            yield self.name, self.labelnames, key, value
+
+
+class _HistogramValue:
+    def __init__(self, buckets: int) -> None:
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+        self._values: dict[LabelValues, _HistogramValue] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        # The upper bounds are inclusive, with a final implicit +Inf bucket
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            try:
+                histogram = self._values[key]
+            except KeyError:
+                histogram = self._values[key] = _HistogramValue(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        histogram = self._values.get(self._label_values(labels))
+        return 0 if histogram is None else histogram.count
+
+    def samples(self) -> Iterator[tuple[str, Sequence[str], LabelValues, float]]:
+        bucket_labelnames = (*self.labelnames, 'le')
+        bounds = [*self.buckets, math.inf]
+
+        for key, histogram in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket',
+                    bucket_labelnames,
+                    (*key, _format_value(bound)),
+                    cumulative,
+                )
+            yield f'{self.name}_sum', self.labelnames, key, histogram.sum
+            yield f'{self.name}_count', self.labelnames, key, histogram.count
+
+
+class CallbackMetric(Metric):
+    """
+    A metric without labels whose value is read from a function when the
+    metric is rendered.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        *,
+        type_: str,
+        function: Callable[[], float],
+    ) -> None:
+        super().__init__(name, documentation)
+        self.type_ = type_
+        self.function = function
+
+    def samples(self) -> Iterator[tuple[str, Sequence[str], LabelValues, float]]:
+        yield self.name, (), (), self.function()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return ''.join(x.render() for x in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = Histogram(
+    'code_submitter_request_duration_seconds',
+    "Time taken to handle HTTP requests, by route.",
+    ('method', 'route', 'status'),
+)
+UPLOAD_BYTES = Counter(
+    'code_submitter_upload_bytes_total',
+    "Total size of archives received.",
+)
+UPLOAD_SIZE = Histogram(
+    'code_submitter_upload_size_bytes',
+    "Size of archives received.",
+    buckets=[1024 * 4 ** x for x in range(10)],
+)
+UPLOAD_REJECTIONS = Counter(
+    'code_submitter_upload_rejections_total',
+    "Uploads which were rejected, by reason.",
+    ('reason',),
+)
+AUTH_DURATION = Histogram(
+    'code_submitter_auth_duration_seconds',
+    "Time taken by the authentication backend, by outcome.",
+    ('result',),
+)
+DB_QUERY_DURATION = Histogram(
+    'code_submitter_db_query_duration_seconds',
+    "Time taken by database queries, by operation.",
+    ('operation',),
+)
+
+for _metric in (
+    REQUEST_DURATION,
+    UPLOAD_BYTES,
+    UPLOAD_SIZE,
+    UPLOAD_REJECTIONS,
+    AUTH_DURATION,
+    DB_QUERY_DURATION,
+):
+    REGISTRY.register(_metric)
+
+
+def register_pool(database: databases.Database, registry: Registry = REGISTRY) -> None:
+    """
+    Register metrics describing the database's connection pool, if it has one
+    which can be monitored.
+    """
+    if not isinstance(database, PooledDatabase) or database.pool is None:
+        return
+    pool = database.pool
+
+    for name, type_, documentation, function in (
+        (
+            'in_use',
+            'gauge',
+            "Database connections currently in use.",
+            lambda: pool.in_use,
+        ),
+        (
+            'idle',
+            'gauge',
+            "Database connections open but not in use.",
+            lambda: pool.idle,
+        ),
+        (
+            'waiting',
+            'gauge',
+            "Requests waiting for a database connection.",
+            lambda: pool.waiting,
+        ),
+        (
+            'timeouts_total',
+            'counter',
+            "Requests which timed out waiting for a database connection.",
+            lambda: pool.timeouts,
+        ),
+    ):
+        registry.register(CallbackMetric(
+            f'code_submitter_db_pool_{name}',
+            documentation,
+            type_=type_,
+            function=function,
+        ))
+
+
+class CacheStats(Protocol):
+    @property
+    def hits(self) -> int:
+        ...
+
+    @property
+    def misses(self) -> int:
+        ...
+
+
+def register_cache(name: str, cache: CacheStats, registry: Registry = REGISTRY) -> None:
+    """
+    Register metrics counting the cache's hits and misses.
+    """
+    for outcome, documentation, function in (
+        ('hits', "Lookups which found a value in the cache.", lambda: cache.hits),
+        ('misses', "Lookups which missed the cache.", lambda: cache.misses),
+    ):
+        registry.register(CallbackMetric(
+            f'code_submitter_{name}_cache_{outcome}_total',
+            documentation,
+            type_='counter',
+            function=function,
+        ))
+
+
+class MetricsMiddleware:
+    """
+    Middleware which records the duration and status of each HTTP request.
+
+    Requests are labelled by the path of the route which they match (rather
+    than their actual path) so that the number of series is bounded. This
+    should be the outermost middleware so that time spent authenticating is
+    included.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        routes: Sequence[BaseRoute],
+        histogram: Histogram = REQUEST_DURATION,
+    ) -> None:
+        self.app = app
+        self.routes = routes
+        self.histogram = histogram
+
+    def route_name(self, scope: Scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, 'path', '')
+        return 'unmatched'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_recording_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_recording_status)
+        finally:
+            self.histogram.observe(
+                time.perf_counter() - start,
+                method=scope['method'],
+                route=self.route_name(scope),
+                status=str(status),
+            )
+
+
+class InstrumentedAuthBackend(AuthenticationBackend):
+    """
+    Authentication backend which records the duration and outcome of each
+    authentication by the wrapped backend.
+    """
+
+    def __init__(
+        self,
+        backend: AuthenticationBackend,
+        *,
+        histogram: Histogram = AUTH_DURATION,
+    ) -> None:
+        self.backend = backend
+        self.histogram = histogram
+
+    async def authenticate(
+        self,
+        conn: HTTPConnection,
+    ) -> tuple[AuthCredentials, BaseUser] | None:
+        result = 'error'
+        start = time.perf_counter()
+        try:
+            credentials = await self.backend.authenticate(conn)
+            result = 'anonymous' if credentials is None else 'success'
+            return credentials
+        except AuthenticationError:
+            result = 'denied'
+            raise
+        finally:
+            self.histogram.observe(time.perf_counter() - start, result=result)
+
+
+class QueryRecord(NamedTuple):
+    operation: str
+    query: ClauseElement | str
+    duration: float
+    # Number of rows returned, for queries which return rows
+    rows: int | None
+
+    @property
+    def shape(self) -> str:
+        """
+        The SQL of the query, with placeholders rather than values.
+        """
+        return ' '.join(str(self.query).split())
+
+
+class QueryLog:
+    """
+    The database queries issued while handling a request.
+    """
+
+    def __init__(self) -> None:
+        self.queries: list[QueryRecord] = []
+
+    @property
+    def duration(self) -> float:
+        return sum(x.duration for x in self.queries)
+
+    def server_timing(self) -> str:
+        return 'db;dur={:.1f};desc="{} queries"'.format(
+            self.duration * 1000,
+            len(self.queries),
+        )
+
+
+_query_log: ContextVar[QueryLog | None] = ContextVar('query_log', default=None)
+
+
+@contextlib.contextmanager
+def record_queries() -> Iterator[QueryLog]:
+    """
+    Record the queries made by an `InstrumentedDatabase` within this context,
+    including those from any tasks started within it.
+    """
+    log = QueryLog()
+    token = _query_log.set(log)
+    try:
+        yield log
+    finally:
+        _query_log.reset(token)
+
+
+class QueryTimingMiddleware:
+    """
+    Middleware which records the database queries made by each HTTP request,
+    optionally reporting them to the client in a `Server-Timing` header.
+
+    Only queries made before the response starts are included in the header,
+    though those made while streaming the response body are still logged.
+    """
+
+    def __init__(self, app: ASGIApp, *, server_timing: bool = True) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        with record_queries() as log:
+            async def send_with_timing(message: Message) -> None:
+                if message['type'] == 'http.response.start' and self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append('Server-Timing', log.server_timing())
+                    headers.append(
+                        'Server-Timing',
+                        f'app;dur={(time.perf_counter() - start) * 1000:.1f}',
+                    )
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                logger.debug(
+                    "%s %s made %d queries taking %.1fms",
+                    scope['method'],
+                    scope['path'],
+                    len(log.queries),
+                    log.duration * 1000,
+                )
+
+
+class InstrumentedDatabase(PooledDatabase):
+    """
+    Database which records the duration of each query, along with its shape
+    and the number of rows returned within `record_queries`.
+
+    Queries slower than `slow_query_threshold` seconds are logged.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        force_rollback: bool = False,
+        pool: PoolOptions | None = None,
+        slow_query_threshold: float | None = None,
+        **options: object,
+    ) -> None:
+        super().__init__(url, force_rollback=force_rollback, pool=pool, **options)
+        self.slow_query_threshold = slow_query_threshold
+
+    def _record(
+        self,
+        operation: str,
+        query: ClauseElement | str,
+        start: float,
+        rows: int | None,
+    ) -> None:
+        record = QueryRecord(operation, query, time.perf_counter() - start, rows)
+
+        DB_QUERY_DURATION.observe(record.duration, operation=operation)
+
+        log = _query_log.get()
+        if log is not None:
+            log.queries.append(record)
+
+        if (
+            self.slow_query_threshold is not None and
+            record.duration >= self.slow_query_threshold
+        ):
+            logger.warning(
+                "Slow query (%s, %.1fms, %s rows): %s",
+                operation,
+                record.duration * 1000,
+                rows,
+                record.shape,
+            )
+
+    async def fetch_all(
+        self,
+        query: ClauseElement | str,
+        values: dict[str, object] | None = None,
+    ) -> list[databases.interfaces.Record]:
+        start = time.perf_counter()
+        rows = None
+        try:
+            result = await super().fetch_all(query, values)
+            rows = len(result)
+            return result
+        finally:
+            self._record('fetch_all', query, start, rows)
+
+    async def fetch_one(
+        self,
+        query: ClauseElement | str,
+        values: dict[str, object] | None = None,
+    ) -> databases.interfaces.Record | None:
+        start = time.perf_counter()
+        rows = None
+        try:
+            result = await super().fetch_one(query, values)
+            rows = 0 if result is None else 1
+            return result
+        finally:
+            self._record('fetch_one', query, start, rows)
+
+    async def fetch_val(
+        self,
+        query: ClauseElement | str,
+        values: dict[str, object] | None = None,
+        column: object = 0,
+    ) -> object:
+        start = time.perf_counter()
+        rows = None
+        try:
+            result = await super().fetch_val(query, values, column=column)
+            rows = 0 if result is None else 1
+            return result
+        finally:
+            self._record('fetch_val', query, start, rows)
+
+    async def execute(
+        self,
+        query: ClauseElement | str,
+        values: dict[str, object] | None = None,
+    ) -> object:
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, values)
+        finally:
+            self._record('execute', query, start, None)
+
+    async def execute_many(
+        self,
+        query: ClauseElement | str,
+        values: list[dict[str, object]],
+    ) -> None:
+        start = time.perf_counter()
+        try:
+            await super().execute_many(query, values)
+        finally:
+            self._record('execute_many', query, start, None)
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import re
+import time
+import asyncio
+import logging
+from typing import Protocol
+from collections.abc import Mapping, Callable
+from typing_extensions import TypedDict
+
+import aiosqlite
+import databases
+from databases.core import DatabaseURL
+from databases.backends.sqlite import SQLiteBackend
+
+logger = logging.getLogger(__name__)
+
+
+Pragmas = Mapping[str, str | int]
+
+_PRAGMA_NAME = re.compile(r'[a-z_]+')
+_PRAGMA_VALUE = re.compile(r'-?[0-9]+|[A-Za-z]+')
+
+
+def production_pragmas(*, busy_timeout: float, mmap_size: int) -> dict[str, str | int]:
+    """
+    SQLite settings suited to a server with concurrent requests.
+
+    WAL journaling lets readers proceed while a write is in progress (such as
+    an upload storing its content) rather than being blocked by it, and with
+    WAL `synchronous=NORMAL` is still safe against corruption, only risking
+    the most recent commits on power loss. Connections wait up to
+    `busy_timeout` seconds for a lock rather than failing immediately, and
+    up to `mmap_size` bytes of the database is memory mapped to save copying
+    pages on reads.
+    """
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(busy_timeout * 1000),
+        'mmap_size': mmap_size,
+        'temp_store': 'MEMORY',
+    }
+
+
+def _pragma_statement(name: str, value: str | int) -> str:
+    # Pragmas can't be parameterised, so ensure that they're only simple
+    # values before using them in SQL.
+    if not _PRAGMA_NAME.fullmatch(name) or not _PRAGMA_VALUE.fullmatch(str(value)):
+        raise ValueError(f"Invalid pragma {name}={value!r}")
+    return f'PRAGMA {name} = {value}'
+
+
+class PoolTimeout(Exception):
+    def __init__(self, timeout: float) -> None:
+        super().__init__(
+            f"Timed out after {timeout}s waiting for a database connection.",
+        )
+        self.timeout = timeout
+
+
+class PoolStats(Protocol):
+    @property
+    def max_size(self) -> int:
+        ...
+
+    @property
+    def in_use(self) -> int:
+        ...
+
+    @property
+    def idle(self) -> int:
+        ...
+
+    @property
+    def waiting(self) -> int:
+        ...
+
+    @property
+    def timeouts(self) -> int:
+        ...
+
+
+def log_exhausted(timeout: float, pool: PoolStats) -> None:
+    logger.warning(
+        "Database connection pool exhausted: timed out after %ss with "
+        "%d connections in use and %d waiting",
+        timeout,
+        pool.in_use,
+        pool.waiting,
+    )
+
+
+class SQLiteConnectionPool:
+    """
+    Pool of SQLite connections, which are kept open for reuse rather than
+    being opened for each query.
+
+    At most `max_size` connections are in use at once. Callers wait up to
+    `acquire_timeout` seconds for one to become free before `PoolTimeout` is
+    raised, so that a burst of load fails fast rather than queueing
+    indefinitely. Connections which have been open for more than `recycle`
+    seconds are closed rather than reused.
+
+    The given `pragmas` are applied to each connection as it is opened.
+    """
+
+    def __init__(
+        self,
+        url: DatabaseURL,
+        *,
+        min_size: int,
+        max_size: int,
+        acquire_timeout: float,
+        recycle: float | None,
+        pragmas: Pragmas | None = None,
+        options: Mapping[str, object] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not 0 <= min_size <= max_size:
+            raise ValueError(
+                f"Invalid pool sizes: min_size={min_size}, max_size={max_size}",
+            )
+
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.recycle = recycle
+        self.clock = clock
+        self.options = dict(options or {})
+        self.pragma_statements = [
+            _pragma_statement(name, value)
+            for name, value in (pragmas or {}).items()
+        ]
+
+        self._slots = asyncio.Semaphore(max_size)
+        # Most recently used last, so that the warmest connection is reused
+        self._idle: list[aiosqlite.Connection] = []
+        self._opened: dict[aiosqlite.Connection, float] = {}
+        self._closed = False
+
+        self.in_use = 0
+        self.waiting = 0
+        self.timeouts = 0
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    async def _open(self) -> aiosqlite.Connection:
+        connection = aiosqlite.connect(
+            database=self.url.database,
+            isolation_level=None,
+            **self.options,  # type: ignore[arg-type]
+        )
+        await connection.__aenter__()
+        try:
+            for statement in self.pragma_statements:
+                await connection.execute(statement)
+        except BaseException:
+            await connection.__aexit__(None, None, None)
+            raise
+        self._opened[connection] = self.clock()
+        return connection
+
+    async def _close(self, connection: aiosqlite.Connection) -> None:
+        del self._opened[connection]
+        await connection.__aexit__(None, None, None)
+
+    def _expired(self, connection: aiosqlite.Connection) -> bool:
+        return (
+            self.recycle is not None and
+            self.clock() - self._opened[connection] >= self.recycle
+        )
+
+    async def warm(self) -> None:
+        """
+        Open connections until there are at least `min_size` available.
+        """
+        self._closed = False
+        while self.in_use + len(self._idle) < self.min_size:
+            self._idle.append(await self._open())
+
+    async def close(self) -> None:
+        """
+        Close the idle connections; those in use are closed when released.
+        """
+        self._closed = True
+        while self._idle:
+            await self._close(self._idle.pop())
+
+    async def _wait_for_slot(self) -> None:
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            log_exhausted(self.acquire_timeout, self)
+            raise PoolTimeout(self.acquire_timeout) from None
+        finally:
+            self.waiting -= 1
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self._slots.locked():
+            await self._wait_for_slot()
+        else:
+            # Avoid the overhead of a timeout when there's no need to wait
+            await self._slots.acquire()
+
+        try:
+            while self._idle:
+                connection = self._idle.pop()
+                if not self._expired(connection):
+                    break
+                await self._close(connection)
+            else:
+                connection = await self._open()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self.in_use += 1
+        return connection
+
+    async def release(self, connection: aiosqlite.Connection) -> None:
+        self.in_use -= 1
+        try:
+            if self._closed or self._expired(connection):
+                await self._close(connection)
+            else:
+                self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+
+class PooledSQLiteBackend(SQLiteBackend):
+    """
+    SQLite backend whose connections are pooled, see `SQLiteConnectionPool`.
+
+    The pool is warmed to its minimum size on connect.
+    """
+
+    def __init__(
+        self,
+        database_url: DatabaseURL | str,
+        *,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 5,
+        recycle: float | None = None,
+        pragmas: Pragmas | None = None,
+        **options: object,
+    ) -> None:
+        super().__init__(database_url, **options)
+        self._pool = self.pool = SQLiteConnectionPool(  # type: ignore[assignment]
+            self._database_url,
+            min_size=min_size,
+            max_size=max_size,
+            acquire_timeout=acquire_timeout,
+            recycle=recycle,
+            pragmas=pragmas,
+            options=options,
+        )
+
+    async def connect(self) -> None:
+        await self.pool.warm()
+
+    async def disconnect(self) -> None:
+        await self.pool.close()
+
+
+class PoolOptions(TypedDict, total=False):
+    min_size: int
+    max_size: int
+    # SQLite and PostgreSQL only
+    acquire_timeout: float
+    recycle: float | None
+    # SQLite only
+    pragmas: Pragmas
+
+
+_SQLITE_BACKEND = 'code_submitter.pool:PooledSQLiteBackend'
+_POSTGRES_BACKEND = 'code_submitter.pool_postgres:PooledPostgresBackend'
+
+
+class PooledDatabase(databases.Database):
+    """
+    Database with configurable connection pooling.
+
+    SQLite connections are pooled by `PooledSQLiteBackend`. PostgreSQL
+    connections are pooled by asyncpg, with the acquire timeout and recycling
+    provided by `PooledPostgresBackend`. Other backends are passed only the
+    pool sizes. Pragmas apply only to SQLite.
+    """
+
+    SUPPORTED_BACKENDS = {
+        **databases.Database.SUPPORTED_BACKENDS,
+        'postgresql': _POSTGRES_BACKEND,
+        'postgres': _POSTGRES_BACKEND,
+        'sqlite': _SQLITE_BACKEND,
+    }
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        force_rollback: bool = False,
+        pool: PoolOptions | None = None,
+        **options: object,
+    ) -> None:
+        database_url = DatabaseURL(url)
+        backend = self.SUPPORTED_BACKENDS.get(
+            database_url.scheme,
+            self.SUPPORTED_BACKENDS.get(database_url.dialect),
+        )
+
+        pool_options: dict[str, object] = dict(pool or {})
+        if backend != _SQLITE_BACKEND:
+            pool_options.pop('pragmas', None)
+        if backend not in (_SQLITE_BACKEND, _POSTGRES_BACKEND):
+            pool_options.pop('acquire_timeout', None)
+            pool_options.pop('recycle', None)
+
+        super().__init__(
+            url,
+            force_rollback=force_rollback,
+            **pool_options,
+            **options,
+        )
+
+    @property
+    def pool(self) -> PoolStats | None:
+        backend = self._backend
+        if isinstance(backend, PooledSQLiteBackend):
+            return backend.pool
+
+        if self.url.dialect == 'postgresql':
+            # Imported here as it requires asyncpg
+            from .pool_postgres import PooledPostgresBackend
+
+            if isinstance(backend, PooledPostgresBackend):
+                return backend.pool
+
+        return None
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import asyncio
+
+import asyncpg
+from databases.core import DatabaseURL
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+
+from .pool import PoolTimeout, log_exhausted
+
+
+class AsyncpgPoolStats:
+    """
+    Statistics about the connections in a `PooledPostgresBackend`'s pool, in
+    the same terms as `SQLiteConnectionPool`.
+    """
+
+    def __init__(self, backend: PooledPostgresBackend) -> None:
+        self._backend = backend
+        self.waiting = 0
+        self.timeouts = 0
+
+    @property
+    def max_size(self) -> int:
+        pool = self._backend.asyncpg_pool
+        return 0 if pool is None else int(pool.get_max_size())
+
+    @property
+    def idle(self) -> int:
+        pool = self._backend.asyncpg_pool
+        return 0 if pool is None else int(pool.get_idle_size())
+
+    @property
+    def in_use(self) -> int:
+        pool = self._backend.asyncpg_pool
+        return 0 if pool is None else int(pool.get_size()) - self.idle
+
+
+class PooledPostgresConnection(PostgresConnection):
+    def __init__(self, database: PooledPostgresBackend) -> None:
+        super().__init__(database, database._dialect)
+        self._pooled_database = database
+
+    async def acquire(self) -> None:
+        assert self._connection is None, "Connection is already acquired"
+        self._connection = await self._pooled_database.acquire_connection()
+
+
+class PooledPostgresBackend(PostgresBackend):
+    """
+    PostgreSQL backend whose connections are acquired from asyncpg's pool with
+    a timeout, as for `SQLiteConnectionPool`.
+
+    asyncpg can't close connections by age, so `recycle` instead closes
+    connections which have been idle for that many seconds.
+    """
+
+    def __init__(
+        self,
+        database_url: DatabaseURL | str,
+        *,
+        acquire_timeout: float = 5,
+        recycle: float | None = None,
+        **options: object,
+    ) -> None:
+        if recycle is not None:
+            options['max_inactive_connection_lifetime'] = recycle
+        super().__init__(database_url, **options)
+        self.acquire_timeout = acquire_timeout
+        self.pool = AsyncpgPoolStats(self)
+
+    @property
+    def asyncpg_pool(self) -> asyncpg.Pool | None:
+        # The base class doesn't annotate its pool, which is only set once
+        # connected.
+        pool: asyncpg.Pool | None = self._pool
+        return pool
+
+    def connection(self) -> PooledPostgresConnection:
+        return PooledPostgresConnection(self)
+
+    async def acquire_connection(self) -> asyncpg.Connection:
+        pool = self.asyncpg_pool
+        assert pool is not None, "DatabaseBackend is not running"
+
+        self.pool.waiting += 1
+        try:
+            # asyncpg's own timeout, unlike `asyncio.wait_for`, returns the
+            # connection to the pool if it arrives just as the timeout expires.
+            return await pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.pool.timeouts += 1
+            log_exhausted(self.acquire_timeout, self.pool)
+            raise PoolTimeout(self.acquire_timeout) from None
+        finally:
+            self.pool.waiting -= 1
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import re
+import zipfile
+from typing import NamedTuple
+from collections.abc import Iterable, Sequence
+
+# Members smaller than this are not subject to the compression ratio limit;
+# small files of repetitive text legitimately compress very well.
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+# Allowance for the size of each member's entry in an archive's central
+# directory, when bounding the size of the directory by the number of members.
+# Entries are 46 bytes plus the member's name and any extra fields or comment.
+DIRECTORY_ENTRY_SIZE = 1024
+
+_GLOB_TOKEN = re.compile(r'(\*\*/|\*\*|\*|\?)')
+
+
+def is_glob(pattern: str) -> bool:
+    return _GLOB_TOKEN.search(pattern) is not None
+
+
+def translate_glob(pattern: str) -> str:
+    """
+    Translate a glob pattern for paths within an archive to a regular
+    expression.
+
+    `*` and `?` match within a single path component, `**` matches across
+    components and `**/` matches zero or more leading directories. All other
+    characters match literally.
+    """
+    regex = ''
+    for token in _GLOB_TOKEN.split(pattern):
+        if token == '**/':
+            regex += '(?:.*/)?'
+        elif token == '**':
+            regex += '.*'
+        elif token == '*':
+            regex += '[^/]*'
+        elif token == '?':
+            regex += '[^/]'
+        else:
+            regex += re.escape(token)
+    return regex
+
+
+class RuleError(NamedTuple):
+    # Short, fixed, description of the rule which was broken, suitable for use
+    # as a metric label.
+    reason: str
+    message: str
+
+
+class _Required:
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.regex = re.compile(translate_glob(pattern))
+        # Matches the pattern nested within a directory, used to suggest
+        # where the file may have been included by mistake.
+        self.nested_regex = re.compile('.+/' + translate_glob(pattern))
+
+    def describe(self) -> str:
+        if is_glob(self.pattern):
+            return f"ZIP file must contain a file matching {self.pattern!r}."
+        return f"ZIP file must contain a file named exactly {self.pattern!r}."
+
+    def suggest(self, name: str) -> str:
+        if is_glob(self.pattern):
+            return (
+                "It looks like you have included a similar file at "
+                f"{name!r}, perhaps you meant to include it at the top level "
+                "of the archive?"
+            )
+
+        prefix = name[:-len(self.pattern)]
+        return (
+            "It looks like you have included a similar file at "
+            f"{name!r}, perhaps you meant to include that file at "
+            f"{self.pattern!r} rather than within {prefix!r}?"
+        )
+
+
+class ArchiveRules:
+    """
+    Rules which the content of uploaded archives must satisfy.
+
+    Patterns are compiled once, up front, and all the rules are then checked
+    in a single pass over an archive's central directory. Sizes are as
+    recorded in the central directory; member content is not read.
+    """
+
+    def __init__(
+        self,
+        *,
+        required_files: Sequence[str] = (),
+        forbidden_files: Sequence[str] = (),
+        max_members: int | None = None,
+        max_uncompressed_size: int | None = None,
+        max_compression_ratio: float | None = None,
+    ) -> None:
+        self.required_files = [_Required(x) for x in required_files]
+        self.forbidden_files = [
+            (x, re.compile(translate_glob(x)))
+            for x in forbidden_files
+        ]
+        # All the forbidden patterns combined, so that each name need only be
+        # matched once in the common case that it isn't forbidden.
+        self._any_forbidden = None
+        if self.forbidden_files:
+            self._any_forbidden = re.compile('|'.join(
+                f'(?:{regex.pattern})'
+                for _, regex in self.forbidden_files
+            ))
+
+        self.max_members = max_members
+        self.max_uncompressed_size = max_uncompressed_size
+        self.max_compression_ratio = max_compression_ratio
+
+    def _too_many_members(self, count: int) -> RuleError | None:
+        if self.max_members is None or count <= self.max_members:
+            return None
+        return RuleError(
+            'too_many_members',
+            f"ZIP file must contain no more than {self.max_members} files "
+            f"(found {count}).",
+        )
+
+    def check_directory(self, entries: int, size: int) -> list[RuleError]:
+        """
+        Check the number of entries and size of an archive's central
+        directory, as recorded in its end record, against the limit on the
+        number of members.
+
+        This allows archives with very large directories to be rejected
+        before the directory is parsed.
+        """
+        error = self._too_many_members(entries)
+        if error is not None:
+            return [error]
+
+        if (
+            self.max_members is not None and
+            size > self.max_members * DIRECTORY_ENTRY_SIZE
+        ):
+            return [RuleError(
+                'directory_size',
+                "ZIP file directory must be no larger than "
+                f"{self.max_members * DIRECTORY_ENTRY_SIZE} bytes "
+                f"(found {size}).",
+            )]
+
+        return []
+
+    def check(self, members: Iterable[zipfile.ZipInfo]) -> list[RuleError]:
+        """
+        Check the given archive members against the rules, returning a
+        description of each rule which is broken.
+        """
+        names = []
+        missing = list(self.required_files)
+        suggestions: dict[_Required, list[str]] = {}
+        forbidden = []
+        too_compressed = None
+        total_size = 0
+
+        for info in members:
+            name = info.filename
+            names.append(name)
+            total_size += info.file_size
+
+            if (
+                self._any_forbidden is not None and
+                self._any_forbidden.fullmatch(name)
+            ):
+                pattern = next(
+                    pattern
+                    for pattern, regex in self.forbidden_files
+                    if regex.fullmatch(name)
+                )
+                forbidden.append(RuleError(
+                    'forbidden_file',
+                    f"ZIP file must not contain {name!r} (matches {pattern!r}).",
+                ))
+
+            if info.is_dir():
+                continue
+
+            if (
+                too_compressed is None and
+                self.max_compression_ratio is not None and
+                info.file_size >= RATIO_CHECK_MIN_SIZE and
+                info.file_size > info.compress_size * self.max_compression_ratio
+            ):
+                too_compressed = name
+
+            # A single file may satisfy several required patterns.
+            still_missing = []
+            for required in missing:
+                if required.regex.fullmatch(name):
+                    continue
+                if required.nested_regex.fullmatch(name):
+                    suggestions.setdefault(required, []).append(name)
+                still_missing.append(required)
+            missing = still_missing
+
+        errors: list[RuleError] = []
+
+        too_many = self._too_many_members(len(names))
+        if too_many is not None:
+            errors.append(too_many)
+
+        if (
+            self.max_uncompressed_size is not None and
+            total_size > self.max_uncompressed_size
+        ):
+            errors.append(RuleError(
+                'uncompressed_size',
+                "ZIP file content must be no larger than "
+                f"{self.max_uncompressed_size} bytes when uncompressed "
+                f"(found {total_size}).",
+            ))
+
+        if too_compressed is not None:
+            errors.append(RuleError(
+                'compression_ratio',
+                f"ZIP file member {too_compressed!r} is too highly compressed "
+                f"(must be at most {self.max_compression_ratio:g}:1).",
+            ))
+
+        errors.extend(forbidden)
+
+        if missing:
+            for required in missing:
+                errors.append(RuleError('missing_file', "\n\n".join([
+                    required.describe(),
+                    *(required.suggest(x) for x in suggestions.get(required, ())),
+                ])))
+
+            errors.append(RuleError(
+                'missing_file',
+                "Found the following files:\n " + "\n ".join(names),
+            ))
+
+        return errors
@@ -1,58 +1,132 @@
 from __future__ import annotations
 
-import io
-import zipfile
 import datetime
 import contextlib
-from collections.abc import AsyncIterator
+from typing import NamedTuple
+from collections.abc import Sequence, AsyncIterator
 
 import databases
 from sqlalchemy.sql import and_, select
 from starlette.routing import Route
 from starlette.requests import Request
-from starlette.responses import Response, RedirectResponse
+from starlette.responses import (
+    Response,
+    FileResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from starlette.middleware import Middleware
 from starlette.templating import Jinja2Templates
+from starlette.formparsers import MultiPartException
 from starlette.applications import Starlette
-from starlette.authentication import requires
-from starlette.datastructures import UploadFile
+from starlette.authentication import requires, AuthenticationBackend
+from starlette.datastructures import FormData
 from starlette.middleware.authentication import AuthenticationMiddleware
 
-from . import auth, utils, config
+from . import auth, pool, utils, config, bundles, caching, metrics, uploads
 from .auth import User, BLUESHIRT_SCOPE
 from .tables import Archive, ChoiceHistory
+from .storage import BlobStore
 
-database = databases.Database(config.DATABASE_URL, force_rollback=config.TESTING)
+database: databases.Database = metrics.InstrumentedDatabase(
+    config.DATABASE_URL,
+    force_rollback=config.TESTING,
+    pool=config.DATABASE_POOL,
+    slow_query_threshold=config.SLOW_QUERY_THRESHOLD,
+)
+blob_store = config.get_blob_store(database)
+
+read_database = database
+read_blob_store = blob_store
+if config.READ_DATABASE_URL is not None:
+    read_database = metrics.InstrumentedDatabase(
+        config.READ_DATABASE_URL,
+        pool=config.DATABASE_POOL,
+        slow_query_threshold=config.SLOW_QUERY_THRESHOLD,
+    )
+    read_blob_store = config.get_blob_store(read_database)
+
+bundle_cache = bundles.BundleCache(config.BUNDLE_CACHE_DIR)
+homepage_cache: caching.GroupedTTLCache[str | None, str, HomepageData]
+homepage_cache = caching.GroupedTTLCache(
+    max_size=config.HOMEPAGE_CACHE_SIZE,
+    ttl=config.HOMEPAGE_CACHE_TTL,
+)
+upload_slots = uploads.UploadSlots(config.MAX_CONCURRENT_UPLOADS)
+archive_inspector = uploads.ArchiveInspector(
+    max_workers=config.ARCHIVE_INSPECTION_WORKERS,
+    timeout=config.ARCHIVE_INSPECTION_TIMEOUT,
+)
 templates = Jinja2Templates(directory='templates')
 
 
+RECENT_WRITE_COOKIE = 'code_submitter_recent_write'
+
+
+def read_source(request: Request) -> tuple[databases.Database, BlobStore]:
+    """
+    The database and blob store to use for reads when handling the request.
+
+    These are the read replica if there is one, unless the client has recently
+    written, in which case reads go to the primary so that they see their
+    own changes despite any replication lag.
+    """
+    if read_database is database or request.cookies.get(RECENT_WRITE_COOKIE):
+        return database, blob_store
+    return read_database, read_blob_store
+
+
+class HomepageData(NamedTuple):
+    chosen: databases.interfaces.Record | None
+    uploads: Sequence[databases.interfaces.Record]
+    next_before: int | None
+
+
+async def load_homepage_data(
+    database: databases.Database,
+    user: User,
+    before: int | None,
+) -> HomepageData:
+    chosen = await database.fetch_one(utils.team_choice_query(user.team))
+
+    # Fetch one more than we show so we know whether there's another page.
+    uploads = await database.fetch_all(utils.uploads_query(
+        user.username,
+        user.team,
+        before=before,
+        limit=config.UPLOADS_PAGE_SIZE + 1,
+    ))
+    if len(uploads) > config.UPLOADS_PAGE_SIZE:
+        uploads = uploads[:config.UPLOADS_PAGE_SIZE]
+        next_before = uploads[-1]['id']
+    else:
+        next_before = None
+
+    return HomepageData(chosen, uploads, next_before)
+
+
 @requires('authenticated')
 async def homepage(request: Request) -> Response:
-    chosen = await database.fetch_one(
-        select([ChoiceHistory]).select_from(
-            ChoiceHistory.join(Archive),
-        ).where(
-            Archive.c.team == request.user.team,
-        ).order_by(
-            ChoiceHistory.c.created.desc(),
-        ),
-    )
-    uploads = await database.fetch_all(
-        select(
-            [
-                Archive.c.id,
-                Archive.c.username,
-                Archive.c.team,
-                # omit content which is probably large and we don't need
-                Archive.c.created,
-            ],
-        ).where(
-            Archive.c.username == request.user.username or
-            Archive.c.team == request.user.team,
-        ).order_by(
-            Archive.c.created.desc(),
-        ),
-    )
+    user: User = request.user
+    database, _ = read_source(request)
+
+    try:
+        before = int(request.query_params['before'])
+    except KeyError:
+        before = None
+    except ValueError:
+        return Response("Invalid 'before' parameter", status_code=400)
+
+    # The first page is cached, since it's what's shown on every refresh. Reads
+    # from the primary rather than the replica bypass the cache so that it
+    # can't serve stale data to a client which has just uploaded.
+    cacheable = before is None and database is read_database
+    generation = homepage_cache.generation(user.team)
+    data = homepage_cache.get(user.team, user.username) if cacheable else None
+    if data is None:
+        data = await load_homepage_data(database, user, before)
+        if cacheable:
+            homepage_cache.put(user.team, user.username, data, generation=generation)
 
     if BLUESHIRT_SCOPE in request.auth.scopes:
         teams_submissions = await utils.get_chosen_submissions_info(database)
@@ -60,15 +134,16 @@ async def homepage(request: Request) -> Response:
         teams_submissions = ()
 
     return templates.TemplateResponse(request, 'index.html', {
-        'chosen': chosen,
-        'uploads': uploads,
+        'chosen': data.chosen,
+        'uploads': data.uploads,
+        'before': before,
+        'next_before': data.next_before,
         'teams_submissions': teams_submissions,
         'BLUESHIRT_SCOPE': BLUESHIRT_SCOPE,
     })
 
 
 @requires('authenticated')
-@database.transaction()
 async def upload(request: Request) -> Response:
     user: User = request.user
 
@@ -78,72 +153,124 @@ async def upload(request: Request) -> Response:
             status_code=403,
         )
 
-    form = await request.form()
-    archive = form['archive']
+    max_size = config.MAX_ARCHIVE_SIZE + uploads.FORM_OVERHEAD
+
+    # Reject requests which declare that they're too large before reading any
+    # of the body; those which don't are limited as the body is received.
+    try:
+        content_length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        pass
+    else:
+        if content_length > max_size:
+            metrics.UPLOAD_REJECTIONS.inc(reason='too_large')
+            return Response(str(uploads.RequestTooLarge(max_size)), status_code=413)
+
+    try:
+        with upload_slots.acquire():
+            limited_request = Request(
+                request.scope,
+                uploads.limit_request_body(request.receive, max_size),
+            )
+            return await receive_upload(limited_request)
+    except uploads.TooManyUploads as e:
+        metrics.UPLOAD_REJECTIONS.inc(reason='too_many_uploads')
+        return Response(str(e), status_code=503, headers={'Retry-After': '1'})
+
+
+async def receive_upload(request: Request) -> Response:
+    try:
+        form = await uploads.parse_form(request, max_parts=config.MAX_UPLOAD_PARTS)
+    except uploads.RequestTooLarge as e:
+        metrics.UPLOAD_REJECTIONS.inc(reason='too_large')
+        return Response(str(e), status_code=413)
+    except MultiPartException as e:
+        metrics.UPLOAD_REJECTIONS.inc(reason='invalid_form')
+        return Response(e.message, status_code=400)
+
+    try:
+        return await store_upload(request, form)
+    finally:
+        # Release the form's spooled files promptly
+        await form.close()
 
-    if not isinstance(archive, UploadFile):
+
+async def store_upload(request: Request, form: FormData) -> Response:
+    archive = form.get('archive')
+
+    if not isinstance(archive, uploads.HashedUploadFile):
+        metrics.UPLOAD_REJECTIONS.inc(reason='no_file')
         return Response("Must upload a file", status_code=400)
 
     if archive.content_type not in ('application/zip', 'application/x-zip-compressed'):
+        metrics.UPLOAD_REJECTIONS.inc(reason='content_type')
         return Response(
             f"Must upload a ZIP file, not {archive.content_type!r}",
             status_code=400,
         )
 
-    contents = await archive.read()
-
     try:
-        zf = zipfile.ZipFile(io.BytesIO(contents))
-    except zipfile.BadZipFile:
-        return Response("Must upload a ZIP file", status_code=400)
-
-    for filepath in config.REQUIRED_FILES_IN_ARCHIVE:
-        try:
-            zf.getinfo(filepath)
-        except KeyError:
-            names = zf.namelist()
-            message = (
-                f"ZIP file must contain a file named exactly {filepath!r}.\n\n"
-                "Found the following files:\n " +
-                "\n ".join(zf.namelist())
-            )
+        uploaded = uploads.uploaded_archive(
+            archive,
+            max_size=config.MAX_ARCHIVE_SIZE,
+        )
+    except uploads.ArchiveTooLarge as e:
+        metrics.UPLOAD_REJECTIONS.inc(reason='too_large')
+        return Response(str(e), status_code=413)
 
-            search = '/' + filepath
-            for name in names:
-                if name.endswith(search):
-                    prefix = name[:-len(filepath)]
-                    message += (
-                        "\n\n"
-                        "It looks like you have included a similar file at "
-                        f"{name!r}, perhaps you meant to include that file at "
-                        f"{filepath!r} rather than within {prefix!r}?"
-                    )
-
-            return Response(
-                message,
-                status_code=400,
-            )
+    metrics.UPLOAD_BYTES.inc(uploaded.size)
+    metrics.UPLOAD_SIZE.observe(uploaded.size)
 
-    archive_id = await database.execute(
-        Archive.insert().values(
-            content=contents,
-            username=request.user.username,
-            team=request.user.team,
-        ),
-    )
-    if form.get('choose'):
-        await database.execute(
-            ChoiceHistory.insert().values(
-                archive_id=archive_id,
+    try:
+        metadata = await archive_inspector.validate(
+            uploaded.file,
+            config.ARCHIVE_RULES,
+        )
+    except uploads.InvalidArchive as e:
+        metrics.UPLOAD_REJECTIONS.inc(reason=e.reason)
+        return Response(str(e), status_code=400)
+
+    uploaded.file.seek(0)
+    await blob_store.put(uploaded.sha256, uploaded.file)
+
+    # Only hold a transaction for the writes, not while receiving the upload.
+    async with database.transaction():
+        archive_id = await database.execute(
+            Archive.insert().values(
+                sha256=uploaded.sha256,
                 username=request.user.username,
+                team=request.user.team,
+                size=uploaded.size,
+                member_count=metadata.member_count,
+                uncompressed_size=metadata.uncompressed_size,
+                members=metadata.members,
             ),
         )
+        if form.get('choose'):
+            await database.execute(
+                ChoiceHistory.insert().values(
+                    archive_id=archive_id,
+                    username=request.user.username,
+                ),
+            )
+
+    homepage_cache.invalidate(request.user.team)
 
-    return RedirectResponse(
+    response = RedirectResponse(
         request.url_for('homepage'),
         # 302 so that the browser switches to GET
         status_code=302,
     )
+    if read_database is not database:
+        response.set_cookie(
+            RECENT_WRITE_COOKIE,
+            '1',
+            max_age=config.READ_YOUR_WRITES_WINDOW,
+            path=request.scope.get('root_path') or '/',
+            httponly=True,
+            samesite='lax',
+        )
+    return response
 
 
 @requires('authenticated')
@@ -156,10 +283,11 @@ async def archive(request: Request) -> Response:
         )
 
     archive_id = request.path_params['archive_id']
+    database, blob_store = read_source(request)
 
     archive = await database.fetch_one(
         select([
-            Archive.c.content,
+            Archive.c.sha256,
         ]).where(and_(
             Archive.c.id == archive_id,
             Archive.c.team == user.team,
@@ -174,8 +302,13 @@ async def archive(request: Request) -> Response:
 
     filename = f'upload-{archive_id}.zip'
 
-    return Response(
-        archive['content'],
+    path = blob_store.local_path(archive['sha256'])
+    if path is not None:
+        # Lets the server use zero-copy transfer where it supports doing so.
+        return FileResponse(path, filename=filename, media_type='application/zip')
+
+    return StreamingResponse(
+        blob_store.stream(archive['sha256']),
         headers={'Content-Disposition': f'attachment; filename="{filename}"'},
         media_type='application/zip',
     )
@@ -183,25 +316,50 @@ async def archive(request: Request) -> Response:
 
 @requires(['authenticated', BLUESHIRT_SCOPE])
 async def download_submissions(request: Request) -> Response:
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, mode='w') as zf:
-        await utils.collect_submissions(database, zf)
+    database, blob_store = read_source(request)
+    archives = await utils.get_chosen_archives(database)
+    key = bundles.bundle_key(archives)
+    etag = f'"{key}"'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and bundles.etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={'ETag': etag})
 
     filename = 'submissions-{now}.zip'.format(
         now=datetime.datetime.now(datetime.timezone.utc),
     )
 
-    return Response(
-        buffer.getvalue(),
-        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    return StreamingResponse(
+        await bundle_cache.stream(key, archives, blob_store),
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'ETag': etag,
+        },
         media_type='application/zip',
     )
 
 
+@requires(['authenticated', BLUESHIRT_SCOPE])
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(
+        metrics.REGISTRY.render(),
+        media_type=metrics.CONTENT_TYPE,
+    )
+
+
+async def pool_timeout(request: Request, exc: Exception) -> Response:
+    return Response(str(exc), status_code=503, headers={'Retry-After': '1'})
+
+
 @contextlib.asynccontextmanager
 async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    # Also opens the pool's initial connections
     await database.connect()
+    if read_database is not database:
+        await read_database.connect()
     yield
+    if read_database is not database:
+        await read_database.disconnect()
     await database.disconnect()
 
 
@@ -210,18 +368,42 @@ routes = [
     Route('/upload', endpoint=upload, methods=['POST']),
     Route('/archive/{archive_id:int}', endpoint=archive, methods=['GET']),
     Route('/download-submissions', endpoint=download_submissions, methods=['GET']),
+    Route('/metrics', endpoint=metrics_endpoint, methods=['GET']),
 ]
 
+metrics.register_pool(database)
+metrics.register_cache('homepage', homepage_cache)
+
+auth_backend: AuthenticationBackend = metrics.InstrumentedAuthBackend(
+    config.get_auth_backend(),
+)
 middleware = [
+    Middleware(metrics.MetricsMiddleware, routes=routes),
+    Middleware(metrics.QueryTimingMiddleware, server_timing=config.SERVER_TIMING),
+]
+
+if config.SESSION_SECRET_KEY is not None:
+    auth_backend = auth.SessionAuthBackend(
+        auth_backend,
+        secret_key=str(config.SESSION_SECRET_KEY),
+        max_age=config.SESSION_MAX_AGE,
+        https_only=config.SESSION_HTTPS_ONLY,
+    )
+    middleware.append(
+        Middleware(auth.SessionCookieMiddleware, backend=auth_backend),
+    )
+
+middleware.append(
     Middleware(
         AuthenticationMiddleware,
-        backend=config.get_auth_backend(),
+        backend=auth_backend,
         on_error=auth.auth_required_response,
     ),
-]
+)
 
 app = Starlette(
     routes=routes,
     lifespan=lifespan,
     middleware=middleware,
+    exception_handlers={pool.PoolTimeout: pool_timeout},
 )
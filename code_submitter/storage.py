@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from typing import IO
+from pathlib import Path
+from collections.abc import AsyncIterator
+
+import databases
+from sqlalchemy.sql import select
+from sqlalchemy.dialects import sqlite, postgresql
+from starlette.concurrency import run_in_threadpool
+
+from .tables import Blob
+
+# Content is streamed in chunks of this size. For content read from files this
+# bounds the memory used by each download regardless of the size of the archive.
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+class BlobStore:
+    """
+    Storage for the content of uploaded archives, keyed by SHA-256.
+
+    Storing content which is already present is a no-op, so identical uploads
+    share storage.
+    """
+
+    def __init__(self, database: databases.Database) -> None:
+        self.database = database
+
+    async def put(self, sha256: str, file: IO[bytes]) -> None:
+        raise NotImplementedError(
+            "Implementations must provide a 'put' method",
+        )
+
+    async def get(self, sha256: str) -> bytes:
+        raise NotImplementedError(
+            "Implementations must provide a 'get' method",
+        )
+
+    async def contains(self, sha256: str) -> bool:
+        raise NotImplementedError(
+            "Implementations must provide a 'contains' method",
+        )
+
+    def stream(
+        self,
+        sha256: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        raise NotImplementedError(
+            "Implementations must provide a 'stream' method",
+        )
+
+    def local_path(self, sha256: str) -> Path | None:
+        """
+        Return the path of a local file holding the content, if there is one.
+
+        This allows the content to be served directly from the file, for
+        example using `sendfile`.
+        """
+        return None
+
+
+class DatabaseBlobStore(BlobStore):
+    """
+    Blob store which keeps content in the `blob` table of the database.
+    """
+
+    async def put(self, sha256: str, file: IO[bytes]) -> None:
+        if await self.contains(sha256):
+            return
+
+        # Identical content may be uploaded concurrently, in which case
+        # another request may have stored it since the check above.
+        dialect = self.database.url.dialect
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert(Blob)
+        await self.database.execute(
+            insert.values(
+                sha256=sha256,
+                content=file.read(),
+            ).on_conflict_do_nothing(index_elements=[Blob.c.sha256]),
+        )
+
+    async def get(self, sha256: str) -> bytes:
+        content: bytes | None = await self.database.fetch_val(
+            select([Blob.c.content]).where(Blob.c.sha256 == sha256),
+        )
+        if content is None:
+            raise KeyError(sha256)
+        return content
+
+    async def contains(self, sha256: str) -> bool:
+        existing = await self.database.fetch_val(
+            select([Blob.c.sha256]).where(Blob.c.sha256 == sha256),
+        )
+        return existing is not None
+
+    async def stream(
+        self,
+        sha256: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        # The content is fetched in one query, since databases generally load
+        # the whole value to extract any part of it, which would make fetching
+        # it chunk by chunk quadratic in its size. Only `FileSystemBlobStore`
+        # streams content without holding it all in memory.
+        content = memoryview(await self.get(sha256))
+        for offset in range(0, len(content), chunk_size):
+            yield bytes(content[offset:offset + chunk_size])
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Blob store which keeps content in files below a local directory.
+
+    Files are written to a temporary name and then moved into place, so
+    readers never see partial content. Content is not removed if the database
+    transaction which stored it is rolled back; since storage is keyed by
+    content this is harmless.
+    """
+
+    def __init__(self, database: databases.Database, *, path: str | Path) -> None:
+        super().__init__(database)
+        self.root = Path(path)
+
+    def path(self, sha256: str) -> Path:
+        if len(sha256) != 64 or not all(x in '0123456789abcdef' for x in sha256):
+            raise ValueError(f"Invalid SHA-256 {sha256!r}")
+        return self.root / sha256[:2] / sha256
+
+    def _put(self, sha256: str, file: IO[bytes]) -> None:
+        path = self.path(sha256)
+        if path.exists():
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            try:
+                shutil.copyfileobj(file, tmp)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        os.replace(tmp.name, path)
+
+    async def put(self, sha256: str, file: IO[bytes]) -> None:
+        await run_in_threadpool(self._put, sha256, file)
+
+    async def get(self, sha256: str) -> bytes:
+        try:
+            return await run_in_threadpool(self.path(sha256).read_bytes)
+        except FileNotFoundError:
+            raise KeyError(sha256) from None
+
+    async def contains(self, sha256: str) -> bool:
+        return await run_in_threadpool(self.path(sha256).exists)
+
+    async def stream(
+        self,
+        sha256: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        try:
+            file = await run_in_threadpool(self.path(sha256).open, 'rb')
+        except FileNotFoundError:
+            raise KeyError(sha256) from None
+
+        try:
+            while chunk := await run_in_threadpool(file.read, chunk_size):
+                yield chunk
+        finally:
+            file.close()
+
+    def local_path(self, sha256: str) -> Path:
+        return self.path(sha256)
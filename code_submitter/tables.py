@@ -4,17 +4,36 @@ import sqlalchemy
 
 metadata = sqlalchemy.MetaData()
 
+# The content of uploaded archives, keyed by its SHA-256 so that identical
+# uploads share storage. Only used by the `DatabaseBlobStore`.
+Blob = sqlalchemy.Table(
+    'blob',
+    metadata,
+    sqlalchemy.Column('sha256', sqlalchemy.String(64), primary_key=True),
+    sqlalchemy.Column('content', sqlalchemy.LargeBinary, nullable=False),
+)
+
 # As a team member you upload your archives prior to their being used to
 # simulate matches.
 Archive = sqlalchemy.Table(
     'archive',
     metadata,
     sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
-    sqlalchemy.Column('content', sqlalchemy.LargeBinary, nullable=False),
+    # Key of the archive's content in the configured `BlobStore`
+    sqlalchemy.Column('sha256', sqlalchemy.String(64), nullable=False),
 
     sqlalchemy.Column('username', sqlalchemy.String, nullable=False),
     sqlalchemy.Column('team', sqlalchemy.String, nullable=False),
 
+    # Metadata captured at upload, so that it can be shown without loading
+    # the content. These are null for archives uploaded before they were
+    # added, until filled in by `backfill_metadata`.
+    sqlalchemy.Column('size', sqlalchemy.Integer),
+    sqlalchemy.Column('member_count', sqlalchemy.Integer),
+    sqlalchemy.Column('uncompressed_size', sqlalchemy.Integer),
+    # The names of the archive's members, as a JSON list
+    sqlalchemy.Column('members', sqlalchemy.JSON),
+
     sqlalchemy.Column(
         'created',
         sqlalchemy.DateTime(timezone=True),
@@ -40,3 +59,14 @@ ChoiceHistory = sqlalchemy.Table(
         server_default=sqlalchemy.func.now(),
     ),
 )
+
+# Listing a team's or user's uploads, most recent first.
+sqlalchemy.Index('ix_archive_team_created', Archive.c.team, Archive.c.created)
+sqlalchemy.Index('ix_archive_username_created', Archive.c.username, Archive.c.created)
+
+# Finding the choices of a given archive, most recent first.
+sqlalchemy.Index(
+    'ix_choice_history_archive_id_created',
+    ChoiceHistory.c.archive_id,
+    ChoiceHistory.c.created,
+)
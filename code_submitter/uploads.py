@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import os
+import time
+import struct
+import asyncio
+import hashlib
+import zipfile
+import contextlib
+from typing import IO, NamedTuple
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.types import Message, Receive
+from starlette.requests import Request
+from starlette.formparsers import MultiPartParser, MultiPartException
+from starlette.datastructures import FormData, UploadFile
+
+from .rules import RuleError, ArchiveRules
+
+# Allowance for the multipart framing and the form's other fields, on top of
+# the size of the archive itself, when limiting the size of upload requests.
+FORM_OVERHEAD = 64 * 1024
+
+
+class InvalidArchive(ValueError):
+    # Short, fixed, description of the problem, suitable for use as a metric
+    # label.
+    reason = 'invalid'
+
+
+class NotZipFile(InvalidArchive):
+    reason = 'not_zip'
+
+
+class BrokenRules(InvalidArchive):
+    def __init__(self, errors: Sequence[RuleError]) -> None:
+        super().__init__("\n\n".join(x.message for x in errors))
+        self.errors = errors
+        # Label the rejection by the first rule broken, so that each upload is
+        # counted once. The limits on the archive's size are checked first.
+        self.reason = errors[0].reason
+
+
+class InspectionTimeout(InvalidArchive):
+    reason = 'timeout'
+
+    def __init__(self) -> None:
+        super().__init__("Archive took too long to inspect.")
+
+
+class ArchiveTooLarge(ValueError):
+    def __init__(self, max_size: int) -> None:
+        super().__init__(f"Archive must be no larger than {max_size} bytes.")
+        self.max_size = max_size
+
+
+class RequestTooLarge(MultiPartException):
+    # A `MultiPartException` so that the form parser closes any files it has
+    # already spooled when this is raised part way through a form.
+
+    def __init__(self, max_size: int) -> None:
+        super().__init__(f"Request must be no larger than {max_size} bytes.")
+        self.max_size = max_size
+
+    def __str__(self) -> str:
+        return self.message
+
+
+class TooManyUploads(Exception):
+    def __init__(self) -> None:
+        super().__init__("Too many uploads in progress, please try again shortly.")
+
+
+class UploadSlots:
+    """
+    Limit on the number of uploads being processed at once.
+
+    Rather than queueing, uploads beyond the limit are rejected immediately so
+    that clients can retry later without holding a connection open. A
+    non-positive limit disables this.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_use = 0
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[None]:
+        if 0 < self.limit <= self.in_use:
+            raise TooManyUploads()
+
+        self.in_use += 1
+        try:
+            yield
+        finally:
+            self.in_use -= 1
+
+
+def limit_request_body(receive: Receive, max_size: int) -> Receive:
+    """
+    Wrap an ASGI `receive` callable such that `RequestTooLarge` is raised as
+    soon as more than `max_size` bytes of request body have been received.
+
+    This bounds the work done on oversized requests regardless of whether the
+    client sent a (truthful) `Content-Length`.
+    """
+    received = 0
+
+    async def limited_receive() -> Message:
+        nonlocal received
+
+        message = await receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > max_size:
+                raise RequestTooLarge(max_size)
+        return message
+
+    return limited_receive
+
+
+class HashedUploadFile(UploadFile):
+    """
+    An uploaded file which was hashed as it was received.
+    """
+
+    def __init__(self, upload: UploadFile) -> None:
+        super().__init__(
+            upload.file,
+            size=upload.size,
+            filename=upload.filename,
+            headers=upload.headers,
+        )
+        self._hasher = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+
+class _HashingMultiPartParser(MultiPartParser):
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        if self._current_part.file is not None:
+            self._current_part.file = HashedUploadFile(self._current_part.file)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        super().on_part_data(data, start, end)
+        if isinstance(self._current_part.file, HashedUploadFile):
+            self._current_part.file._hasher.update(memoryview(data)[start:end])
+
+
+async def parse_form(request: Request, *, max_parts: int) -> FormData:
+    """
+    Parse the request's multipart form, which may have at most `max_parts`
+    files and fields. Files are returned as `HashedUploadFile`s, hashed as
+    they're received so that they needn't be read again to hash them.
+
+    Unlike `Request.form`, errors are raised as `MultiPartException` (or
+    `RequestTooLarge`) rather than as an `HTTPException`. In either case any
+    files already spooled are closed; otherwise the caller must close the
+    returned form.
+    """
+    content_type = request.headers.get('Content-Type', '')
+    if content_type.partition(';')[0].strip().lower() != 'multipart/form-data':
+        return FormData()
+
+    parser = _HashingMultiPartParser(
+        request.headers,
+        request.stream(),
+        max_files=max_parts,
+        max_fields=max_parts,
+    )
+    return await parser.parse()
+
+
+class UploadedArchive(NamedTuple):
+    file: IO[bytes]
+    size: int
+    sha256: str
+
+
+class ArchiveMetadata(NamedTuple):
+    member_count: int
+    uncompressed_size: int
+    members: list[str]
+
+
+def uploaded_archive(upload: HashedUploadFile, *, max_size: int) -> UploadedArchive:
+    """
+    Get the content, size and hash of an uploaded archive, enforcing a size
+    limit.
+
+    The content is not read: its size and hash were recorded as the form was
+    parsed. The returned file is the one into which the form parser spooled
+    the content, positioned at its start; it is closed along with the form.
+    """
+    size = upload.size or 0
+    if size > max_size:
+        raise ArchiveTooLarge(max_size)
+
+    return UploadedArchive(upload.file, size, upload.sha256)
+
+
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_RECORD_SIGNATURE = b'PK\x05\x06'
+_ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_END_RECORD_SIGNATURE = b'PK\x06\x06'
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+
+
+def _read_directory_extent(file: IO[bytes]) -> tuple[int, int] | None:
+    """
+    Read the number of entries and size of a ZIP archive's central directory
+    from the archive's end record, without reading the directory itself.
+
+    Returns `None` if the file doesn't have an end record.
+    """
+    file_size = file.seek(0, os.SEEK_END)
+    # The end record is followed by a comment of up to 64KiB.
+    tail_start = max(0, file_size - _END_RECORD.size - 0xFFFF)
+    file.seek(tail_start)
+    tail = file.read()
+
+    start = tail.rfind(_END_RECORD_SIGNATURE)
+    if start < 0 or start + _END_RECORD.size > len(tail):
+        return None
+
+    *_, entries, size, _, _ = _END_RECORD.unpack_from(tail, start)
+
+    if entries == 0xFFFF or size == 0xFFFFFFFF:
+        # A ZIP64 archive: the actual values are in a ZIP64 end record, which
+        # is followed by a locator immediately before the end record.
+        zip64_start = (
+            tail_start + start - _ZIP64_LOCATOR.size - _ZIP64_END_RECORD.size
+        )
+        if zip64_start >= 0:
+            file.seek(zip64_start)
+            zip64 = file.read(_ZIP64_END_RECORD.size + _ZIP64_LOCATOR.size)
+            if (
+                zip64.startswith(_ZIP64_END_RECORD_SIGNATURE) and
+                zip64[_ZIP64_END_RECORD.size:].startswith(_ZIP64_LOCATOR_SIGNATURE)
+            ):
+                *_, entries, size, _ = _ZIP64_END_RECORD.unpack_from(zip64)
+
+    return entries, size
+
+
+def validate_archive(
+    file: IO[bytes],
+    rules: ArchiveRules,
+    *,
+    deadline: float | None = None,
+) -> ArchiveMetadata:
+    """
+    Check that the given file is a ZIP archive which satisfies the given
+    rules, returning metadata about the archive's members.
+
+    Only the archive's central directory is inspected; member content is not
+    read. If a `deadline` (in terms of `time.monotonic`) is given then
+    `InspectionTimeout` is raised if it passes part way through the checks.
+
+    The deadline can't be checked while the central directory is parsed, so
+    the directory's size is first checked against the rules using the
+    archive's end record.
+    """
+    def check_deadline() -> None:
+        if deadline is not None and time.monotonic() > deadline:
+            raise InspectionTimeout()
+
+    check_deadline()
+
+    extent = _read_directory_extent(file)
+    if extent is not None:
+        errors = rules.check_directory(*extent)
+        if errors:
+            raise BrokenRules(errors)
+
+    try:
+        zf = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise NotZipFile("Must upload a ZIP file") from None
+
+    names = []
+    uncompressed_size = 0
+
+    def members() -> Iterator[zipfile.ZipInfo]:
+        nonlocal uncompressed_size
+        for info in zf.infolist():
+            check_deadline()
+            names.append(info.filename)
+            uncompressed_size += info.file_size
+            yield info
+
+    with zf:
+        errors = rules.check(members())
+
+    if errors:
+        raise BrokenRules(errors)
+
+    return ArchiveMetadata(len(names), uncompressed_size, names)
+
+
+class ArchiveInspector:
+    """
+    Validates archives in a bounded pool of worker threads, so that inspecting
+    a large or malformed archive doesn't block the event loop.
+
+    Each archive has a time budget covering both waiting for a free worker
+    and the inspection itself. Threads can't be interrupted, so a worker which
+    overruns stops at its next check of the deadline.
+    """
+
+    def __init__(self, *, max_workers: int, timeout: float) -> None:
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='archive-inspector',
+        )
+
+    async def validate(self, file: IO[bytes], rules: ArchiveRules) -> ArchiveMetadata:
+        """
+        Validate the given archive as `validate_archive` does, returning its
+        metadata.
+
+        The file must not be used by the caller until this returns, which
+        even on timeout is not until no worker is using it.
+        """
+        future = self._executor.submit(
+            validate_archive,
+            file,
+            rules,
+            deadline=time.monotonic() + self.timeout,
+        )
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            # The caller may close the file once this returns, so wait for a
+            # worker still reading it to stop at its next check of the
+            # deadline. (Archives yet to reach a worker have been cancelled.)
+            finished = asyncio.wrap_future(future)
+            await asyncio.wait([finished])
+            if not finished.cancelled():
+                # Superseded by the timeout; retrieve it so it isn't logged.
+                finished.exception()
+            raise InspectionTimeout() from None
@@ -1,15 +1,34 @@
 from __future__ import annotations
 
+import io
+import shutil
 import datetime
-from typing import Any, Union, TypeVar
-from zipfile import ZipFile
-from collections.abc import Callable, Iterable, Collection
-from typing_extensions import TypedDict
+from typing import IO, Any, Union, TypeVar, NamedTuple
+from zipfile import ZipFile, ZipInfo
+from collections.abc import (
+    Mapping,
+    Callable,
+    Iterable,
+    Collection,
+    AsyncIterator,
+)
+from typing_extensions import Buffer, TypedDict
 
 import databases
-from sqlalchemy.sql import select, FromClause, ColumnElement
+from sqlalchemy.sql import (
+    and_,
+    func,
+    union,
+    select,
+    tuple_,
+    literal,
+    FromClause,
+    ColumnElement,
+)
+from sqlalchemy.sql.expression import Select
 
 from .tables import Archive, ChoiceHistory
+from .storage import BlobStore
 
 K = TypeVar('K')
 V = TypeVar('V')
@@ -23,30 +42,121 @@ def map_values(mapping: dict[K, V], fn: Callable[[V], R]) -> dict[K, R]:
     return {k: fn(v) for k, v in mapping.items()}
 
 
-async def _get_chosen_submissions_data(
-    database: databases.Database,
-    fields: Iterable[SqlalchemyField],
-) -> dict[str, databases.interfaces.Record]:
+def team_choice_query(team: str | None) -> Select:
     """
-    Return a mapping of teams to their the chosen archive.
+    Query for the team's current choice of archive.
     """
+    return select([ChoiceHistory]).select_from(
+        ChoiceHistory.join(Archive),
+    ).where(
+        Archive.c.team == team,
+    ).order_by(
+        # As in `chosen_submissions_query`, so that the two agree when choices
+        # are made within the resolution of the timestamps.
+        ChoiceHistory.c.created.desc(),
+        ChoiceHistory.c.id.desc(),
+    ).limit(1)
 
-    # Note: Ideally we'd group by team in SQL, however that doesn't seem to work
-    # properly -- we don't get the ordering applied before the grouping.
 
-    rows = await database.fetch_all(
+def uploads_query(
+    username: str,
+    team: str | None,
+    *,
+    before: int | None,
+    limit: int,
+) -> Select:
+    """
+    Query for a page of the uploads by the user or their team, most recent
+    first.
+
+    Pages are selected by a keyset on `(created, id)`: `before` is the id of
+    the last upload on the previous page, if any. Each filter is applied in
+    its own limited, index-ordered query, so the cost of a page does not
+    depend on how many uploads there are in total.
+    """
+    columns = [
+        Archive.c.id,
+        Archive.c.username,
+        Archive.c.team,
+        Archive.c.created,
+        Archive.c.size,
+        Archive.c.member_count,
+    ]
+
+    conditions = [Archive.c.username == username]
+    if team is not None:
+        conditions.append(Archive.c.team == team)
+
+    if before is not None:
+        cursor = Archive.alias('cursor')
+        # Compare against the stored value, rather than one which has been
+        # round-tripped through Python, so that ties are handled exactly.
+        cursor_created = select([cursor.c.created]).where(
+            cursor.c.id == before,
+        ).scalar_subquery()  # type: ignore[attr-defined]
+        position = tuple_(Archive.c.created, Archive.c.id)
+        is_before_cursor = position < tuple_(cursor_created, literal(before))
+        conditions = [and_(x, is_before_cursor) for x in conditions]
+
+    pages = [
         select([
-            *fields,
-            Archive.c.team.label('__team'),
-        ]).select_from(
-            Archive.join(ChoiceHistory),
-        ).order_by(
-            Archive.c.team,
-            ChoiceHistory.c.created.asc(),
+            select(columns).where(
+                condition,
+            ).order_by(
+                Archive.c.created.desc(),
+                Archive.c.id.desc(),
+            ).limit(limit).alias(),
+        ])
+        for condition in conditions
+    ]
+
+    uploads = union(*pages).alias('uploads')
+    return select([uploads]).order_by(
+        uploads.c.created.desc(),
+        uploads.c.id.desc(),
+    ).limit(limit)
+
+
+def chosen_submissions_query(fields: Iterable[SqlalchemyField]) -> Select:
+    """
+    Query for the given fields of each team's chosen archive.
+    """
+
+    # Rank each team's choices, most recent first, so that only the current
+    # choice for each team is returned.
+    ranked_choices = select([
+        ChoiceHistory.c.id,
+        func.row_number().over(
+            partition_by=Archive.c.team,
+            order_by=(ChoiceHistory.c.created.desc(), ChoiceHistory.c.id.desc()),
+        ).label('rank'),
+    ]).select_from(
+        Archive.join(ChoiceHistory),
+    ).alias('ranked_choices')
+
+    return select([
+        *fields,
+        Archive.c.team.label('__team'),
+    ]).select_from(
+        Archive.join(ChoiceHistory).join(
+            ranked_choices,
+            ranked_choices.c.id == ChoiceHistory.c.id,
         ),
+    ).where(
+        ranked_choices.c.rank == 1,
+    ).order_by(
+        Archive.c.team,
     )
 
-    # Rely on later keys replacing earlier occurrences of the same key.
+
+async def _get_chosen_submissions_data(
+    database: databases.Database,
+    fields: Iterable[SqlalchemyField],
+) -> dict[str, databases.interfaces.Record]:
+    """
+    Return a mapping of teams to their the chosen archive.
+    """
+    rows = await database.fetch_all(chosen_submissions_query(fields))
     return {x['__team']: x for x in rows}
 
 
@@ -54,6 +164,8 @@ class SubmissionInfo(TypedDict):
     team: str
     archive_id: int
     chosen_at: datetime.datetime
+    size: int | None
+    member_count: int | None
 
 
 async def get_chosen_submissions_info(
@@ -65,6 +177,8 @@ async def get_chosen_submissions_info(
 
     submissions_by_team = await _get_chosen_submissions_data(database, [
         Archive.c.id,
+        Archive.c.size,
+        Archive.c.member_count,
         ChoiceHistory.c.created,
     ])
     return [
@@ -72,41 +186,159 @@ async def get_chosen_submissions_info(
             team=team,
             archive_id=info['id'],
             chosen_at=info['created'],
+            size=info['size'],
+            member_count=info['member_count'],
         )
         for team, info in submissions_by_team.items()
     ]
 
 
-async def get_chosen_submissions(
+class ChosenArchive(TypedDict):
+    archive_id: int
+    sha256: str
+
+
+async def get_chosen_archives(
     database: databases.Database,
-) -> dict[str, tuple[int, bytes]]:
+) -> dict[str, ChosenArchive]:
     """
-    Return a mapping of teams to their the chosen archive.
+    Return a mapping of teams to their the chosen archive, without content.
     """
     submissions_by_team = await _get_chosen_submissions_data(database, [
         Archive.c.id,
-        Archive.c.content,
+        Archive.c.sha256,
     ])
     return {
-        team: (row['id'], row['content'])
+        team: ChosenArchive(archive_id=row['id'], sha256=row['sha256'])
         for team, row in submissions_by_team.items()
     }
 
 
-def summarise(submissions: dict[str, tuple[int, bytes]]) -> str:
+def summarise(submissions: Mapping[str, tuple[int, object]]) -> str:
     return "".join(
         f"{team}: {id_}\n"
         for team, (id_, _) in sorted(submissions.items())
     )
 
 
-async def collect_submissions(
-    database: databases.Database,
+def _bundle_member(name: str) -> ZipInfo:
+    # Use a fixed timestamp so that the same choices always produce an
+    # identical bundle.
+    info = ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.external_attr = 0o600 << 16
+    return info
+
+
+class PreviousSubmissions(NamedTuple):
+    """
+    A bundle of submissions written previously, along with the archives which
+    it contains.
+    """
+    zipfile: ZipFile
+    archives: Mapping[str, ChosenArchive]
+
+
+def _bundle_name(team: str) -> str:
+    return f'{team.upper()}.zip'
+
+
+def _copy_previous(
+    previous: PreviousSubmissions | None,
+    team: str,
+    info: ChosenArchive,
+    dest: IO[bytes],
+) -> bool:
+    if previous is None or previous.archives.get(team) != info:
+        return False
+
+    try:
+        source = previous.zipfile.open(_bundle_name(team))
+    except KeyError:
+        return False
+
+    with source:
+        shutil.copyfileobj(source, dest)
+    return True
+
+
+async def _write_submissions(
+    archives: Mapping[str, ChosenArchive],
+    blob_store: BlobStore,
     zipfile: ZipFile,
+    previous: PreviousSubmissions | None = None,
+) -> AsyncIterator[None]:
+    """
+    Write the given archives into the given ZIP file, one chunk at a time.
+
+    Yields after each chunk is written, so that callers can consume the
+    output as it is generated. Archives which are unchanged from the given
+    previous bundle, if any, are copied from it rather than loaded from the
+    blob store.
+    """
+    for team, info in sorted(archives.items()):
+        with zipfile.open(_bundle_member(_bundle_name(team)), mode='w') as f:
+            if _copy_previous(previous, team, info, f):
+                yield
+                continue
+
+            async for chunk in blob_store.stream(info['sha256']):
+                f.write(chunk)
+                yield
+
+    zipfile.writestr(_bundle_member('summary.txt'), summarise({
+        team: (info['archive_id'], None)
+        for team, info in archives.items()
+    }))
+
+
+async def write_submissions(
+    archives: Mapping[str, ChosenArchive],
+    blob_store: BlobStore,
+    zipfile: ZipFile,
+    previous: PreviousSubmissions | None = None,
 ) -> None:
-    submissions = await get_chosen_submissions(database)
+    async for _ in _write_submissions(archives, blob_store, zipfile, previous):
+        pass
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    A write-only, non-seekable file which buffers what is written to it until
+    it is drained.
+    """
 
-    for team, (_, content) in submissions.items():
-        zipfile.writestr(f'{team.upper()}.zip', content)
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Buffer) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        return len(chunk)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_bundle(
+    archives: Mapping[str, ChosenArchive],
+    blob_store: BlobStore,
+) -> AsyncIterator[bytes]:
+    """
+    Generate a ZIP file of the given archives incrementally.
+
+    The output is yielded as each chunk of each archive is written, so the
+    bundle as a whole is never held in memory.
+    """
+    sink = _StreamSink()
+    with ZipFile(sink, mode='w') as zf:
+        async for _ in _write_submissions(archives, blob_store, zf):
+            if data := sink.drain():
+                yield data
 
-    zipfile.writestr('summary.txt', summarise(submissions))
+    yield sink.drain()
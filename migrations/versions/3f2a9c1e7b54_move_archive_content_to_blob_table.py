@@ -0,0 +1,81 @@
+"""Move archive content to a content-addressed blob table
+
+Revision ID: 3f2a9c1e7b54
+Revises: d4e3b890e3d7
+Create Date: 2026-10-18 10:12:31.482910
+
+"""
+from __future__ import annotations
+
+import hashlib
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1e7b54'
+down_revision = 'd4e3b890e3d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    blob = op.create_table(
+        'blob',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('content', sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint('sha256'),
+    )
+
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+
+    archive = sa.table(
+        'archive',
+        sa.column('id', sa.Integer()),
+        sa.column('content', sa.LargeBinary()),
+        sa.column('sha256', sa.String()),
+    )
+
+    connection = op.get_bind()
+    known = set()
+    ids = [x for x, in connection.execute(sa.select([archive.c.id]))]
+    for archive_id in ids:
+        content = connection.execute(
+            sa.select([archive.c.content]).where(archive.c.id == archive_id),
+        ).scalar()
+        sha256 = hashlib.sha256(content).hexdigest()
+
+        if sha256 not in known:
+            connection.execute(blob.insert().values(sha256=sha256, content=content))
+            known.add(sha256)
+
+        connection.execute(
+            archive.update().where(
+                archive.c.id == archive_id,
+            ).values(sha256=sha256),
+        )
+
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.alter_column('sha256', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_foreign_key('fk_archive_sha256_blob', 'blob', ['sha256'], ['sha256'])
+        batch_op.drop_column('content')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.add_column(sa.Column('content', sa.LargeBinary(), nullable=True))
+
+    connection = op.get_bind()
+    connection.execute(sa.text(
+        'UPDATE archive SET content = ('
+        'SELECT content FROM blob WHERE blob.sha256 = archive.sha256'
+        ')',
+    ))
+
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.alter_column('content', existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_constraint('fk_archive_sha256_blob', type_='foreignkey')
+        batch_op.drop_column('sha256')
+
+    op.drop_table('blob')
@@ -0,0 +1,35 @@
+"""Add archive metadata
+
+Existing archives are left with null metadata; run
+`python -m code_submitter.backfill_metadata` to fill it in.
+
+Revision ID: 5d2c8a7e9b13
+Revises: b7e4f19a0c62
+Create Date: 2026-10-18 15:21:44.518301
+
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5d2c8a7e9b13'
+down_revision = 'b7e4f19a0c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('archive', sa.Column('size', sa.Integer(), nullable=True))
+    op.add_column('archive', sa.Column('member_count', sa.Integer(), nullable=True))
+    op.add_column('archive', sa.Column('uncompressed_size', sa.Integer(), nullable=True))
+    op.add_column('archive', sa.Column('members', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.drop_column('members')
+        batch_op.drop_column('uncompressed_size')
+        batch_op.drop_column('member_count')
+        batch_op.drop_column('size')
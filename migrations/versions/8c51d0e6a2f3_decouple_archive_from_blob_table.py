@@ -0,0 +1,29 @@
+"""Decouple archive from the blob table
+
+Archive content may now live in a blob store outside the database, so the
+archive's key can no longer be constrained to a row of the blob table.
+
+Revision ID: 8c51d0e6a2f3
+Revises: 3f2a9c1e7b54
+Create Date: 2026-10-18 11:40:07.219355
+
+"""
+from __future__ import annotations
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c51d0e6a2f3'
+down_revision = '3f2a9c1e7b54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.drop_constraint('fk_archive_sha256_blob', type_='foreignkey')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('archive') as batch_op:
+        batch_op.create_foreign_key('fk_archive_sha256_blob', 'blob', ['sha256'], ['sha256'])
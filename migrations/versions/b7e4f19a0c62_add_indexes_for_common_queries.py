@@ -0,0 +1,40 @@
+"""Add indexes for common queries
+
+Revision ID: b7e4f19a0c62
+Revises: 8c51d0e6a2f3
+Create Date: 2026-10-18 13:05:52.730114
+
+"""
+from __future__ import annotations
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4f19a0c62'
+down_revision = '8c51d0e6a2f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_archive_team_created',
+        'archive',
+        ['team', 'created'],
+    )
+    op.create_index(
+        'ix_archive_username_created',
+        'archive',
+        ['username', 'created'],
+    )
+    op.create_index(
+        'ix_choice_history_archive_id_created',
+        'choice_history',
+        ['archive_id', 'created'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_choice_history_archive_id_created', table_name='choice_history')
+    op.drop_index('ix_archive_username_created', table_name='archive')
+    op.drop_index('ix_archive_team_created', table_name='archive')
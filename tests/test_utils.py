@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import io
 import json
 import asyncio
+import hashlib
 import tempfile
 import unittest
 from typing import IO, TypeVar
@@ -14,6 +16,8 @@ from alembic.config import Config
 from starlette.config import environ
 
 from code_submitter.auth import NemesisUserInfo, DummyNemesisBackend
+from code_submitter.tables import Archive
+from code_submitter.storage import BlobStore
 
 T = TypeVar('T')
 
@@ -82,6 +86,7 @@ class AsyncTestCase(unittest.TestCase):
 
 class DatabaseTestCase(AsyncTestCase):
     database: databases.Database
+    blob_store: BlobStore
 
     @classmethod
     def setUpClass(cls) -> None:
@@ -89,9 +94,17 @@ class DatabaseTestCase(AsyncTestCase):
         ensure_database_configured()
 
         # Import must happen after TESTING environment setup
-        from code_submitter.server import database
+        from code_submitter.server import database, blob_store
 
         cls.database = database
+        cls.blob_store = blob_store
+
+    def insert_archive(self, *, content: bytes, **values: object) -> None:
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.await_(self.blob_store.put(sha256, io.BytesIO(content)))
+        self.await_(self.database.execute(
+            Archive.insert().values(sha256=sha256, **values),
+        ))
 
 
 class InTransactionTestCase(DatabaseTestCase):
@@ -1,15 +1,30 @@
 from __future__ import annotations
 
+import gc
 import io
+import re
+import html
+import base64
+import hashlib
 import zipfile
 import datetime
+import tempfile
+import warnings
+import contextlib
 from unittest import mock
 
 import httpx
 import test_utils
+from sqlalchemy import create_engine
+from starlette.types import Message
 from starlette.testclient import TestClient
 
-from code_submitter.tables import Archive, ChoiceHistory
+from code_submitter import uploads
+from code_submitter.tables import Blob, Archive, metadata, ChoiceHistory
+from code_submitter.bundles import BundleCache
+from code_submitter.caching import GroupedTTLCache
+from code_submitter.metrics import InstrumentedDatabase
+from code_submitter.storage import DatabaseBlobStore, FileSystemBlobStore
 
 
 class AppTests(test_utils.DatabaseTestCase):
@@ -25,6 +40,23 @@ class AppTests(test_utils.DatabaseTestCase):
             # ASGI server and in turn work correctly under proxy.
             return f'http://testserver{app.url_path_for(name, **path_params)}'
 
+        # Archive ids are re-used between tests, so each needs its own cache.
+        bundle_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(bundle_dir.cleanup)
+        patcher = mock.patch(
+            'code_submitter.server.bundle_cache',
+            BundleCache(bundle_dir.name),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Similarly each test needs an empty homepage cache.
+        homepage_cache: GroupedTTLCache[str | None, str, object]
+        homepage_cache = GroupedTTLCache(max_size=10, ttl=60)
+        cache_patcher = mock.patch('code_submitter.server.homepage_cache', homepage_cache)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
         test_client = TestClient(app)
         self.session = test_client.__enter__()
         self.session.auth = httpx.BasicAuth('test_user', 'test_pass')
@@ -41,6 +73,27 @@ class AppTests(test_utils.DatabaseTestCase):
         html = response.text
         self.assertIn("Upload a new submission", html)
 
+    def test_server_timing(self) -> None:
+        response = self.session.get(self.url_for('homepage'))
+        self.assertEqual(200, response.status_code)
+
+        self.assertRegex(
+            response.headers['Server-Timing'],
+            r'^db;dur=[0-9.]+;desc="2 queries", app;dur=[0-9.]+$',
+        )
+
+    def test_database_pool_exhausted(self) -> None:
+        from code_submitter.pool import PoolTimeout
+
+        with mock.patch(
+            'code_submitter.server.database.fetch_one',
+            side_effect=PoolTimeout(5),
+        ):
+            response = self.session.get(self.url_for('homepage'))
+
+        self.assertEqual(503, response.status_code)
+        self.assertIn('Retry-After', response.headers)
+
     def test_app_requires_auth(self) -> None:
         self.session.auth = None  # type: ignore[assignment]
         response = self.session.get(self.url_for('homepage'))
@@ -49,34 +102,28 @@ class AppTests(test_utils.DatabaseTestCase):
         self.assertIn(' realm=', response.headers['WWW-Authenticate'])
 
     def test_shows_own_and_own_team_uploads(self) -> None:
-        self.await_(self.database.execute(
-            # Another team's archive we shouldn't be able to see.
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-                created=datetime.datetime(2020, 8, 8, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=2222222222,
-                content=b'',
-                username='a_colleague',
-                team='SRZ2',
-                created=datetime.datetime(2020, 2, 2, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=1111111111,
-                content=b'',
-                username='test_user',
-                team='SRZ2',
-                created=datetime.datetime(2020, 1, 1, 12, 0),
-            ),
-        ))
+        # Another team's archive we shouldn't be able to see.
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
+        self.insert_archive(
+            id=2222222222,
+            content=b'',
+            username='a_colleague',
+            team='SRZ2',
+            created=datetime.datetime(2020, 2, 2, 12, 0),
+        )
+        self.insert_archive(
+            id=1111111111,
+            content=b'',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
 
         response = self.session.get(self.url_for('homepage'))
         self.assertEqual(200, response.status_code)
@@ -94,37 +141,106 @@ class AppTests(test_utils.DatabaseTestCase):
         self.assertNotIn('8888888888', html)
         self.assertNotIn('someone_else', html)
 
-    def test_blueshirt_sees_all_latest_chosen_archives(self) -> None:
-        self.session.auth = httpx.BasicAuth('blueshirt', 'blueshirt')
+    def test_shows_own_uploads_from_other_teams(self) -> None:
+        self.insert_archive(
+            id=3333333333,
+            content=b'',
+            username='test_user',
+            team='OLD',
+            created=datetime.datetime(2020, 3, 3, 12, 0),
+        )
 
-        self.await_(self.database.execute(
-            # Another team's archive we shouldn't be able to see.
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-                created=datetime.datetime(2020, 8, 8, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=2222222222,
+        response = self.session.get(self.url_for('homepage'))
+        self.assertEqual(200, response.status_code)
+
+        html = response.text
+        self.assertIn('3333333333', html)
+
+    def test_shows_upload_metadata(self) -> None:
+        self.insert_archive(
+            id=3333333333,
+            content=b'',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 3, 3, 12, 0),
+            size=2048,
+            member_count=42,
+        )
+
+        response = self.session.get(self.url_for('homepage'))
+        self.assertEqual(200, response.status_code)
+
+        html = response.text
+        self.assertIn('2.0 kB', html)
+        self.assertIn('<td>42</td>', html)
+
+    def test_paginates_uploads(self) -> None:
+        created = [
+            datetime.datetime(2020, 1, 1, 12, 0),
+            datetime.datetime(2020, 1, 2, 12, 0),
+            datetime.datetime(2020, 1, 2, 12, 0),
+            datetime.datetime(2020, 1, 2, 12, 0),
+            datetime.datetime(2020, 1, 3, 12, 0),
+        ]
+        for archive_id, when in enumerate(created, start=1000000001):
+            self.insert_archive(
+                id=archive_id,
                 content=b'',
                 username='a_colleague',
                 team='SRZ2',
-                created=datetime.datetime(2020, 2, 2, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=1111111111,
-                content=b'',
-                username='test_user',
-                team='SRZ2',
-                created=datetime.datetime(2020, 1, 1, 12, 0),
-            ),
-        ))
+                created=when,
+            )
+
+        seen = []
+        url = self.url_for('homepage')
+        with mock.patch('code_submitter.config.UPLOADS_PAGE_SIZE', 2):
+            for _ in range(len(created)):
+                response = self.session.get(url)
+                self.assertEqual(200, response.status_code)
+
+                page = re.findall(r'<td>(100000000\d)</td>', response.text)
+                self.assertLessEqual(len(page), 2)
+                seen.extend(page)
+
+                match = re.search(r'href="([^"]*\?before=\d+)"', response.text)
+                if match is None:
+                    break
+                url = html.unescape(match.group(1))
+
+        self.assertEqual(
+            ['1000000005', '1000000004', '1000000003', '1000000002', '1000000001'],
+            seen,
+        )
+
+    def test_invalid_page(self) -> None:
+        response = self.session.get(self.url_for('homepage') + '?before=bees')
+        self.assertEqual(400, response.status_code)
+
+    def test_blueshirt_sees_all_latest_chosen_archives(self) -> None:
+        self.session.auth = httpx.BasicAuth('blueshirt', 'blueshirt')
+
+        # Another team's archive we shouldn't be able to see.
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
+        self.insert_archive(
+            id=2222222222,
+            content=b'',
+            username='a_colleague',
+            team='SRZ2',
+            created=datetime.datetime(2020, 2, 2, 12, 0),
+        )
+        self.insert_archive(
+            id=1111111111,
+            content=b'',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
         self.await_(self.database.execute(
             ChoiceHistory.insert().values(
                 archive_id=8888888888,
@@ -167,34 +283,28 @@ class AppTests(test_utils.DatabaseTestCase):
         self.assertIn('ABC', html)
 
     def test_shows_chosen_archive(self) -> None:
-        self.await_(self.database.execute(
-            # Another team's archive we shouldn't be able to see.
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-                created=datetime.datetime(2020, 8, 8, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=2222222222,
-                content=b'',
-                username='a_colleague',
-                team='SRZ2',
-                created=datetime.datetime(2020, 2, 2, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=1111111111,
-                content=b'',
-                username='test_user',
-                team='SRZ2',
-                created=datetime.datetime(2020, 1, 1, 12, 0),
-            ),
-        ))
+        # Another team's archive we shouldn't be able to see.
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
+        self.insert_archive(
+            id=2222222222,
+            content=b'',
+            username='a_colleague',
+            team='SRZ2',
+            created=datetime.datetime(2020, 2, 2, 12, 0),
+        )
+        self.insert_archive(
+            id=1111111111,
+            content=b'',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
         self.await_(self.database.execute(
             # An invalid choice -- you shouldn't be able to select archives for
             # another team.
@@ -254,7 +364,7 @@ class AppTests(test_utils.DatabaseTestCase):
 
         self.assertEqual(
             [contents.getvalue()],
-            [x['content'] for x in archives],
+            [self.await_(self.blob_store.get(x['sha256'])) for x in archives],
             "Wrong content stored in the database",
         )
 
@@ -270,11 +380,68 @@ class AppTests(test_utils.DatabaseTestCase):
             "Wrong team stored in the database",
         )
 
+        archive, = archives
+        self.assertEqual(len(contents.getvalue()), archive['size'])
+        self.assertEqual(1, archive['member_count'])
+        self.assertEqual(len('print("I am a robot")'), archive['uncompressed_size'])
+        self.assertEqual(['robot.py'], archive['members'])
+
         choices = self.await_(
             self.database.fetch_all(ChoiceHistory.select()),
         )
         self.assertEqual([], choices, "Should not have created a choice")
 
+    def test_upload_without_replica_sets_no_cookie(self) -> None:
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        response = self.session.post(
+            self.url_for('upload'),
+            files={'archive': ('whatever.zip', contents.getvalue(), 'application/zip')},
+            follow_redirects=False,
+        )
+        self.assertEqual(302, response.status_code)
+        self.assertNotIn('Set-Cookie', response.headers)
+
+    def test_homepage_cached_until_upload(self) -> None:
+        self.insert_archive(
+            id=1111111111,
+            content=b'',
+            username='a_colleague',
+            team='SRZ2',
+        )
+
+        response = self.session.get(self.url_for('homepage'))
+        self.assertIn(self.url_for('archive', archive_id='1111111111'), response.text)
+
+        # Written without going through the app, so not seen until the cache
+        # is invalidated.
+        self.insert_archive(
+            id=2222222222,
+            content=b'',
+            username='a_colleague',
+            team='SRZ2',
+        )
+
+        response = self.session.get(self.url_for('homepage'))
+        self.assertIn('desc="0 queries"', response.headers['Server-Timing'])
+        self.assertNotIn(
+            self.url_for('archive', archive_id='2222222222'),
+            response.text,
+        )
+
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        response = self.session.post(
+            self.url_for('upload'),
+            files={'archive': ('whatever.zip', contents.getvalue(), 'application/zip')},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIn(self.url_for('archive', archive_id='2222222222'), response.text)
+
     def test_upload_and_choose_file(self) -> None:
         contents = io.BytesIO()
         with zipfile.ZipFile(contents, mode='w') as zip_file:
@@ -298,7 +465,7 @@ class AppTests(test_utils.DatabaseTestCase):
 
         self.assertEqual(
             contents.getvalue(),
-            archive['content'],
+            self.await_(self.blob_store.get(archive['sha256'])),
             "Wrong content stored in the database",
         )
 
@@ -316,6 +483,40 @@ class AppTests(test_utils.DatabaseTestCase):
             "Should not have created a choice",
         )
 
+    def test_upload_same_file_twice_stores_content_once(self) -> None:
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        for _ in range(2):
+            response = self.session.post(
+                self.url_for('upload'),
+                data={'choose': 'on'},
+                files={
+                    'archive': ('whatever.zip', contents.getvalue(), 'application/zip'),
+                },
+                follow_redirects=False,
+            )
+            self.assertEqual(302, response.status_code)
+
+        archives = self.await_(
+            self.database.fetch_all(Archive.select()),
+        )
+        self.assertEqual(2, len(archives), "Should have recorded both uploads")
+
+        blobs = self.await_(
+            self.database.fetch_all(Blob.select()),
+        )
+        self.assertEqual(
+            [contents.getvalue()],
+            [x['content'] for x in blobs],
+            "Should have stored the content once",
+        )
+        self.assertEqual(
+            {x['sha256'] for x in blobs},
+            {x['sha256'] for x in archives},
+        )
+
     def test_upload_bad_file(self) -> None:
         response = self.session.post(
             self.url_for('upload'),
@@ -334,6 +535,10 @@ class AppTests(test_utils.DatabaseTestCase):
         self.assertEqual([], choices, "Should not have created a choice")
 
     def test_upload_archive_without_robot_py(self) -> None:
+        from code_submitter import metrics
+
+        rejections = metrics.UPLOAD_REJECTIONS.value(reason='missing_file')
+
         contents = io.BytesIO()
         with zipfile.ZipFile(contents, mode='w') as zip_file:
             zip_file.writestr('main.py', 'print("I am a robot")')
@@ -343,6 +548,10 @@ class AppTests(test_utils.DatabaseTestCase):
             files={'archive': ('whatever.zip', contents.getvalue(), 'application/zip')},
         )
         self.assertEqual(400, response.status_code)
+        self.assertEqual(
+            rejections + 1,
+            metrics.UPLOAD_REJECTIONS.value(reason='missing_file'),
+        )
 
         archives = self.await_(
             self.database.fetch_all(Archive.select()),
@@ -354,63 +563,222 @@ class AppTests(test_utils.DatabaseTestCase):
         )
         self.assertEqual([], choices, "Should not have created a choice")
 
+    def test_upload_too_large(self) -> None:
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")' * 100)
+
+        with mock.patch('code_submitter.config.MAX_ARCHIVE_SIZE', 100):
+            response = self.session.post(
+                self.url_for('upload'),
+                files={
+                    'archive': ('whatever.zip', contents.getvalue(), 'application/zip'),
+                },
+            )
+        self.assertEqual(413, response.status_code)
+
+        archives = self.await_(
+            self.database.fetch_all(Archive.select()),
+        )
+        self.assertEqual([], archives, "Wrong content stored in the database")
+
+    def test_upload_declared_too_large(self) -> None:
+        with mock.patch('code_submitter.config.MAX_ARCHIVE_SIZE', 100):
+            response = self.session.post(
+                self.url_for('upload'),
+                content=b'x' * (100 + uploads.FORM_OVERHEAD + 1),
+                headers={'Content-Type': 'multipart/form-data; boundary=bees'},
+            )
+        self.assertEqual(413, response.status_code)
+
+    def test_upload_body_too_large_rejected_while_streaming(self) -> None:
+        from code_submitter.server import app
+
+        preamble = (
+            b'--bees\r\n'
+            b'Content-Disposition: form-data; name="archive"; filename="a.zip"\r\n'
+            b'Content-Type: application/zip\r\n'
+            b'\r\n'
+        )
+        chunks_read = 0
+
+        async def receive() -> Message:
+            nonlocal chunks_read
+            chunks_read += 1
+            body = preamble if chunks_read == 1 else b'x' * 100
+            return {'type': 'http.request', 'body': body, 'more_body': True}
+
+        messages: list[Message] = []
+
+        async def send(message: Message) -> None:
+            messages.append(message)
+
+        credentials = base64.b64encode(b'test_user:test_pass')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'POST',
+            'scheme': 'http',
+            'server': ('testserver', 80),
+            'path': '/upload',
+            'raw_path': b'/upload',
+            'root_path': '',
+            'query_string': b'',
+            'headers': [
+                (b'authorization', b'Basic ' + credentials),
+                (b'content-type', b'multipart/form-data; boundary=bees'),
+                (b'transfer-encoding', b'chunked'),
+            ],
+            'app': app,
+        }
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch('code_submitter.config.MAX_ARCHIVE_SIZE', 0))
+            stack.enter_context(mock.patch('code_submitter.uploads.FORM_OVERHEAD', 1000))
+            caught = stack.enter_context(warnings.catch_warnings(record=True))
+            warnings.simplefilter('always', ResourceWarning)
+
+            self.await_(app(scope, receive, send))
+            # Unclosed files are only reported when they're collected
+            gc.collect()
+
+        self.assertEqual(413, messages[0]['status'])
+        # The preamble plus nine chunks exceeds the limit
+        self.assertEqual(10, chunks_read, "Should stop reading once over the limit")
+        self.assertEqual(
+            [],
+            [x.message for x in caught if issubclass(x.category, ResourceWarning)],
+            "Should close the partially received upload",
+        )
+
+    def test_upload_too_many_parts(self) -> None:
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        with mock.patch('code_submitter.config.MAX_UPLOAD_PARTS', 1):
+            response = self.session.post(
+                self.url_for('upload'),
+                data={'choose': 'on'},
+                files={
+                    'archive': ('whatever.zip', contents.getvalue(), 'application/zip'),
+                    'other': ('other.zip', contents.getvalue(), 'application/zip'),
+                },
+            )
+        self.assertEqual(400, response.status_code)
+
+        archives = self.await_(
+            self.database.fetch_all(Archive.select()),
+        )
+        self.assertEqual([], archives, "Wrong content stored in the database")
+
+    def test_upload_too_many_concurrent(self) -> None:
+        from code_submitter.server import upload_slots
+
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        with mock.patch.object(upload_slots, 'limit', 1), upload_slots.acquire():
+            response = self.session.post(
+                self.url_for('upload'),
+                files={
+                    'archive': ('whatever.zip', contents.getvalue(), 'application/zip'),
+                },
+            )
+        self.assertEqual(503, response.status_code)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(0, upload_slots.in_use)
+
+        archives = self.await_(
+            self.database.fetch_all(Archive.select()),
+        )
+        self.assertEqual([], archives, "Wrong content stored in the database")
+
+        response = self.session.post(
+            self.url_for('upload'),
+            files={
+                'archive': ('whatever.zip', contents.getvalue(), 'application/zip'),
+            },
+            follow_redirects=False,
+        )
+        self.assertEqual(302, response.status_code)
+
     def test_download_requires_team(self) -> None:
         self.session.auth = httpx.BasicAuth('no_teams_blueshirt', 'blueshirt')
 
-        self.await_(self.database.execute(
-            # Another team's archive we shouldn't be able to see.
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-            ),
-        ))
+        # Another team's archive we shouldn't be able to see.
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+        )
 
         response = self.session.get(self.url_for('archive', archive_id='8888888888'))
         self.assertEqual(403, response.status_code)
 
     def test_download_requires_matching_team(self) -> None:
-        self.await_(self.database.execute(
-            # Another team's archive we shouldn't be able to see.
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-            ),
-        ))
+        # Another team's archive we shouldn't be able to see.
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+        )
 
         response = self.session.get(self.url_for('archive', archive_id='8888888888'))
         self.assertEqual(404, response.status_code)
 
     def test_download_own_uploads(self) -> None:
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=1111111111,
-                content=b'beeees',
-                username='test_user',
-                team='SRZ2',
-            ),
-        ))
+        self.insert_archive(
+            id=1111111111,
+            content=b'beeees',
+            username='test_user',
+            team='SRZ2',
+        )
 
         response = self.session.get(self.url_for('archive', archive_id='1111111111'))
         self.assertEqual(200, response.status_code)
         self.assertEqual(b'beeees', response.content)
 
     def test_download_own_team_uploads(self) -> None:
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=2222222222,
+        self.insert_archive(
+            id=2222222222,
+            content=b'beeees',
+            username='a_colleague',
+            team='SRZ2',
+        )
+
+        response = self.session.get(self.url_for('archive', archive_id='2222222222'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'beeees', response.content)
+
+    def test_download_from_file_system_store(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = FileSystemBlobStore(self.database, path=tmp.name)
+
+        with mock.patch('code_submitter.server.blob_store', store):
+            self.blob_store = store
+            self.insert_archive(
+                id=1111111111,
                 content=b'beeees',
-                username='a_colleague',
+                username='test_user',
                 team='SRZ2',
-            ),
-        ))
+            )
+
+            response = self.session.get(
+                self.url_for('archive', archive_id='1111111111'),
+            )
 
-        response = self.session.get(self.url_for('archive', archive_id='2222222222'))
         self.assertEqual(200, response.status_code)
         self.assertEqual(b'beeees', response.content)
+        self.assertEqual(
+            'attachment; filename="upload-1111111111.zip"',
+            response.headers['Content-Disposition'],
+        )
 
     def test_download_missing_uploads(self) -> None:
         response = self.session.get(self.url_for('archive', archive_id='4'))
@@ -452,15 +820,13 @@ class AppTests(test_utils.DatabaseTestCase):
     def test_download_submissions(self) -> None:
         self.session.auth = httpx.BasicAuth('blueshirt', 'blueshirt')
 
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=8888888888,
-                content=b'',
-                username='someone_else',
-                team='ABC',
-                created=datetime.datetime(2020, 8, 8, 12, 0),
-            ),
-        ))
+        self.insert_archive(
+            id=8888888888,
+            content=b'',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
         self.await_(self.database.execute(
             ChoiceHistory.insert().values(
                 archive_id=8888888888,
@@ -477,3 +843,225 @@ class AppTests(test_utils.DatabaseTestCase):
                 ['summary.txt', 'ABC.zip'],
                 zf.namelist(),
             )
+
+    def test_download_submissions_etag(self) -> None:
+        self.session.auth = httpx.BasicAuth('blueshirt', 'blueshirt')
+
+        self.insert_archive(
+            id=8888888888,
+            content=b'8888888888',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
+        self.insert_archive(
+            id=9999999999,
+            content=b'9999999999',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+        )
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=8888888888,
+                username='test_user',
+                created=datetime.datetime(2020, 9, 9, 12, 0),
+            ),
+        ))
+
+        first = self.session.get(self.url_for('download_submissions'))
+        self.assertEqual(200, first.status_code)
+        etag = first.headers['ETag']
+
+        with mock.patch.object(self.blob_store, 'stream') as mock_stream:
+            second = self.session.get(self.url_for('download_submissions'))
+        self.assertEqual(200, second.status_code)
+        self.assertEqual(etag, second.headers['ETag'])
+        self.assertEqual(first.content, second.content)
+        mock_stream.assert_not_called()
+
+        not_modified = self.session.get(
+            self.url_for('download_submissions'),
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(304, not_modified.status_code)
+        self.assertEqual(b'', not_modified.content)
+
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=9999999999,
+                username='test_user',
+                created=datetime.datetime(2020, 10, 10, 12, 0),
+            ),
+        ))
+
+        changed = self.session.get(
+            self.url_for('download_submissions'),
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(200, changed.status_code)
+        self.assertNotEqual(etag, changed.headers['ETag'])
+
+        with zipfile.ZipFile(io.BytesIO(changed.content)) as zf:
+            self.assertEqual(b'9999999999', zf.read('ABC.zip'))
+
+    def test_metrics_requires_blueshirt(self) -> None:
+        response = self.session.get(self.url_for('metrics_endpoint'))
+        self.assertEqual(403, response.status_code)
+
+    def test_metrics(self) -> None:
+        from code_submitter import metrics
+
+        rejections = metrics.UPLOAD_REJECTIONS.value(reason='not_zip')
+
+        response = self.session.post(
+            self.url_for('upload'),
+            files={'archive': ('whatever.zip', b'should-be-a-zip', 'application/zip')},
+        )
+        self.assertEqual(400, response.status_code)
+
+        self.assertEqual(
+            rejections + 1,
+            metrics.UPLOAD_REJECTIONS.value(reason='not_zip'),
+        )
+
+        # Queries the database
+        self.session.get(self.url_for('homepage'))
+
+        self.session.auth = httpx.BasicAuth('blueshirt', 'blueshirt')
+        response = self.session.get(self.url_for('metrics_endpoint'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(metrics.CONTENT_TYPE, response.headers['Content-Type'])
+
+        text = response.text
+        self.assertIn(
+            'code_submitter_request_duration_seconds_count'
+            '{method="POST",route="/upload",status="400"}',
+            text,
+        )
+        self.assertIn(
+            'code_submitter_auth_duration_seconds_count{result="success"}',
+            text,
+        )
+        self.assertIn(
+            'code_submitter_db_query_duration_seconds_count{operation="fetch_all"}',
+            text,
+        )
+
+
+class ReadReplicaTests(test_utils.DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        # App import must happen after TESTING environment setup
+        from code_submitter.server import app
+
+        self.url_for = lambda name, **path_params: (
+            f'http://testserver{app.url_path_for(name, **path_params)}'
+        )
+
+        # A separate database stands in for the replica, which (as if it were
+        # lagging) has none of the primary's data.
+        replica_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(replica_file.close)
+        replica_url = f'sqlite:///{replica_file.name}'
+        metadata.create_all(create_engine(replica_url))
+
+        self.replica = InstrumentedDatabase(replica_url)
+        self.await_(self.replica.connect())
+        self.addCleanup(lambda: self.await_(self.replica.disconnect()))
+        self.replica_blob_store = DatabaseBlobStore(self.replica)
+
+        for name, value in (
+            ('read_database', self.replica),
+            ('read_blob_store', self.replica_blob_store),
+        ):
+            patcher = mock.patch(f'code_submitter.server.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        homepage_cache: GroupedTTLCache[str | None, str, object]
+        homepage_cache = GroupedTTLCache(max_size=10, ttl=60)
+        cache_patcher = mock.patch('code_submitter.server.homepage_cache', homepage_cache)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+        test_client = TestClient(app)
+        self.session = test_client.__enter__()
+        self.addCleanup(self.session.__exit__, None, None, None)
+        self.session.auth = httpx.BasicAuth('test_user', 'test_pass')
+
+    def insert_replica_archive(self, *, content: bytes, **values: object) -> None:
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.await_(self.replica_blob_store.put(sha256, io.BytesIO(content)))
+        self.await_(self.replica.execute(
+            Archive.insert().values(sha256=sha256, **values),
+        ))
+
+    def test_homepage_reads_from_replica(self) -> None:
+        self.insert_replica_archive(
+            id=1111111111,
+            content=b'replica',
+            username='test_user',
+            team='SRZ2',
+        )
+        self.insert_archive(
+            id=2222222222,
+            content=b'primary',
+            username='test_user',
+            team='SRZ2',
+        )
+
+        response = self.session.get(self.url_for('homepage'))
+        self.assertEqual(200, response.status_code)
+        self.assertIn(self.url_for('archive', archive_id='1111111111'), response.text)
+        self.assertNotIn(
+            self.url_for('archive', archive_id='2222222222'),
+            response.text,
+        )
+
+    def test_download_reads_from_replica(self) -> None:
+        self.insert_replica_archive(
+            id=1111111111,
+            content=b'replica',
+            username='test_user',
+            team='SRZ2',
+        )
+
+        response = self.session.get(self.url_for('archive', archive_id='1111111111'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'replica', response.content)
+
+    def test_uploader_reads_own_writes(self) -> None:
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zip_file:
+            zip_file.writestr('robot.py', 'print("I am a robot")')
+
+        response = self.session.post(
+            self.url_for('upload'),
+            files={'archive': ('whatever.zip', contents.getvalue(), 'application/zip')},
+            follow_redirects=False,
+        )
+        self.assertEqual(302, response.status_code)
+        self.assertIn('Max-Age=30', response.headers['Set-Cookie'])
+
+        archive, = self.await_(self.database.fetch_all(Archive.select()))
+        self.assertEqual(
+            [],
+            self.await_(self.replica.fetch_all(Archive.select())),
+            "Upload should only be written to the primary",
+        )
+        archive_url = self.url_for('archive', archive_id=str(archive['id']))
+
+        response = self.session.get(self.url_for('homepage'))
+        self.assertEqual(200, response.status_code)
+        self.assertIn(archive_url, response.text)
+
+        response = self.session.get(archive_url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(contents.getvalue(), response.content)
+
+        # Other clients still read from the replica
+        self.session.cookies.clear()
+        response = self.session.get(self.url_for('homepage'))
+        self.assertNotIn(archive_url, response.text)
@@ -1,20 +1,34 @@
 from __future__ import annotations
 
+import os
+import time
+import tempfile
+import threading
 from typing import Any, TypeVar
 from pathlib import Path
 from collections.abc import Callable, Coroutine
 
 import test_utils
+from starlette.routing import Route
 from starlette.requests import Request
 from starlette.responses import Response, JSONResponse
+from starlette.middleware import Middleware
+from starlette.testclient import TestClient
 from starlette.applications import Starlette
 from starlette.authentication import AuthenticationError
+from starlette.middleware.authentication import AuthenticationMiddleware
 
 from code_submitter.auth import (
     FileBackend,
+    SessionData,
+    DummyBackend,
     NemesisBackend,
     BLUESHIRT_SCOPE,
     NemesisUserInfo,
+    ValidationResult,
+    SessionAuthBackend,
+    auth_required_response,
+    SessionCookieMiddleware,
 )
 
 TEndpoint = TypeVar(  # type: ignore[explicit-any]
@@ -116,6 +130,81 @@ class NemesisAuthTests(test_utils.AsyncTestCase):
             "Wrong scopes for user",
         )
 
+    def test_caches_successful_validation(self) -> None:
+        calls = []
+
+        @self.nemesis_route('/user/user')
+        async def endpoint(request: Request) -> Response:
+            calls.append(request)
+            return JSONResponse(self.info)
+
+        first = self.await_(self.backend.validate('user', 'pass'))
+        second = self.await_(self.backend.validate('user', 'pass'))
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(calls), "Should only have contacted nemesis once")
+        self.assertEqual(1, self.backend.cache.hits)
+        self.assertEqual(1, self.backend.cache.misses)
+
+    def test_cache_requires_matching_password(self) -> None:
+        calls = []
+
+        @self.nemesis_route('/user/user')
+        async def endpoint(request: Request) -> Response:
+            calls.append(request)
+            if len(calls) > 1:
+                return JSONResponse({}, status_code=403)
+            return JSONResponse(self.info)
+
+        self.await_(self.backend.validate('user', 'pass'))
+
+        with self.assertRaises(AuthenticationError):
+            self.await_(self.backend.validate('user', 'wrong'))
+
+        self.assertEqual(2, len(calls))
+
+    def test_does_not_cache_failures(self) -> None:
+        calls = []
+
+        @self.nemesis_route('/user/user')
+        async def endpoint(request: Request) -> Response:
+            calls.append(request)
+            return JSONResponse({}, status_code=403)
+
+        for _ in range(2):
+            with self.assertRaises(AuthenticationError):
+                self.await_(self.backend.validate('user', 'pass'))
+
+        self.assertEqual(2, len(calls))
+
+    def test_cache_expires(self) -> None:
+        calls = []
+
+        @self.nemesis_route('/user/user')
+        async def endpoint(request: Request) -> Response:
+            calls.append(request)
+            return JSONResponse(self.info)
+
+        now = 0.0
+        self.backend.cache.clock = lambda: now
+
+        self.await_(self.backend.validate('user', 'pass'))
+        now = self.backend.cache.ttl + 1
+        self.await_(self.backend.validate('user', 'pass'))
+
+        self.assertEqual(2, len(calls))
+
+    def test_cache_does_not_hold_password(self) -> None:
+        @self.nemesis_route('/user/user')
+        async def endpoint(request: Request) -> Response:
+            return JSONResponse(self.info)
+
+        self.await_(self.backend.validate('user', 'pass'))
+
+        (username, password_hash), = self.backend.cache._entries.keys()
+        self.assertEqual('user', username)
+        self.assertNotIn(b'pass', password_hash)
+
 
 class FileAuthTests(test_utils.AsyncTestCase):
     def setUp(self) -> None:
@@ -124,6 +213,7 @@ class FileAuthTests(test_utils.AsyncTestCase):
         self.backend = FileBackend(
             path=Path(__file__).parent / 'fixtures' / 'auth-file.yml',
         )
+        self.addCleanup(self.backend.close)
 
     def test_ok(self) -> None:
         scopes, user = self.await_(self.backend.validate('ABC', 'password1'))
@@ -155,3 +245,265 @@ class FileAuthTests(test_utils.AsyncTestCase):
             scopes,
             "Wrong scopes for user",
         )
+
+
+class FileAuthReloadTests(test_utils.AsyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        self.path = Path(tmp.name) / 'auth-file.yml'
+        self.write('ABC: password1\nDEF: password1\n')
+
+        self.backend = FileBackend(path=self.path, reload_interval=0)
+
+    def write(self, content: str) -> None:
+        # Write to a new file and move it into place, as a deployment would,
+        # so that the change is detected even within the mtime resolution.
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(content)
+        os.replace(tmp, self.path)
+
+    def assertValid(self, username: str, password: str) -> None:
+        _, user = self.await_(self.backend.validate(username, password))
+        self.assertEqual(username, user.team)
+
+    def assertInvalid(self, username: str, password: str) -> None:
+        with self.assertRaises(AuthenticationError):
+            self.await_(self.backend.validate(username, password))
+
+    def test_unchanged(self) -> None:
+        self.assertFalse(self.backend.reload())
+        self.assertValid('ABC', 'password1')
+
+    def test_reload(self) -> None:
+        self.write('ABC: password2\nDEF: password3\n')
+
+        self.assertTrue(self.backend.reload())
+
+        self.assertInvalid('ABC', 'password1')
+        self.assertValid('ABC', 'password2')
+        self.assertValid('DEF', 'password3')
+
+        self.assertFalse(self.backend.reload())
+
+    def test_invalid_file_keeps_credentials(self) -> None:
+        for content in ('- not a mapping\n', 'ABC: [unclosed\n'):
+            with self.subTest(content=content):
+                self.write(content)
+
+                self.assertFalse(self.backend.reload())
+
+                self.assertValid('ABC', 'password1')
+
+        self.write('ABC: password2\n')
+        self.assertTrue(self.backend.reload())
+        self.assertValid('ABC', 'password2')
+
+    def test_missing_file_keeps_credentials(self) -> None:
+        self.path.unlink()
+
+        self.assertFalse(self.backend.reload())
+        self.assertValid('ABC', 'password1')
+
+    def test_watcher_reloads(self) -> None:
+        backend = FileBackend(path=self.path, reload_interval=0.01)
+        self.addCleanup(backend.close)
+
+        self.write('ABC: password2\n')
+
+        deadline = time.monotonic() + 5
+        while backend.credentials.get('ABC') != 'password2':
+            self.assertLess(time.monotonic(), deadline, "Credentials not reloaded")
+            time.sleep(0.01)
+
+        self.await_(backend.validate('ABC', 'password2'))
+
+    def test_close_stops_watcher(self) -> None:
+        backend = FileBackend(path=self.path, reload_interval=0.01)
+        backend.close()
+
+        self.write('ABC: password2\n')
+        time.sleep(0.05)
+
+        self.assertEqual('password1', backend.credentials['ABC'])
+
+    def test_concurrent_reloads(self) -> None:
+        passwords = [f'password{x}' for x in range(20)]
+        stop = threading.Event()
+        errors: list[Exception] = []
+
+        def writer() -> None:
+            for password in passwords:
+                self.write(f'ABC: {password}\nDEF: {password}\n')
+
+        def reloader() -> None:
+            while not stop.is_set():
+                try:
+                    self.backend.reload()
+                except Exception as e:  # pragma: no cover
+                    errors.append(e)
+
+        seen = set()
+
+        reloaders = [threading.Thread(target=reloader) for _ in range(4)]
+        for thread in reloaders:
+            thread.start()
+        try:
+            writer_thread = threading.Thread(target=writer)
+            writer_thread.start()
+
+            while writer_thread.is_alive():
+                # Each lookup sees a complete mapping from a single version of
+                # the file: both teams always share a password.
+                credentials = self.backend.credentials
+                self.assertEqual(credentials.get('ABC'), credentials.get('DEF'))
+                seen.add(credentials['ABC'])
+
+            writer_thread.join()
+        finally:
+            stop.set()
+            for thread in reloaders:
+                thread.join()
+
+        self.assertEqual([], errors)
+        self.assertLessEqual(seen, {'password1', *passwords})
+
+        # Once quiescent, the latest content is picked up.
+        self.backend.reload()
+        self.assertValid('ABC', passwords[-1])
+        self.assertValid('DEF', passwords[-1])
+
+
+class CountingBackend(DummyBackend):
+    def __init__(self) -> None:
+        super().__init__(team='ABC')
+        self.calls = 0
+
+    async def validate(self, username: str, password: str) -> ValidationResult:
+        self.calls += 1
+        return await super().validate(username, password)
+
+
+class SessionAuthTests(test_utils.AsyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.now = 1000.0
+        self.inner = CountingBackend()
+        self.backend = SessionAuthBackend(
+            self.inner,
+            secret_key='secret',
+            max_age=60,
+            clock=lambda: self.now,
+        )
+
+        async def endpoint(request: Request) -> Response:
+            return JSONResponse({
+                'username': request.user.username,
+                'team': request.user.team,
+                'scopes': request.auth.scopes,
+            })
+
+        app = Starlette(
+            routes=[Route('/', endpoint)],
+            middleware=[
+                Middleware(SessionCookieMiddleware, backend=self.backend),
+                Middleware(
+                    AuthenticationMiddleware,
+                    backend=self.backend,
+                    on_error=auth_required_response,
+                ),
+            ],
+        )
+        self.client = TestClient(app)
+
+    def session_data(self, **overrides: object) -> SessionData:
+        data = SessionData(
+            login='user',
+            username='user',
+            team='ABC',
+            scopes=['authenticated'],
+            expires=self.now + 60,
+        )
+        data.update(overrides)  # type: ignore[typeddict-item]
+        return data
+
+    def test_round_trip(self) -> None:
+        data = self.session_data()
+        self.assertEqual(data, self.backend.load(self.backend.dump(data)))
+
+    def test_rejects_tampered(self) -> None:
+        token = self.backend.dump(self.session_data())
+        payload, _, signature = token.partition('.')
+
+        forged = self.backend.dump(self.session_data(scopes=[BLUESHIRT_SCOPE]))
+        forged_payload, _, _ = forged.partition('.')
+
+        self.assertIsNone(self.backend.load(f'{forged_payload}.{signature}'))
+        self.assertIsNone(self.backend.load(f'{payload}.not-base64!'))
+        self.assertIsNone(self.backend.load(payload))
+
+    def test_rejects_other_key(self) -> None:
+        other = SessionAuthBackend(self.inner, secret_key='other', max_age=60)
+        token = other.dump(self.session_data())
+        self.assertIsNone(self.backend.load(token))
+
+    def test_rejects_expired(self) -> None:
+        token = self.backend.dump(self.session_data())
+        self.now += 60
+        self.assertIsNone(self.backend.load(token))
+
+    def test_login_issues_cookie(self) -> None:
+        response = self.client.get('/', auth=('user', 'pass'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, self.inner.calls)
+
+        cookie = response.headers['Set-Cookie']
+        self.assertIn('HttpOnly', cookie)
+        self.assertIn('Max-Age=60', cookie)
+
+        session = self.backend.load(self.client.cookies[SessionAuthBackend.COOKIE_NAME])
+        self.assertEqual(self.session_data(), session)
+
+    def test_session_skips_backend(self) -> None:
+        self.client.get('/', auth=('user', 'pass'))
+
+        response = self.client.get('/', auth=('user', 'pass'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {'username': 'user', 'team': 'ABC', 'scopes': ['authenticated']},
+            response.json(),
+        )
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(1, self.inner.calls)
+
+        # Cookie alone is sufficient
+        response = self.client.get('/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, self.inner.calls)
+
+    def test_expired_session_uses_backend(self) -> None:
+        self.client.get('/', auth=('user', 'pass'))
+        self.now += 60
+
+        response = self.client.get('/', auth=('user', 'pass'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, self.inner.calls)
+        self.assertIn('Set-Cookie', response.headers)
+
+        self.client.cookies.clear()
+        self.now += 60
+
+        response = self.client.get('/')
+        self.assertEqual(401, response.status_code)
+
+    def test_different_user_uses_backend(self) -> None:
+        self.client.get('/', auth=('user', 'pass'))
+
+        response = self.client.get('/', auth=('other', 'pass'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('other', response.json()['username'])
+        self.assertEqual(2, self.inner.calls)
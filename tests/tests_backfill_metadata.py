@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import io
+import hashlib
+import zipfile
+import datetime
+
+import test_utils
+
+from code_submitter.tables import Archive
+
+
+def make_archive(*names: str) -> bytes:
+    contents = io.BytesIO()
+    with zipfile.ZipFile(contents, mode='w') as zip_file:
+        for name in names:
+            zip_file.writestr(name, 'print("I am a robot")')
+    return contents.getvalue()
+
+
+class BackfillMetadataTests(test_utils.InTransactionTestCase):
+    def backfill(self) -> tuple[int, dict[str, str]]:
+        # Import must happen after TESTING environment setup
+        from code_submitter.backfill_metadata import backfill_metadata
+
+        return self.await_(backfill_metadata(self.database, self.blob_store))
+
+    def test_backfill(self) -> None:
+        content = make_archive('robot.py', 'lib/helper.py')
+        # Wouldn't satisfy the current rules, but was valid when uploaded
+        old_content = make_archive('main.py')
+
+        for archive_id in (1, 2):
+            self.insert_archive(
+                id=archive_id,
+                content=content,
+                username='test_user',
+                team='SRZ2',
+                created=datetime.datetime(2020, 1, archive_id, 12, 0),
+            )
+        self.insert_archive(
+            id=3,
+            content=old_content,
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 3, 12, 0),
+        )
+        self.insert_archive(
+            id=4,
+            content=b'already-filled-in',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 4, 12, 0),
+            size=1,
+            member_count=2,
+            uncompressed_size=3,
+            members=['existing'],
+        )
+
+        self.assertEqual((3, {}), self.backfill())
+
+        rows = self.await_(self.database.fetch_all(
+            Archive.select().order_by(Archive.c.id),
+        ))
+        self.assertEqual(
+            [
+                (len(content), 2, 42, ['robot.py', 'lib/helper.py']),
+                (len(content), 2, 42, ['robot.py', 'lib/helper.py']),
+                (len(old_content), 1, 21, ['main.py']),
+                (1, 2, 3, ['existing']),
+            ],
+            [
+                (x['size'], x['member_count'], x['uncompressed_size'], x['members'])
+                for x in rows
+            ],
+        )
+
+        self.assertEqual((0, {}), self.backfill())
+
+    def test_skips_invalid(self) -> None:
+        self.insert_archive(
+            id=1,
+            content=b'not-a-zip',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
+
+        updated, skipped = self.backfill()
+        self.assertEqual(0, updated)
+        self.assertEqual(
+            {hashlib.sha256(b'not-a-zip').hexdigest(): "Must upload a ZIP file"},
+            skipped,
+        )
+
+        member_count = self.await_(self.database.fetch_val(
+            Archive.select().with_only_columns([Archive.c.member_count]),
+        ))
+        self.assertIsNone(member_count)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import io
+import asyncio
+import zipfile
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import test_utils
+from sqlalchemy.sql import select
+
+from code_submitter import bundles
+from code_submitter.utils import ChosenArchive
+from code_submitter.tables import Archive
+
+
+class BundleKeyTests(test_utils.AsyncTestCase):
+    def test_depends_only_on_choices(self) -> None:
+        first = bundles.bundle_key({
+            'ABC': ChosenArchive(archive_id=1, sha256='a'),
+            'DEF': ChosenArchive(archive_id=2, sha256='b'),
+        })
+        second = bundles.bundle_key({
+            'DEF': ChosenArchive(archive_id=2, sha256='b'),
+            'ABC': ChosenArchive(archive_id=1, sha256='a'),
+        })
+        different = bundles.bundle_key({
+            'ABC': ChosenArchive(archive_id=3, sha256='a'),
+            'DEF': ChosenArchive(archive_id=2, sha256='b'),
+        })
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, different)
+
+    def test_etag_matches(self) -> None:
+        self.assertTrue(bundles.etag_matches('"abc"', '"abc"'))
+        self.assertTrue(bundles.etag_matches('"abc"', '"def", W/"abc"'))
+        self.assertTrue(bundles.etag_matches('"abc"', '*'))
+        self.assertFalse(bundles.etag_matches('"abc"', '"def"'))
+
+
+class BundleCacheTests(test_utils.InTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+        self.cache = bundles.BundleCache(self.directory)
+
+        self.insert_archive(id=1, content=b'first', username='user', team='ABC')
+        self.insert_archive(id=2, content=b'second', username='user', team='ABC')
+
+    def chosen(self, archive_id: int) -> dict[str, ChosenArchive]:
+        return {'ABC': ChosenArchive(
+            archive_id=archive_id,
+            sha256=self.await_(self.database.fetch_val(
+                select([Archive.c.sha256]).where(Archive.c.id == archive_id),
+            )),
+        )}
+
+    async def collect(self, archives: dict[str, ChosenArchive]) -> bytes:
+        key = bundles.bundle_key(archives)
+        stream = await self.cache.stream(key, archives, self.blob_store)
+        return b''.join([x async for x in stream])
+
+    def build(self, archive_id: int) -> bytes:
+        return self.await_(self.collect(self.chosen(archive_id)))
+
+    def test_builds_once(self) -> None:
+        first = self.build(1)
+
+        with zipfile.ZipFile(io.BytesIO(first)) as zf:
+            self.assertEqual(b'first', zf.read('ABC.zip'))
+
+        with mock.patch.object(self.blob_store, 'stream') as mock_stream:
+            self.assertEqual(first, self.build(1))
+        mock_stream.assert_not_called()
+
+    def test_concurrent_requests_build_once(self) -> None:
+        archives = self.chosen(1)
+
+        async def collect_concurrently() -> list[bytes]:
+            return await asyncio.gather(*(self.collect(archives) for _ in range(3)))
+
+        with mock.patch.object(
+            self.blob_store,
+            'stream',
+            wraps=self.blob_store.stream,
+        ) as mock_stream:
+            first, *others = self.await_(collect_concurrently())
+
+        mock_stream.assert_called_once()
+        with zipfile.ZipFile(io.BytesIO(first)) as zf:
+            self.assertEqual(b'first', zf.read('ABC.zip'))
+        self.assertEqual([first, first], others)
+
+    def test_abandoned_build_is_taken_over(self) -> None:
+        archives = self.chosen(1)
+        key = bundles.bundle_key(archives)
+
+        async def run() -> bytes:
+            abandoned = await self.cache.stream(key, archives, self.blob_store)
+            await abandoned.__anext__()
+
+            waiting = asyncio.ensure_future(self.collect(archives))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+
+            await abandoned.aclose()  # type: ignore[attr-defined]
+            return await asyncio.wait_for(waiting, timeout=5)
+
+        with zipfile.ZipFile(io.BytesIO(self.await_(run()))) as zf:
+            self.assertEqual(b'first', zf.read('ABC.zip'))
+
+    def test_replaces_previous_bundle(self) -> None:
+        self.build(1)
+        second = self.build(2)
+
+        with zipfile.ZipFile(io.BytesIO(second)) as zf:
+            self.assertEqual(b'second', zf.read('ABC.zip'))
+
+        self.assertEqual(1, len(list(self.directory.iterdir())))
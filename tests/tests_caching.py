@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import unittest
+
+from code_submitter.caching import TTLCache, GroupedTTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.clock = FakeClock()
+        self.cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self) -> None:
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 1)
+        self.assertEqual(1, self.cache.get('a'))
+
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_expiry(self) -> None:
+        self.cache.put('a', 1)
+
+        self.clock.now = 9.9
+        self.assertEqual(1, self.cache.get('a'))
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_evicts_least_recently_used(self) -> None:
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(3, self.cache.get('c'))
+
+    def test_discard(self) -> None:
+        self.cache.put('a', 1)
+        self.cache.discard('a')
+        self.cache.discard('b')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_disabled(self) -> None:
+        cache: TTLCache[str, int] = TTLCache(max_size=0, ttl=10)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class GroupedTTLCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.clock = FakeClock()
+        self.cache: GroupedTTLCache[str, str, int] = GroupedTTLCache(
+            max_size=4,
+            ttl=10,
+            clock=self.clock,
+        )
+
+    def put(self, group: str, key: str, value: int) -> None:
+        self.cache.put(group, key, value, generation=self.cache.generation(group))
+
+    def test_hit_and_miss(self) -> None:
+        self.assertIsNone(self.cache.get('g', 'a'))
+        self.put('g', 'a', 1)
+        self.assertEqual(1, self.cache.get('g', 'a'))
+        self.assertIsNone(self.cache.get('h', 'a'))
+
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(2, self.cache.misses)
+
+    def test_expiry(self) -> None:
+        self.put('g', 'a', 1)
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('g', 'a'))
+
+    def test_invalidate(self) -> None:
+        self.put('g', 'a', 1)
+        self.put('g', 'b', 2)
+        self.put('h', 'a', 3)
+
+        self.cache.invalidate('g')
+
+        self.assertIsNone(self.cache.get('g', 'a'))
+        self.assertIsNone(self.cache.get('g', 'b'))
+        self.assertEqual(3, self.cache.get('h', 'a'))
+
+        self.put('g', 'a', 4)
+        self.assertEqual(4, self.cache.get('g', 'a'))
+
+    def test_ignores_values_loaded_before_invalidation(self) -> None:
+        generation = self.cache.generation('g')
+        self.cache.invalidate('g')
+
+        self.cache.put('g', 'a', 1, generation=generation)
+        self.assertIsNone(self.cache.get('g', 'a'))
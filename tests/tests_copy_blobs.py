@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import io
+import hashlib
+import tempfile
+from unittest import mock
+
+import test_utils
+
+from code_submitter.storage import FileSystemBlobStore
+
+
+class CopyBlobsTests(test_utils.InTransactionTestCase):
+    def test_copy(self) -> None:
+        # Import must happen after TESTING environment setup
+        from code_submitter.copy_blobs import copy_blobs
+
+        contents = [b'first', b'second']
+        for content in contents:
+            # Stored in the blob table by the default store
+            self.await_(self.blob_store.put(
+                hashlib.sha256(content).hexdigest(),
+                io.BytesIO(content),
+            ))
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        target = FileSystemBlobStore(self.database, path=directory.name)
+
+        copied = self.await_(copy_blobs(self.database, target))
+        self.assertEqual(2, copied)
+
+        for content in contents:
+            self.assertEqual(
+                content,
+                self.await_(target.get(hashlib.sha256(content).hexdigest())),
+            )
+
+        with mock.patch.object(target, 'put', wraps=target.put) as put:
+            copied = self.await_(copy_blobs(self.database, target))
+
+        self.assertEqual(0, copied)
+        put.assert_not_called()
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import io
+import json
+import stat
+import asyncio
+import zipfile
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+from collections.abc import AsyncIterator
+
+import test_utils
+
+from code_submitter.utils import ChosenArchive
+from code_submitter.tables import ChoiceHistory
+from code_submitter.storage import BlobStore, STREAM_CHUNK_SIZE
+
+
+class CountingBlobStore(BlobStore):
+    def __init__(self, inner: BlobStore) -> None:
+        super().__init__(inner.database)
+        self.inner = inner
+        self.streamed: list[str] = []
+
+    def stream(
+        self,
+        sha256: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        self.streamed.append(sha256)
+        return self.inner.stream(sha256, chunk_size)
+
+
+class ConcurrencyTrackingBlobStore(BlobStore):
+    def __init__(self, inner: BlobStore) -> None:
+        super().__init__(inner.database)
+        self.inner = inner
+        self.active = 0
+        self.max_active = 0
+
+    async def stream(
+        self,
+        sha256: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            # Give other extractions the chance to start fetching
+            await asyncio.sleep(0.01)
+            async for chunk in self.inner.stream(sha256, chunk_size):
+                yield chunk
+        finally:
+            self.active -= 1
+
+
+class ExtractArchivesTests(test_utils.InTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        self.output = Path(tmp.name) / 'out' / 'submissions.zip'
+        self.manifest = Path(tmp.name) / 'out' / 'submissions.zip.manifest.json'
+
+        for archive_id, team in (
+            (1, 'ABC'),
+            (2, 'SRZ2'),
+            (3, 'SRZ2'),
+            (4, 'DEF'),
+        ):
+            self.insert_archive(
+                id=archive_id,
+                content=f'content-{archive_id}'.encode(),
+                username='someone',
+                team=team,
+                created=datetime.datetime(2020, 1, archive_id, 12, 0),
+            )
+
+        self.choose(1, datetime.datetime(2020, 2, 1, 12, 0))
+        self.choose(2, datetime.datetime(2020, 2, 2, 12, 0))
+
+    def choose(self, archive_id: int, created: datetime.datetime) -> None:
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=archive_id,
+                username='someone',
+                created=created,
+            ),
+        ))
+
+    def export(self, *, incremental: bool) -> tuple[CountingBlobStore, tuple[int, int]]:
+        # Import must happen after TESTING environment setup
+        from code_submitter.extract_archives import export
+
+        blob_store = CountingBlobStore(self.blob_store)
+        result = self.await_(export(
+            self.database,
+            blob_store,
+            self.output,
+            manifest=self.manifest,
+            incremental=incremental,
+        ))
+        return blob_store, result
+
+    def read_output(self) -> dict[str, bytes]:
+        with zipfile.ZipFile(self.output) as zf:
+            return {x: zf.read(x) for x in zf.namelist()}
+
+    def test_export(self) -> None:
+        blob_store, result = self.export(incremental=False)
+
+        self.assertEqual((2, 0), result)
+        self.assertEqual(2, len(blob_store.streamed))
+        self.assertEqual(
+            {
+                'ABC.zip': b'content-1',
+                'SRZ2.zip': b'content-2',
+                'summary.txt': b'ABC: 1\nSRZ2: 2\n',
+            },
+            self.read_output(),
+        )
+
+        manifest = json.loads(self.manifest.read_text())
+        self.assertEqual({'ABC', 'SRZ2'}, manifest['teams'].keys())
+        self.assertEqual(2, manifest['teams']['SRZ2']['archive_id'])
+
+    def test_incremental_only_loads_changes(self) -> None:
+        self.export(incremental=False)
+
+        self.choose(3, datetime.datetime(2020, 3, 3, 12, 0))
+        self.choose(4, datetime.datetime(2020, 3, 4, 12, 0))
+
+        blob_store, result = self.export(incremental=True)
+
+        self.assertEqual((3, 1), result)
+        self.assertEqual(2, len(blob_store.streamed))
+        self.assertEqual(
+            {
+                'ABC.zip': b'content-1',
+                'DEF.zip': b'content-4',
+                'SRZ2.zip': b'content-3',
+                'summary.txt': b'ABC: 1\nDEF: 4\nSRZ2: 3\n',
+            },
+            self.read_output(),
+        )
+
+        manifest = json.loads(self.manifest.read_text())
+        self.assertEqual(3, manifest['teams']['SRZ2']['archive_id'])
+
+    def test_incremental_unchanged_does_not_rewrite(self) -> None:
+        self.export(incremental=False)
+        before = self.output.stat()
+
+        blob_store, result = self.export(incremental=True)
+
+        self.assertEqual((2, 2), result)
+        self.assertEqual([], blob_store.streamed)
+        self.assertEqual(before, self.output.stat())
+
+    def test_incremental_without_manifest(self) -> None:
+        self.export(incremental=False)
+        self.manifest.write_text('not json')
+
+        blob_store, result = self.export(incremental=True)
+
+        self.assertEqual((2, 0), result)
+        self.assertEqual(2, len(blob_store.streamed))
+
+    def test_incremental_without_output(self) -> None:
+        self.export(incremental=False)
+        self.output.unlink()
+
+        blob_store, result = self.export(incremental=True)
+
+        self.assertEqual((2, 0), result)
+        self.assertEqual(2, len(blob_store.streamed))
+        self.assertEqual(b'content-1', self.read_output()['ABC.zip'])
+
+    def test_not_incremental_ignores_manifest(self) -> None:
+        self.export(incremental=False)
+
+        blob_store, result = self.export(incremental=False)
+
+        self.assertEqual((2, 0), result)
+        self.assertEqual(2, len(blob_store.streamed))
+
+
+def make_archive(members: dict[str, bytes]) -> bytes:
+    contents = io.BytesIO()
+    with zipfile.ZipFile(contents, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return contents.getvalue()
+
+
+class ExtractArchiveTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        test_utils.ensure_database_configured()
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.destination = self.root / 'dest'
+        self.destination.mkdir()
+
+    def extract(self, content: bytes, max_size: int | None = None) -> int:
+        # Import must happen after TESTING environment setup
+        from code_submitter.extract_archives import extract_archive
+
+        source = self.root / 'source.zip'
+        source.write_bytes(content)
+        return extract_archive(str(source), str(self.destination), max_size)
+
+    def test_extract(self) -> None:
+        count = self.extract(make_archive({
+            'robot.py': b'print("I am a robot")',
+            'lib/': b'',
+            'lib/helper.py': b'pass',
+        }))
+
+        self.assertEqual(2, count)
+        self.assertEqual(
+            b'print("I am a robot")',
+            (self.destination / 'robot.py').read_bytes(),
+        )
+        self.assertEqual(b'pass', (self.destination / 'lib' / 'helper.py').read_bytes())
+
+    def test_rejects_unsafe_paths(self) -> None:
+        from code_submitter.extract_archives import UnsafeArchive
+
+        for name in ('../evil.py', 'lib/../../evil.py', '/etc/evil.py', 'C:/evil.py'):
+            with self.subTest(name=name):
+                with self.assertRaises(UnsafeArchive):
+                    self.extract(make_archive({name: b'evil'}))
+
+        self.assertEqual([], list(self.root.glob('**/evil.py')))
+
+    def test_rejects_symlinks(self) -> None:
+        from code_submitter.extract_archives import UnsafeArchive
+
+        contents = io.BytesIO()
+        with zipfile.ZipFile(contents, mode='w') as zf:
+            info = zipfile.ZipInfo('link')
+            info.external_attr = (stat.S_IFLNK | 0o777) << 16
+            zf.writestr(info, '/etc/passwd')
+
+        with self.assertRaises(UnsafeArchive):
+            self.extract(contents.getvalue())
+
+        self.assertFalse((self.destination / 'link').exists())
+
+    def test_limits_decompressed_size(self) -> None:
+        from code_submitter.extract_archives import UnsafeArchive
+
+        content = make_archive({'a.txt': b'a' * 1000, 'b.txt': b'b' * 1000})
+
+        self.assertEqual(2, self.extract(content, max_size=2000))
+
+        for path in self.destination.iterdir():
+            path.unlink()
+
+        with self.assertRaises(UnsafeArchive):
+            self.extract(content, max_size=1999)
+
+
+class ExtractToDirectoryTests(test_utils.InTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output = Path(tmp.name) / 'out'
+
+        archives = {
+            1: ('ABC', {'robot.py': b'abc'}),
+            2: ('SRZ2', {'robot.py': b'srz2', 'lib/helper.py': b'help'}),
+            3: ('DEF', {'../robot.py': b'evil'}),
+        }
+        for archive_id, (team, members) in archives.items():
+            self.insert_archive(
+                id=archive_id,
+                content=make_archive(members),
+                username='someone',
+                team=team,
+                created=datetime.datetime(2020, 1, archive_id, 12, 0),
+            )
+
+        self.choose(1)
+        self.choose(2)
+
+    def choose(self, archive_id: int) -> None:
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=archive_id,
+                username='someone',
+                created=datetime.datetime(2020, 2, archive_id, 12, 0),
+            ),
+        ))
+
+    def extract(self) -> dict[str, ChosenArchive]:
+        # Import must happen after TESTING environment setup
+        from code_submitter.extract_archives import extract_to_directory
+
+        return self.await_(extract_to_directory(
+            self.database,
+            self.blob_store,
+            self.output,
+            workers=2,
+        ))
+
+    def test_extract(self) -> None:
+        # Content from a previous run is replaced
+        (self.output / 'ABC').mkdir(parents=True)
+        (self.output / 'ABC' / 'stale.py').write_text('stale')
+
+        extracted = self.extract()
+
+        self.assertEqual({'ABC', 'SRZ2'}, extracted.keys())
+        self.assertEqual(
+            {
+                'ABC/robot.py': b'abc',
+                'SRZ2/robot.py': b'srz2',
+                'SRZ2/lib/helper.py': b'help',
+                'summary.txt': b'ABC: 1\nSRZ2: 2\n',
+            },
+            {
+                path.relative_to(self.output).as_posix(): path.read_bytes()
+                for path in self.output.glob('**/*')
+                if path.is_file()
+            },
+        )
+
+    def test_limits_concurrent_fetches(self) -> None:
+        from code_submitter.extract_archives import extract_to_directory
+
+        blob_store = ConcurrencyTrackingBlobStore(self.blob_store)
+
+        extracted = self.await_(extract_to_directory(
+            self.database,
+            blob_store,
+            self.output,
+            workers=1,
+        ))
+
+        self.assertEqual({'ABC', 'SRZ2'}, extracted.keys())
+        self.assertEqual(1, blob_store.max_active)
+
+    def test_failure_still_extracts_others(self) -> None:
+        from code_submitter.extract_archives import (
+            UnsafeArchive,
+            ExtractionFailed,
+        )
+
+        self.choose(3)
+
+        with self.assertRaises(ExtractionFailed) as e:
+            self.extract()
+
+        self.assertEqual({'DEF'}, e.exception.errors.keys())
+        self.assertIsInstance(e.exception.errors['DEF'], UnsafeArchive)
+
+        self.assertEqual(
+            {'ABC', 'SRZ2', 'summary.txt'},
+            {x.name for x in self.output.iterdir()},
+        )
+        self.assertEqual(
+            'ABC: 1\nSRZ2: 2\n',
+            (self.output / 'summary.txt').read_text(),
+        )
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import datetime
+import unittest
+from unittest import mock
+
+import test_utils
+from starlette.routing import Route
+from starlette.requests import Request, HTTPConnection
+from starlette.responses import Response
+from starlette.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.authentication import (
+    BaseUser,
+    SimpleUser,
+    AuthCredentials,
+    AuthenticationError,
+    AuthenticationBackend,
+)
+
+from code_submitter.tables import Archive
+from code_submitter.caching import GroupedTTLCache
+from code_submitter.metrics import (
+    Counter,
+    Registry,
+    Histogram,
+    record_queries,
+    register_cache,
+    MetricsMiddleware,
+    InstrumentedAuthBackend,
+)
+
+
+class CounterTests(unittest.TestCase):
+    def test_render(self) -> None:
+        counter = Counter('things_total', "Things.", ('kind',))
+        counter.inc(kind='a')
+        counter.inc(2, kind='b')
+        counter.inc(kind='a')
+
+        self.assertEqual(2, counter.value(kind='a'))
+        self.assertEqual(0, counter.value(kind='c'))
+        self.assertEqual(
+            '# HELP things_total Things.\n'
+            '# TYPE things_total counter\n'
+            'things_total{kind="a"} 2.0\n'
+            'things_total{kind="b"} 2.0\n',
+            counter.render(),
+        )
+
+    def test_escapes_label_values(self) -> None:
+        counter = Counter('things_total', "Things.", ('kind',))
+        counter.inc(kind='a"b\\c\nd')
+
+        self.assertIn(r'things_total{kind="a\"b\\c\nd"} 1.0', counter.render())
+
+    def test_wrong_labels(self) -> None:
+        counter = Counter('things_total', "Things.", ('kind',))
+
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+        with self.assertRaises(ValueError):
+            counter.inc(kind='a', other='b')
+
+    def test_cannot_decrease(self) -> None:
+        counter = Counter('things_total', "Things.")
+
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+
+
+class HistogramTests(unittest.TestCase):
+    def test_render(self) -> None:
+        histogram = Histogram('duration_seconds', "Durations.", buckets=(1, 5))
+        histogram.observe(0.5)
+        histogram.observe(1)
+        histogram.observe(3)
+        histogram.observe(10)
+
+        self.assertEqual(4, histogram.count())
+        self.assertEqual(
+            '# HELP duration_seconds Durations.\n'
+            '# TYPE duration_seconds histogram\n'
+            'duration_seconds_bucket{le="1.0"} 2.0\n'
+            'duration_seconds_bucket{le="5.0"} 3.0\n'
+            'duration_seconds_bucket{le="+Inf"} 4.0\n'
+            'duration_seconds_sum 14.5\n'
+            'duration_seconds_count 4.0\n',
+            histogram.render(),
+        )
+
+    def test_time(self) -> None:
+        histogram = Histogram('duration_seconds', "Durations.", ('kind',))
+
+        with self.assertRaises(RuntimeError):
+            with histogram.time(kind='a'):
+                raise RuntimeError
+
+        self.assertEqual(1, histogram.count(kind='a'))
+
+
+class RegistryTests(unittest.TestCase):
+    def test_render(self) -> None:
+        registry = Registry()
+        registry.register(Counter('a_total', "A."))
+        registry.register(Counter('b_total', "B."))
+
+        self.assertEqual(
+            '# HELP a_total A.\n'
+            '# TYPE a_total counter\n'
+            '# HELP b_total B.\n'
+            '# TYPE b_total counter\n',
+            registry.render(),
+        )
+
+    def test_duplicate_name(self) -> None:
+        registry = Registry()
+        registry.register(Counter('a_total', "A."))
+
+        with self.assertRaises(ValueError):
+            registry.register(Counter('a_total', "A."))
+
+
+class RegisterCacheTests(unittest.TestCase):
+    def test_render(self) -> None:
+        cache: GroupedTTLCache[str, str, int] = GroupedTTLCache(max_size=1, ttl=10)
+        cache.get('g', 'a')
+
+        registry = Registry()
+        register_cache('things', cache, registry)
+
+        text = registry.render()
+        self.assertIn('code_submitter_things_cache_hits_total 0.0\n', text)
+        self.assertIn('code_submitter_things_cache_misses_total 1.0\n', text)
+
+
+class MetricsMiddlewareTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.histogram = Histogram('duration_seconds', "", ('method', 'route', 'status'))
+
+        async def item(request: Request) -> Response:
+            return Response(status_code=int(request.path_params['status']))
+
+        async def broken(request: Request) -> Response:
+            raise RuntimeError
+
+        routes = [
+            Route('/item/{status:int}', endpoint=item),
+            Route('/broken', endpoint=broken),
+        ]
+        app = Starlette(routes=routes)
+        self.client = TestClient(
+            MetricsMiddleware(app, routes=routes, histogram=self.histogram),
+            raise_server_exceptions=False,
+        )
+
+    def test_labels_by_route(self) -> None:
+        self.client.get('/item/201')
+        self.client.get('/item/201')
+        self.client.get('/item/404')
+        self.client.get('/missing')
+        self.client.get('/broken')
+
+        self.assertEqual(
+            2,
+            self.histogram.count(method='GET', route='/item/{status:int}', status='201'),
+        )
+        self.assertEqual(
+            1,
+            self.histogram.count(method='GET', route='/item/{status:int}', status='404'),
+        )
+        self.assertEqual(
+            1,
+            self.histogram.count(method='GET', route='unmatched', status='404'),
+        )
+        self.assertEqual(
+            1,
+            self.histogram.count(method='GET', route='/broken', status='500'),
+        )
+
+
+class FixedBackend(AuthenticationBackend):
+    def __init__(self, result: object) -> None:
+        self.result = result
+
+    async def authenticate(
+        self,
+        conn: HTTPConnection,
+    ) -> tuple[AuthCredentials, BaseUser] | None:
+        if isinstance(self.result, Exception):
+            raise self.result
+        return AuthCredentials(), SimpleUser('someone')
+
+
+class InstrumentedAuthBackendTests(test_utils.AsyncTestCase):
+    def test_outcomes(self) -> None:
+        histogram = Histogram('duration_seconds', "", ('result',))
+        connection = HTTPConnection({'type': 'http', 'headers': []})
+
+        for result, outcome in (
+            (None, 'success'),
+            (AuthenticationError("Nope"), 'denied'),
+            (RuntimeError("Broken"), 'error'),
+        ):
+            with self.subTest(outcome=outcome):
+                backend = InstrumentedAuthBackend(
+                    FixedBackend(result),
+                    histogram=histogram,
+                )
+                try:
+                    self.await_(backend.authenticate(connection))
+                except Exception as e:
+                    self.assertIs(result, e)
+
+                self.assertEqual(1, histogram.count(result=outcome))
+
+
+class InstrumentedDatabaseTests(test_utils.InTransactionTestCase):
+    def test_records_queries(self) -> None:
+        self.insert_archive(
+            id=1,
+            content=b'1',
+            username='someone',
+            team='ABC',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
+
+        with record_queries() as log:
+            self.await_(self.database.fetch_all(
+                Archive.select().where(Archive.c.team == 'ABC'),
+            ))
+            self.await_(self.database.fetch_one(
+                Archive.select().where(Archive.c.team == 'DEF'),
+            ))
+            self.await_(self.database.execute(
+                Archive.delete().where(Archive.c.id == 1),
+            ))
+
+        # Only queries within the context are recorded
+        self.await_(self.database.fetch_all(Archive.select()))
+
+        self.assertEqual(
+            [('fetch_all', 1), ('fetch_one', 0), ('execute', None)],
+            [(x.operation, x.rows) for x in log.queries],
+        )
+
+        shape = log.queries[0].shape
+        self.assertIn('FROM archive WHERE archive.team = :team_1', shape)
+        self.assertNotIn('ABC', shape)
+
+        self.assertRegex(log.server_timing(), r'^db;dur=[0-9.]+;desc="3 queries"$')
+
+    def test_logs_slow_queries(self) -> None:
+        with mock.patch.object(self.database, 'slow_query_threshold', 0):
+            with mock.patch('code_submitter.metrics.logger') as logger:
+                self.await_(self.database.fetch_all(Archive.select()))
+
+        logger.warning.assert_called_once()
+        self.assertIn('FROM archive', logger.warning.call_args[0][-1])
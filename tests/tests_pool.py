@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import sqlalchemy
+import test_utils
+from databases.core import DatabaseURL
+from databases.interfaces import DatabaseBackend
+
+from code_submitter import utils
+from code_submitter.pool import (
+    PoolTimeout,
+    PooledDatabase,
+    production_pragmas,
+    PooledSQLiteBackend,
+    SQLiteConnectionPool,
+)
+from code_submitter.tables import Blob, Archive, metadata
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SQLiteConnectionPoolTests(test_utils.AsyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        database_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(database_file.close)
+        self.url = DatabaseURL(f'sqlite:///{database_file.name}')
+        self.clock = FakeClock()
+
+    def make_pool(
+        self,
+        *,
+        min_size: int = 0,
+        max_size: int = 2,
+        recycle: float | None = None,
+    ) -> SQLiteConnectionPool:
+        pool = SQLiteConnectionPool(
+            self.url,
+            min_size=min_size,
+            max_size=max_size,
+            acquire_timeout=0.05,
+            recycle=recycle,
+            clock=self.clock,
+        )
+        self.addCleanup(lambda: self.await_(pool.close()))
+        return pool
+
+    def test_reuses_connections(self) -> None:
+        pool = self.make_pool()
+
+        first = self.await_(pool.acquire())
+        self.assertEqual((1, 0), (pool.in_use, pool.idle))
+        self.await_(pool.release(first))
+        self.assertEqual((0, 1), (pool.in_use, pool.idle))
+
+        second = self.await_(pool.acquire())
+        self.assertIs(first, second)
+        self.await_(pool.release(second))
+
+    def test_warm(self) -> None:
+        pool = self.make_pool(min_size=2)
+
+        self.await_(pool.warm())
+        self.assertEqual(2, pool.idle)
+
+        # Already warm
+        self.await_(pool.warm())
+        self.assertEqual(2, pool.idle)
+
+    def test_timeout_when_exhausted(self) -> None:
+        pool = self.make_pool(max_size=1)
+        connection = self.await_(pool.acquire())
+
+        with self.assertRaises(PoolTimeout):
+            self.await_(pool.acquire())
+
+        self.assertEqual(1, pool.timeouts)
+        self.assertEqual(0, pool.waiting)
+
+        self.await_(pool.release(connection))
+
+        # The failed attempt didn't take a slot
+        self.await_(pool.release(self.await_(pool.acquire())))
+
+    def test_waiter_gets_released_connection(self) -> None:
+        pool = self.make_pool(max_size=1)
+
+        async def run() -> None:
+            connection = await pool.acquire()
+            waiter = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(1, pool.waiting)
+
+            await pool.release(connection)
+            self.assertIs(connection, await waiter)
+            await pool.release(connection)
+
+        self.await_(run())
+        self.assertEqual(0, pool.timeouts)
+
+    def test_recycles_old_connections(self) -> None:
+        pool = self.make_pool(recycle=60)
+
+        first = self.await_(pool.acquire())
+        self.await_(pool.release(first))
+
+        self.clock.now = 59
+        self.assertIs(first, self.await_(pool.acquire()))
+
+        self.clock.now = 60
+        self.await_(pool.release(first))
+        self.assertEqual(0, pool.idle)
+
+        second = self.await_(pool.acquire())
+        self.assertIsNot(first, second)
+        self.await_(pool.release(second))
+
+    def test_close(self) -> None:
+        pool = self.make_pool()
+        idle = self.await_(pool.acquire())
+        in_use = self.await_(pool.acquire())
+        self.await_(pool.release(idle))
+
+        self.await_(pool.close())
+        self.assertEqual(0, pool.idle)
+
+        # Connections in use at close are closed when released
+        self.await_(pool.release(in_use))
+        self.assertEqual(0, pool.idle)
+
+    def test_invalid_sizes(self) -> None:
+        with self.assertRaises(ValueError):
+            self.make_pool(min_size=3, max_size=2)
+
+
+class PooledDatabaseTests(test_utils.AsyncTestCase):
+    def test_pools_sqlite_connections(self) -> None:
+        database_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(database_file.close)
+
+        database = PooledDatabase(
+            f'sqlite:///{database_file.name}',
+            pool={'min_size': 1, 'max_size': 3, 'acquire_timeout': 1},
+        )
+
+        pool = database.pool
+        assert pool is not None
+        self.assertIsInstance(database._backend, PooledSQLiteBackend)
+        self.assertEqual(3, pool.max_size)
+
+        async def run() -> None:
+            async with database:
+                self.assertEqual(1, pool.idle)
+
+                await asyncio.gather(*(
+                    asyncio.ensure_future(database.fetch_val('SELECT 1'))
+                    for _ in range(5)
+                ))
+                self.assertEqual(0, pool.in_use)
+                self.assertLessEqual(pool.idle, 3)
+
+            self.assertEqual(0, pool.idle)
+
+        self.await_(run())
+
+
+class RecordingBackend(DatabaseBackend):
+    def __init__(self, database_url: DatabaseURL, **options: object) -> None:
+        self.options = options
+
+
+class PooledDatabaseBackendTests(unittest.TestCase):
+    def make_backend(self, url: str) -> tuple[str, dict[str, object]]:
+        imported = []
+
+        def import_from_string(name: str) -> type[RecordingBackend]:
+            imported.append(name)
+            return RecordingBackend
+
+        with mock.patch('databases.core.import_from_string', import_from_string):
+            database = PooledDatabase(url, pool={
+                'min_size': 1,
+                'max_size': 2,
+                'acquire_timeout': 3,
+                'recycle': 4,
+                'pragmas': {'journal_mode': 'WAL'},
+            })
+
+        backend = database._backend
+        assert isinstance(backend, RecordingBackend)
+        name, = imported
+        return name, backend.options
+
+    def test_postgres(self) -> None:
+        name, options = self.make_backend('postgresql://localhost/db')
+
+        self.assertEqual('code_submitter.pool_postgres:PooledPostgresBackend', name)
+        self.assertEqual(
+            {'min_size': 1, 'max_size': 2, 'acquire_timeout': 3, 'recycle': 4},
+            options,
+        )
+
+    def test_other_backends_only_given_sizes(self) -> None:
+        for url in ('mysql://localhost/db', 'postgresql+aiopg://localhost/db'):
+            with self.subTest(url=url):
+                name, options = self.make_backend(url)
+
+                self.assertNotIn('code_submitter', name)
+                self.assertEqual({'min_size': 1, 'max_size': 2}, options)
+
+
+class SQLiteProductionModeTests(test_utils.AsyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        database_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(database_file.close)
+        url = f'sqlite:///{database_file.name}'
+        metadata.create_all(sqlalchemy.create_engine(url))
+
+        self.database = PooledDatabase(url, pool={
+            'max_size': 2,
+            'pragmas': production_pragmas(busy_timeout=2, mmap_size=1024 * 1024),
+        })
+        self.await_(self.database.connect())
+        self.addCleanup(lambda: self.await_(self.database.disconnect()))
+
+    def test_applies_pragmas(self) -> None:
+        async def run() -> list[object]:
+            # All the queries in one task use the same connection
+            return [
+                await self.database.fetch_val(f'PRAGMA {name}')
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size')
+            ]
+
+        self.assertEqual(['wal', 1, 2000, 1024 * 1024], self.await_(run()))
+
+    def test_rejects_invalid_pragmas(self) -> None:
+        with self.assertRaises(ValueError):
+            PooledDatabase('sqlite:///unused.db', pool={
+                'pragmas': {'journal_mode': 'WAL; DROP TABLE archive'},
+            })
+
+    def test_reads_proceed_during_upload(self) -> None:
+        uploading = asyncio.Event()
+        uploaded = asyncio.Event()
+
+        async def upload() -> None:
+            async with self.database.transaction():
+                # Large enough to overflow SQLite's page cache, which with the
+                # default rollback journal would make the writer take an
+                # exclusive lock, blocking readers.
+                await self.database.execute(Blob.insert().values(
+                    sha256='abc',
+                    content=bytes(8 * 1024 * 1024),
+                ))
+                await self.database.execute(Archive.insert().values(
+                    sha256='abc',
+                    username='someone',
+                    team='ABC',
+                    created=datetime.datetime(2020, 1, 1, 12, 0),
+                ))
+                uploading.set()
+                await uploaded.wait()
+
+        async def read_homepage() -> tuple[object, list[object]]:
+            chosen = await self.database.fetch_one(utils.team_choice_query('ABC'))
+            uploads = await self.database.fetch_all(
+                utils.uploads_query('someone', 'ABC', before=None, limit=20),
+            )
+            return chosen, list(uploads)
+
+        async def homepage() -> tuple[object, list[object]]:
+            await uploading.wait()
+            try:
+                # Shorter than the busy timeout, so this fails if blocked
+                return await asyncio.wait_for(read_homepage(), timeout=1)
+            finally:
+                uploaded.set()
+
+        async def run() -> tuple[object, list[object]]:
+            _, result = await asyncio.gather(
+                asyncio.ensure_future(upload()),
+                asyncio.ensure_future(homepage()),
+            )
+            return result
+
+        # The reads don't see the uncommitted upload
+        self.assertEqual((None, []), self.await_(run()))
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import test_utils
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql.expression import Select
+
+from code_submitter import utils
+from code_submitter.tables import Archive, ChoiceHistory
+
+
+class QueryPlanTests(test_utils.InTransactionTestCase):
+    """
+    Check that the queries behind the most common requests are backed by
+    indexes, so that they remain fast as the tables grow.
+    """
+
+    def query_plan_steps(self, query: Select) -> list[tuple[int, int, str]]:
+        """
+        The steps of the query's plan, as (id, parent id, detail).
+        """
+        sql = query.compile(
+            dialect=sqlite.dialect(),
+            compile_kwargs={'literal_binds': True},
+        )
+        rows = self.await_(self.database.fetch_all(f'EXPLAIN QUERY PLAN {sql}'))
+        return [(x['id'], x['parent'], x['detail']) for x in rows]
+
+    def query_plan(self, query: Select) -> list[str]:
+        return [detail for _, _, detail in self.query_plan_steps(query)]
+
+    def assertNoTableScans(self, plan: list[str]) -> None:
+        for table in ('archive', 'choice_history'):
+            for step in plan:
+                if step.startswith(f'SCAN {table}'):
+                    self.assertIn('INDEX', step, f"Full table scan in {plan!r}")
+
+    def test_team_choice(self) -> None:
+        plan = self.query_plan(utils.team_choice_query('ABC'))
+
+        self.assertNoTableScans(plan)
+        self.assertTrue(
+            any('ix_archive_team_created' in x for x in plan),
+            msg=f"Team index not used in {plan!r}",
+        )
+        self.assertTrue(
+            any('ix_choice_history_archive_id_created' in x for x in plan),
+            msg=f"Choice index not used in {plan!r}",
+        )
+
+    def test_uploads(self) -> None:
+        for before in (None, 1234):
+            plan = self.query_plan(
+                utils.uploads_query('user', 'ABC', before=before, limit=20),
+            )
+
+            self.assertNoTableScans(plan)
+            self.assertTrue(
+                any('ix_archive_team_created' in x for x in plan),
+                msg=f"Team index not used in {plan!r}",
+            )
+            self.assertTrue(
+                any('ix_archive_username_created' in x for x in plan),
+                msg=f"Username index not used in {plan!r}",
+            )
+
+            # Each filter's page must be read in index order; only combining
+            # the pages may sort, which is bounded by the page size.
+            steps = self.query_plan_steps(
+                utils.uploads_query('user', 'ABC', before=before, limit=20),
+            )
+            pages = {
+                id_
+                for id_, _, detail in steps
+                if detail.startswith('CO-ROUTINE anon_')
+            }
+            self.assertEqual(2, len(pages), f"Unexpected plan {plan!r}")
+            # Parents are listed before their children
+            for id_, parent, _ in steps:
+                if parent in pages:
+                    pages.add(id_)
+
+            self.assertEqual(
+                [],
+                [d for id_, _, d in steps if id_ in pages and 'TEMP B-TREE' in d],
+                f"Ordering not provided by index in {plan!r}",
+            )
+            self.assertLessEqual(
+                {d for id_, _, d in steps if id_ not in pages and 'TEMP B-TREE' in d},
+                {'UNION USING TEMP B-TREE', 'USE TEMP B-TREE FOR ORDER BY'},
+                f"Unexpected sort in {plan!r}",
+            )
+
+    def test_chosen_submissions(self) -> None:
+        plan = self.query_plan(utils.chosen_submissions_query([
+            Archive.c.id,
+            ChoiceHistory.c.created,
+        ]))
+
+        self.assertNoTableScans(plan)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import re
+import zipfile
+import unittest
+
+from code_submitter.rules import (
+    RuleError,
+    ArchiveRules,
+    translate_glob,
+    DIRECTORY_ENTRY_SIZE,
+    RATIO_CHECK_MIN_SIZE,
+)
+
+
+def member(name: str, size: int = 10, compressed: int | None = None) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name)
+    info.file_size = size
+    info.compress_size = size if compressed is None else compressed
+    return info
+
+
+class TranslateGlobTests(unittest.TestCase):
+    def assertMatches(self, pattern: str, name: str) -> None:
+        self.assertIsNotNone(
+            re.fullmatch(translate_glob(pattern), name),
+            f"{pattern!r} should match {name!r}",
+        )
+
+    def assertNotMatches(self, pattern: str, name: str) -> None:
+        self.assertIsNone(
+            re.fullmatch(translate_glob(pattern), name),
+            f"{pattern!r} should not match {name!r}",
+        )
+
+    def test_literal(self) -> None:
+        self.assertMatches('robot.py', 'robot.py')
+        self.assertNotMatches('robot.py', 'robotxpy')
+        self.assertNotMatches('robot.py', 'code/robot.py')
+
+    def test_star(self) -> None:
+        self.assertMatches('*.py', 'robot.py')
+        self.assertNotMatches('*.py', 'code/robot.py')
+
+    def test_question_mark(self) -> None:
+        self.assertMatches('robot.p?', 'robot.py')
+        self.assertNotMatches('a?b', 'a/b')
+
+    def test_double_star(self) -> None:
+        self.assertMatches('**/*.pyc', 'robot.pyc')
+        self.assertMatches('**/*.pyc', 'a/b/robot.pyc')
+        self.assertMatches('.git/**', '.git/objects/ab')
+        self.assertNotMatches('.git/**', 'code/.git/config')
+
+
+class ArchiveRulesTests(unittest.TestCase):
+    def test_ok(self) -> None:
+        rules = ArchiveRules(
+            required_files=['robot.py', 'lib/*.py'],
+            forbidden_files=['**/*.pyc'],
+            max_members=3,
+            max_uncompressed_size=30,
+            max_compression_ratio=2,
+        )
+        errors = rules.check([
+            member('robot.py'),
+            member('lib/'),
+            member('lib/helper.py'),
+        ])
+        self.assertEqual([], errors)
+
+    def test_missing_required_file(self) -> None:
+        rules = ArchiveRules(required_files=['robot.py'])
+
+        error, found = rules.check([member('code/robot.py'), member('other.py')])
+
+        self.assertEqual('missing_file', error.reason)
+        self.assertIn("named exactly 'robot.py'", error.message)
+        self.assertIn(
+            "similar file at 'code/robot.py', perhaps you meant to include that "
+            "file at 'robot.py' rather than within 'code/'?",
+            error.message,
+        )
+        self.assertEqual(
+            RuleError(
+                'missing_file',
+                "Found the following files:\n code/robot.py\n other.py",
+            ),
+            found,
+        )
+
+    def test_missing_required_glob(self) -> None:
+        rules = ArchiveRules(required_files=['*.py'])
+
+        error, _ = rules.check([member('code/robot.py')])
+
+        self.assertIn("matching '*.py'", error.message)
+        self.assertIn("'code/robot.py'", error.message)
+
+    def test_overlapping_required_patterns(self) -> None:
+        rules = ArchiveRules(required_files=['**/*.py', 'robot.py'])
+
+        self.assertEqual([], rules.check([member('robot.py')]))
+
+        errors = rules.check([member('other.py')])
+        self.assertEqual(2, len(errors))
+        self.assertIn("exactly 'robot.py'", errors[0].message)
+
+    def test_directory_does_not_satisfy_required(self) -> None:
+        rules = ArchiveRules(required_files=['lib*'])
+
+        errors = rules.check([member('lib/')])
+
+        self.assertEqual(2, len(errors))
+
+    def test_forbidden(self) -> None:
+        rules = ArchiveRules(forbidden_files=['**/*.pyc', '.git/**'])
+
+        errors = rules.check([
+            member('robot.py'),
+            member('__pycache__/robot.pyc'),
+            member('.git/'),
+        ])
+
+        self.assertEqual(
+            [
+                RuleError(
+                    'forbidden_file',
+                    "ZIP file must not contain '__pycache__/robot.pyc' "
+                    "(matches '**/*.pyc').",
+                ),
+                RuleError(
+                    'forbidden_file',
+                    "ZIP file must not contain '.git/' (matches '.git/**').",
+                ),
+            ],
+            errors,
+        )
+
+    def test_max_members(self) -> None:
+        rules = ArchiveRules(max_members=2)
+
+        errors = rules.check([member(f'{x}.py') for x in range(3)])
+
+        self.assertEqual(
+            [
+                RuleError(
+                    'too_many_members',
+                    "ZIP file must contain no more than 2 files (found 3).",
+                ),
+            ],
+            errors,
+        )
+
+    def test_check_directory(self) -> None:
+        rules = ArchiveRules(max_members=2)
+
+        self.assertEqual([], rules.check_directory(2, 2 * DIRECTORY_ENTRY_SIZE))
+        self.assertEqual(
+            ['too_many_members'],
+            [x.reason for x in rules.check_directory(3, 100)],
+        )
+        self.assertEqual(
+            ['directory_size'],
+            [x.reason for x in rules.check_directory(1, 2 * DIRECTORY_ENTRY_SIZE + 1)],
+        )
+
+        self.assertEqual([], ArchiveRules().check_directory(10 ** 6, 10 ** 9))
+
+    def test_max_uncompressed_size(self) -> None:
+        rules = ArchiveRules(max_uncompressed_size=15)
+
+        self.assertEqual([], rules.check([member('a.py', 15)]))
+
+        errors = rules.check([member('a.py', 10), member('b.py', 10)])
+        self.assertEqual(1, len(errors))
+        self.assertEqual('uncompressed_size', errors[0].reason)
+        self.assertIn("found 20", errors[0].message)
+
+    def test_max_compression_ratio(self) -> None:
+        rules = ArchiveRules(max_compression_ratio=10)
+        size = RATIO_CHECK_MIN_SIZE
+
+        self.assertEqual(
+            [],
+            rules.check([member('ok.bin', size, size // 8)]),
+        )
+
+        errors = rules.check([
+            member('bomb.bin', size, size // 100),
+            member('other-bomb.bin', size, 0),
+        ])
+        self.assertEqual(
+            [
+                RuleError(
+                    'compression_ratio',
+                    "ZIP file member 'bomb.bin' is too highly compressed "
+                    "(must be at most 10:1).",
+                ),
+            ],
+            errors,
+        )
+
+    def test_compression_ratio_ignores_small_members(self) -> None:
+        rules = ArchiveRules(max_compression_ratio=10)
+
+        errors = rules.check([member('small.txt', RATIO_CHECK_MIN_SIZE - 1, 1)])
+
+        self.assertEqual([], errors)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import io
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from collections.abc import AsyncIterator
+
+import test_utils
+
+from code_submitter.storage import FileSystemBlobStore
+
+CONTENT = b'beeees'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+async def collect(iterator: AsyncIterator[bytes]) -> list[bytes]:
+    return [x async for x in iterator]
+
+
+class DatabaseBlobStoreTests(test_utils.InTransactionTestCase):
+    def test_put_get(self) -> None:
+        self.await_(self.blob_store.put(SHA256, io.BytesIO(CONTENT)))
+        self.assertEqual(CONTENT, self.await_(self.blob_store.get(SHA256)))
+
+    def test_put_existing(self) -> None:
+        self.await_(self.blob_store.put(SHA256, io.BytesIO(CONTENT)))
+        # Content is not re-read when already stored
+        self.await_(self.blob_store.put(SHA256, io.BytesIO(b'other')))
+        self.assertEqual(CONTENT, self.await_(self.blob_store.get(SHA256)))
+
+    def test_put_concurrently(self) -> None:
+        async def run() -> None:
+            # Both check for the content before either stores it
+            await asyncio.gather(*(
+                asyncio.ensure_future(self.blob_store.put(SHA256, io.BytesIO(CONTENT)))
+                for _ in range(2)
+            ))
+
+        self.await_(run())
+        self.assertEqual(CONTENT, self.await_(self.blob_store.get(SHA256)))
+
+    def test_contains(self) -> None:
+        self.assertFalse(self.await_(self.blob_store.contains(SHA256)))
+        self.await_(self.blob_store.put(SHA256, io.BytesIO(CONTENT)))
+        self.assertTrue(self.await_(self.blob_store.contains(SHA256)))
+
+    def test_get_missing(self) -> None:
+        with self.assertRaises(KeyError):
+            self.await_(self.blob_store.get(SHA256))
+
+    def test_stream(self) -> None:
+        self.await_(self.blob_store.put(SHA256, io.BytesIO(CONTENT)))
+
+        chunks = self.await_(collect(self.blob_store.stream(SHA256, chunk_size=4)))
+
+        self.assertEqual([b'beee', b'es'], chunks)
+
+    def test_stream_missing(self) -> None:
+        with self.assertRaises(KeyError):
+            self.await_(collect(self.blob_store.stream(SHA256)))
+
+    def test_no_local_path(self) -> None:
+        self.assertIsNone(self.blob_store.local_path(SHA256))
+
+
+class FileSystemBlobStoreTests(test_utils.DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.store = FileSystemBlobStore(self.database, path=self.root)
+
+    def test_put_get(self) -> None:
+        self.await_(self.store.put(SHA256, io.BytesIO(CONTENT)))
+
+        self.assertEqual(CONTENT, self.await_(self.store.get(SHA256)))
+        self.assertEqual(CONTENT, (self.root / SHA256[:2] / SHA256).read_bytes())
+        self.assertEqual(
+            [self.root / SHA256[:2] / SHA256],
+            [x for x in self.root.rglob('*') if x.is_file()],
+            "Should not leave temporary files behind",
+        )
+
+    def test_put_existing(self) -> None:
+        self.await_(self.store.put(SHA256, io.BytesIO(CONTENT)))
+        self.await_(self.store.put(SHA256, io.BytesIO(b'other')))
+        self.assertEqual(CONTENT, self.await_(self.store.get(SHA256)))
+
+    def test_contains(self) -> None:
+        self.assertFalse(self.await_(self.store.contains(SHA256)))
+        self.await_(self.store.put(SHA256, io.BytesIO(CONTENT)))
+        self.assertTrue(self.await_(self.store.contains(SHA256)))
+
+    def test_get_missing(self) -> None:
+        with self.assertRaises(KeyError):
+            self.await_(self.store.get(SHA256))
+
+    def test_stream(self) -> None:
+        self.await_(self.store.put(SHA256, io.BytesIO(CONTENT)))
+
+        chunks = self.await_(collect(self.store.stream(SHA256, chunk_size=4)))
+
+        self.assertEqual([b'beee', b'es'], chunks)
+
+    def test_stream_missing(self) -> None:
+        with self.assertRaises(KeyError):
+            self.await_(collect(self.store.stream(SHA256)))
+
+    def test_local_path(self) -> None:
+        self.assertEqual(
+            self.root / SHA256[:2] / SHA256,
+            self.store.local_path(SHA256),
+        )
+
+    def test_invalid_key(self) -> None:
+        with self.assertRaises(ValueError):
+            self.store.path('../../etc/passwd')
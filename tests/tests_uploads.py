@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import io
+import time
+import struct
+import asyncio
+import hashlib
+import zipfile
+from unittest import mock
+
+import httpx
+import test_utils
+from starlette.types import Message
+from starlette.requests import Request
+
+from code_submitter import uploads
+from code_submitter.rules import ArchiveRules
+
+ROBOT_RULES = ArchiveRules(required_files=['robot.py'])
+
+
+def make_archive(*names: str) -> bytes:
+    contents = io.BytesIO()
+    with zipfile.ZipFile(contents, mode='w') as zip_file:
+        for name in names:
+            zip_file.writestr(name, 'print("I am a robot")')
+    return contents.getvalue()
+
+
+def make_request(
+    *,
+    files: dict[str, tuple[str, bytes, str]] | None = None,
+    data: dict[str, str] | None = None,
+) -> Request:
+    request = httpx.Request(
+        'POST',
+        'http://testserver/upload',
+        files=files,
+        data=data,
+    )
+    body = request.read()
+
+    async def receive() -> Message:
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    return Request(
+        {
+            'type': 'http',
+            'method': 'POST',
+            'path': '/upload',
+            'headers': [(k.lower(), v) for k, v in request.headers.raw],
+        },
+        receive,
+    )
+
+
+class ParseFormTests(test_utils.AsyncTestCase):
+    def test_hashes_files(self) -> None:
+        # Larger than the parser spools in memory
+        content = b'bees' * 1024 * 1024
+        request = make_request(
+            files={'archive': ('robot.zip', content, 'application/zip')},
+            data={'description': 'bees'},
+        )
+
+        form = self.await_(uploads.parse_form(request, max_parts=5))
+        self.addCleanup(lambda: self.await_(form.close()))
+
+        archive = form['archive']
+        assert isinstance(archive, uploads.HashedUploadFile)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), archive.sha256)
+        self.assertEqual(len(content), archive.size)
+        self.assertEqual(content, archive.file.read())
+        self.assertEqual('bees', form['description'])
+
+    def test_not_multipart(self) -> None:
+        request = make_request(data={'archive': 'bees'})
+
+        form = self.await_(uploads.parse_form(request, max_parts=5))
+
+        self.assertEqual([], form.multi_items())
+
+
+class UploadedArchiveTests(test_utils.AsyncTestCase):
+    def parse(self, content: bytes) -> uploads.HashedUploadFile:
+        request = make_request(
+            files={'archive': ('robot.zip', content, 'application/zip')},
+        )
+        form = self.await_(uploads.parse_form(request, max_parts=5))
+        self.addCleanup(lambda: self.await_(form.close()))
+
+        archive = form['archive']
+        assert isinstance(archive, uploads.HashedUploadFile)
+        return archive
+
+    def test_uploaded_archive(self) -> None:
+        content = b'bees' * 1024
+        upload = self.parse(content)
+
+        with mock.patch.object(upload.file, 'read') as mock_read:
+            uploaded = uploads.uploaded_archive(upload, max_size=len(content))
+
+        # The content is not read or copied
+        mock_read.assert_not_called()
+        self.assertIs(upload.file, uploaded.file)
+        self.assertEqual(len(content), uploaded.size)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), uploaded.sha256)
+
+    def test_too_large(self) -> None:
+        content = b'bees' * 1024
+        upload = self.parse(content)
+
+        with self.assertRaises(uploads.ArchiveTooLarge):
+            uploads.uploaded_archive(upload, max_size=len(content) - 1)
+
+
+class ValidateArchiveTests(test_utils.AsyncTestCase):
+    def test_ok(self) -> None:
+        archive = make_archive('robot.py', 'lib/helper.py')
+        uploads.validate_archive(io.BytesIO(archive), ROBOT_RULES)
+
+    def test_not_a_zip(self) -> None:
+        with self.assertRaises(uploads.InvalidArchive):
+            uploads.validate_archive(io.BytesIO(b'should-be-a-zip'), ROBOT_RULES)
+
+    def test_missing_required_file_suggests_similar(self) -> None:
+        archive = make_archive('code/robot.py')
+
+        with self.assertRaises(uploads.BrokenRules) as e:
+            uploads.validate_archive(io.BytesIO(archive), ROBOT_RULES)
+
+        self.assertEqual('missing_file', e.exception.reason)
+        message = str(e.exception)
+        self.assertIn("'robot.py'", message)
+        self.assertIn("'code/robot.py'", message)
+
+    def test_deadline_passed(self) -> None:
+        archive = make_archive('robot.py')
+
+        with self.assertRaises(uploads.InspectionTimeout):
+            uploads.validate_archive(
+                io.BytesIO(archive),
+                ROBOT_RULES,
+                deadline=time.monotonic() - 1,
+            )
+
+    def test_many_members_rejected_before_parsing(self) -> None:
+        rules = ArchiveRules(max_members=100)
+        archive = make_archive(*(f'{x}.py' for x in range(20_000)))
+
+        with self.assertRaises(uploads.BrokenRules) as e:
+            uploads.validate_archive(
+                io.BytesIO(archive),
+                rules,
+                deadline=time.monotonic() + 0.05,
+            )
+
+        self.assertEqual('too_many_members', e.exception.reason)
+        self.assertIn("found 20000", str(e.exception))
+
+    def test_large_directory_rejected_before_parsing(self) -> None:
+        rules = ArchiveRules(max_members=1)
+        archive = make_archive(*(f'{"x" * 600}{x}.py' for x in range(3)))
+
+        # Understate the number of entries; the directory itself is parsed
+        # until its recorded size is exhausted.
+        end = archive.rindex(b'PK\x05\x06')
+        archive = (
+            archive[:end + 8] +
+            struct.pack('<2H', 1, 1) +
+            archive[end + 12:]
+        )
+
+        with self.assertRaises(uploads.BrokenRules) as e:
+            uploads.validate_archive(io.BytesIO(archive), rules)
+
+        self.assertEqual('directory_size', e.exception.reason)
+
+    def test_zip64_member_count(self) -> None:
+        rules = ArchiveRules(max_members=1)
+        archive = make_archive('robot.py', 'a.py', 'b.py')
+
+        # Move the counts into a ZIP64 end record, as for archives with too
+        # many members to record in the end record itself.
+        end = archive.rindex(b'PK\x05\x06')
+        _, _, _, _, entries, size, offset, _ = struct.unpack_from(
+            '<4s4H2LH',
+            archive,
+            end,
+        )
+        zip64 = struct.pack(
+            '<4sQ2H2L4Q',
+            b'PK\x06\x06',
+            44,  # Size of the rest of the record
+            45,  # Version made by
+            45,  # Version needed
+            0,  # This disk
+            0,  # Disk with the directory
+            entries,  # Entries on this disk
+            entries,  # Total entries
+            size,
+            offset,
+        )
+        locator = struct.pack('<4sLQL', b'PK\x06\x07', 0, end, 1)
+        end_record = struct.pack(
+            '<4s4H2LH',
+            b'PK\x05\x06',
+            0,
+            0,
+            0xFFFF,
+            0xFFFF,
+            size,
+            0xFFFFFFFF,
+            0,
+        )
+        archive = archive[:end] + zip64 + locator + end_record
+
+        with self.assertRaises(uploads.BrokenRules) as e:
+            uploads.validate_archive(io.BytesIO(archive), rules)
+
+        self.assertIn("found 3", str(e.exception))
+
+
+class SlowFile(io.BytesIO):
+    def __init__(self, content: bytes, delay: float) -> None:
+        super().__init__(content)
+        self.delay = delay
+
+        self.reading = 0
+
+    def read(self, size: int | None = -1) -> bytes:
+        self.reading += 1
+        try:
+            time.sleep(self.delay)
+            return super().read(size)
+        finally:
+            self.reading -= 1
+
+
+class ArchiveInspectorTests(test_utils.AsyncTestCase):
+    def test_ok(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=5)
+        archive = make_archive('robot.py')
+
+        self.await_(inspector.validate(io.BytesIO(archive), ROBOT_RULES))
+
+    def test_invalid(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=5)
+        archive = make_archive('code/robot.py')
+
+        with self.assertRaises(uploads.InvalidArchive) as e:
+            self.await_(inspector.validate(io.BytesIO(archive), ROBOT_RULES))
+
+        self.assertNotIsInstance(e.exception, uploads.InspectionTimeout)
+
+    def test_timeout(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=0.05)
+        archive = SlowFile(make_archive('robot.py'), delay=0.2)
+
+        with self.assertRaises(uploads.InspectionTimeout):
+            self.await_(inspector.validate(archive, ROBOT_RULES))
+
+    def test_timeout_waits_for_worker(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=0.05)
+        archive = SlowFile(make_archive('robot.py'), delay=0.2)
+
+        with self.assertRaises(uploads.InspectionTimeout):
+            self.await_(inspector.validate(archive, ROBOT_RULES))
+
+        # The caller is free to close the file
+        self.assertEqual(0, archive.reading)
+
+    def test_many_members_within_timeout(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=0.05)
+        rules = ArchiveRules(max_members=100)
+        archive = make_archive(*(f'{x}.py' for x in range(20_000)))
+
+        with self.assertRaises(uploads.BrokenRules):
+            self.await_(inspector.validate(io.BytesIO(archive), rules))
+
+    def test_does_not_block_event_loop(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=5)
+        archive = SlowFile(make_archive('robot.py'), delay=0.02)
+
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.001)
+                ticks += 1
+
+        async def run() -> None:
+            task = asyncio.ensure_future(ticker())
+            try:
+                await inspector.validate(archive, ROBOT_RULES)
+            finally:
+                task.cancel()
+
+        self.await_(run())
+
+        # The inspection sleeps for at least 0.1s in total; had it blocked
+        # the event loop the ticker would not have run.
+        self.assertGreater(ticks, 10)
+
+    def test_queued_time_counts_against_budget(self) -> None:
+        inspector = uploads.ArchiveInspector(max_workers=1, timeout=0.1)
+        slow = SlowFile(make_archive('robot.py'), delay=0.05)
+        fast = io.BytesIO(make_archive('robot.py'))
+
+        Result = uploads.ArchiveMetadata | BaseException
+
+        async def run() -> tuple[Result, Result]:
+            return await asyncio.gather(
+                inspector.validate(slow, ROBOT_RULES),
+                inspector.validate(fast, ROBOT_RULES),
+                return_exceptions=True,
+            )
+
+        slow_result, fast_result = self.await_(run())
+
+        self.assertIsInstance(slow_result, uploads.InspectionTimeout)
+        self.assertIsInstance(fast_result, uploads.InspectionTimeout)
+
+
+class UploadSlotsTests(test_utils.AsyncTestCase):
+    def test_limit(self) -> None:
+        slots = uploads.UploadSlots(2)
+
+        with slots.acquire(), slots.acquire():
+            self.assertEqual(2, slots.in_use)
+
+            with self.assertRaises(uploads.TooManyUploads):
+                with slots.acquire():
+                    pass  # pragma: no cover
+
+            self.assertEqual(2, slots.in_use)
+
+        self.assertEqual(0, slots.in_use)
+
+        with slots.acquire():
+            pass
+
+    def test_released_on_error(self) -> None:
+        slots = uploads.UploadSlots(1)
+
+        with self.assertRaises(ValueError):
+            with slots.acquire():
+                raise ValueError
+
+        self.assertEqual(0, slots.in_use)
+
+    def test_unlimited(self) -> None:
+        slots = uploads.UploadSlots(0)
+
+        with slots.acquire(), slots.acquire():
+            self.assertEqual(2, slots.in_use)
+
+
+class LimitRequestBodyTests(test_utils.AsyncTestCase):
+    def test_limit(self) -> None:
+        received = 0
+
+        async def receive() -> Message:
+            nonlocal received
+            received += 1
+            return {'type': 'http.request', 'body': b'1234', 'more_body': True}
+
+        limited = uploads.limit_request_body(receive, 10)
+
+        self.await_(limited())
+        self.await_(limited())
+
+        with self.assertRaises(uploads.RequestTooLarge):
+            self.await_(limited())
+
+        self.assertEqual(3, received)
+
+    def test_passes_other_messages(self) -> None:
+        async def receive() -> Message:
+            return {'type': 'http.disconnect'}
+
+        limited = uploads.limit_request_body(receive, 0)
+
+        self.assertEqual({'type': 'http.disconnect'}, self.await_(limited()))
@@ -1,46 +1,44 @@
 from __future__ import annotations
 
 import io
+import hashlib
 import zipfile
 import datetime
+from unittest import mock
 
 import test_utils
 
 from code_submitter import utils
-from code_submitter.tables import Archive, ChoiceHistory
+from code_submitter.tables import ChoiceHistory
 
 
 class UtilsTests(test_utils.InTransactionTestCase):
     def setUp(self) -> None:
         super().setUp()
 
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=8888888888,
-                content=b'8888888888',
-                username='someone_else',
-                team='ABC',
-                created=datetime.datetime(2020, 8, 8, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=2222222222,
-                content=b'2222222222',
-                username='a_colleague',
-                team='SRZ2',
-                created=datetime.datetime(2020, 2, 2, 12, 0),
-            ),
-        ))
-        self.await_(self.database.execute(
-            Archive.insert().values(
-                id=1111111111,
-                content=b'1111111111',
-                username='test_user',
-                team='SRZ2',
-                created=datetime.datetime(2020, 1, 1, 12, 0),
-            ),
-        ))
+        self.insert_archive(
+            id=8888888888,
+            content=b'8888888888',
+            username='someone_else',
+            team='ABC',
+            created=datetime.datetime(2020, 8, 8, 12, 0),
+            size=10,
+            member_count=3,
+        )
+        self.insert_archive(
+            id=2222222222,
+            content=b'2222222222',
+            username='a_colleague',
+            team='SRZ2',
+            created=datetime.datetime(2020, 2, 2, 12, 0),
+        )
+        self.insert_archive(
+            id=1111111111,
+            content=b'1111111111',
+            username='test_user',
+            team='SRZ2',
+            created=datetime.datetime(2020, 1, 1, 12, 0),
+        )
 
     def test_get_chosen_submissions_info_nothing_chosen(self) -> None:
         result = self.await_(utils.get_chosen_submissions_info(self.database))
@@ -76,21 +74,43 @@ class UtilsTests(test_utils.InTransactionTestCase):
                     team='SRZ2',
                     archive_id=1111111111,
                     chosen_at=datetime.datetime(2020, 3, 3, 12, 0),
+                    size=None,
+                    member_count=None,
                 ),
                 utils.SubmissionInfo(
                     team='ABC',
                     archive_id=8888888888,
                     chosen_at=datetime.datetime(2020, 8, 8, 12, 0),
+                    size=10,
+                    member_count=3,
                 ),
             ],
             result,
         )
 
-    def test_get_chosen_submissions_nothing_chosen(self) -> None:
-        result = self.await_(utils.get_chosen_submissions(self.database))
+    def test_team_choice_matches_chosen_archives_on_ties(self) -> None:
+        # The later choice wins, as it has the higher id
+        for archive_id in (1111111111, 2222222222):
+            self.await_(self.database.execute(
+                ChoiceHistory.insert().values(
+                    archive_id=archive_id,
+                    username='test_user',
+                    created=datetime.datetime(2020, 3, 3, 12, 0),
+                ),
+            ))
+
+        chosen = self.await_(self.database.fetch_one(utils.team_choice_query('SRZ2')))
+        archives = self.await_(utils.get_chosen_archives(self.database))
+
+        assert chosen is not None
+        self.assertEqual(2222222222, chosen['archive_id'])
+        self.assertEqual(2222222222, archives['SRZ2']['archive_id'])
+
+    def test_get_chosen_archives_nothing_chosen(self) -> None:
+        result = self.await_(utils.get_chosen_archives(self.database))
         self.assertEqual({}, result)
 
-    def test_get_chosen_submissions_multiple_chosen(self) -> None:
+    def test_get_chosen_archives_multiple_chosen(self) -> None:
         self.await_(self.database.execute(
             ChoiceHistory.insert().values(
                 archive_id=8888888888,
@@ -113,16 +133,59 @@ class UtilsTests(test_utils.InTransactionTestCase):
             ),
         ))
 
-        result = self.await_(utils.get_chosen_submissions(self.database))
+        result = self.await_(utils.get_chosen_archives(self.database))
         self.assertEqual(
             {
-                'SRZ2': (1111111111, b'1111111111'),
-                'ABC': (8888888888, b'8888888888'),
+                'SRZ2': utils.ChosenArchive(
+                    archive_id=1111111111,
+                    sha256=hashlib.sha256(b'1111111111').hexdigest(),
+                ),
+                'ABC': utils.ChosenArchive(
+                    archive_id=8888888888,
+                    sha256=hashlib.sha256(b'8888888888').hexdigest(),
+                ),
             },
             result,
         )
 
-    def test_collect_submissions(self) -> None:
+    def test_get_chosen_archives_reads_only_current_choices(self) -> None:
+        def choose(archive_id: int, day: int) -> None:
+            self.await_(self.database.execute(
+                ChoiceHistory.insert().values(
+                    archive_id=archive_id,
+                    username='test_user',
+                    created=datetime.datetime(2020, 3, day, 12, 0),
+                ),
+            ))
+
+        def rows_read() -> int:
+            with mock.patch.object(
+                self.database,
+                'fetch_all',
+                wraps=self.database.fetch_all,
+            ) as fetch_all:
+                self.await_(utils.get_chosen_archives(self.database))
+
+            return sum(
+                len(self.await_(self.database.fetch_all(*call.args)))
+                for call in fetch_all.call_args_list
+            )
+
+        choose(8888888888, 1)
+        choose(1111111111, 2)
+
+        self.assertEqual(2, rows_read())
+
+        for day in range(3, 28):
+            choose(2222222222 if day % 2 else 1111111111, day)
+
+        self.assertEqual(
+            2,
+            rows_read(),
+            "Size of choice history should not affect rows read",
+        )
+
+    def test_write_submissions(self) -> None:
         self.await_(self.database.execute(
             ChoiceHistory.insert().values(
                 archive_id=8888888888,
@@ -146,8 +209,42 @@ class UtilsTests(test_utils.InTransactionTestCase):
         ))
 
         with zipfile.ZipFile(io.BytesIO(), mode='w') as zf:
-            self.await_(utils.collect_submissions(self.database, zf))
+            archives = self.await_(utils.get_chosen_archives(self.database))
+            self.await_(utils.write_submissions(archives, self.blob_store, zf))
+
+            self.assertEqual(
+                {
+                    'summary.txt': b'ABC: 8888888888\nSRZ2: 1111111111\n',
+                    'SRZ2.zip': b'1111111111',
+                    'ABC.zip': b'8888888888',
+                },
+                {x: zf.open(x).read() for x in zf.namelist()},
+            )
+
+    def test_stream_bundle(self) -> None:
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=8888888888,
+                username='someone_else',
+                created=datetime.datetime(2020, 8, 8, 12, 0),
+            ),
+        ))
+        self.await_(self.database.execute(
+            ChoiceHistory.insert().values(
+                archive_id=1111111111,
+                username='test_user',
+                created=datetime.datetime(2020, 3, 3, 12, 0),
+            ),
+        ))
+
+        async def collect() -> list[bytes]:
+            archives = await utils.get_chosen_archives(self.database)
+            return [x async for x in utils.stream_bundle(archives, self.blob_store)]
+
+        chunks = self.await_(collect())
+        self.assertGreater(len(chunks), 1, "Should have streamed the output")
 
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
             self.assertEqual(
                 {
                     'summary.txt': b'ABC: 8888888888\nSRZ2: 1111111111\n',